@@ -0,0 +1,283 @@
+'''
+Process-wide Azure OpenAI client registry.
+
+Streamlit re-executes app.py on every interaction, but imported modules are loaded only once per
+process. Clients created here therefore survive reruns and are shared by every session: one HTTP
+connection pool (keep-alive, HTTP/2 when the `h2` package is installed), one requests/tokens per
+minute limiter, one cap on in-flight requests, and retries with jitter on 429/5xx that honour
+Retry-After.
+'''
+
+import os
+import json
+import time
+import random
+import logging
+import threading
+import importlib.util
+from email.utils import parsedate_to_datetime
+
+import httpx
+from openai import AzureOpenAI
+
+from context_manager import count_tokens
+
+logger = logging.getLogger(__name__)
+
+######################
+# Rate limiting
+######################
+
+# Responses worth retrying
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# Output tokens assumed when a request does not set max_tokens
+DEFAULT_OUTPUT_TOKENS = 256
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute buckets plus a cap on concurrent requests.
+
+    Both buckets refill continuously (limit / 60 per second), so a burst is spread over the
+    minute instead of draining the quota at once. A 429 pauses every request for its Retry-After,
+    and Azure's x-ratelimit-remaining-* headers pull the buckets down when the server sees less
+    quota than the local estimate. A limit of 0 disables that bucket.
+    """
+
+    def __init__(self, rpm: int = 0, tpm: int = 0, max_in_flight: int = 16):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.retries = 0
+        self.throttled = 0
+        self.waited = 0.0
+
+    def _reserve(self, tokens: int) -> float:
+        """Reserve quota for a request; return 0 on success or the seconds until there is quota."""
+        with self._lock:
+            now = time.monotonic()
+            elapsed, self._updated = now - self._updated, now
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+            if now < self._paused_until:
+                return self._paused_until - now
+
+            # A request larger than the whole minute's quota waits for a full bucket
+            tokens = min(tokens, self.tpm)
+            wait = 0.0
+            if self.rpm and self._requests < 1:
+                wait = (1 - self._requests) * 60 / self.rpm
+            if self.tpm and self._tokens < tokens:
+                wait = max(wait, (tokens - self._tokens) * 60 / self.tpm)
+            if wait:
+                return wait
+            if self.rpm:
+                self._requests -= 1
+            if self.tpm:
+                self._tokens -= tokens
+            self.sent += 1
+            return 0.0
+
+    def acquire(self, tokens: int):
+        start = time.monotonic()
+        while (wait := self._reserve(tokens)) > 0:
+            time.sleep(wait)
+        self._slots.acquire()
+        with self._lock:
+            self.waited += time.monotonic() - start
+
+    def release(self):
+        self._slots.release()
+
+    def count_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def pause(self, seconds: float):
+        """Hold every request back after a 429 instead of feeding the burst."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.throttled += 1
+
+    def sync(self, headers):
+        with self._lock:
+            for header, attribute, limit in (("x-ratelimit-remaining-requests", "_requests", self.rpm),
+                                             ("x-ratelimit-remaining-tokens", "_tokens", self.tpm)):
+                value = headers.get(header)
+                if limit and value is not None:
+                    try:
+                        setattr(self, attribute, min(getattr(self, attribute), float(value)))
+                    except ValueError:
+                        pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sent": self.sent, "retries": self.retries, "throttled": self.throttled, "waited": self.waited}
+
+
+def estimate_tokens(request: httpx.Request) -> int:
+    """Input tokens of a chat request plus its max output (Azure charges the quota for max_tokens)."""
+    try:
+        body = json.loads(request.content or b"{}")
+    except (ValueError, httpx.RequestNotRead):
+        return DEFAULT_OUTPUT_TOKENS
+    tokens = 0
+    for message in body.get("messages", []):
+        content = message.get("content") or ""
+        if not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False)
+        tokens += 3 + count_tokens(content)
+    output = body.get("max_tokens") or body.get("max_completion_tokens") or DEFAULT_OUTPUT_TOKENS
+    return tokens + int(output) * (body.get("n") or 1)
+
+
+def retry_delay(response, attempt: int, base: float = 0.5, maximum: float = 30.0) -> float:
+    """Retry-After (seconds, HTTP date or milliseconds) plus jitter, or jittered exponential backoff."""
+    headers = response.headers if response is not None else {}
+    delay = None
+    for header, scale in (("retry-after-ms", 1000), ("x-ms-retry-after-ms", 1000), ("retry-after", 1)):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            delay = float(value) / scale
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                continue
+        break
+    if delay is not None:
+        # Jitter keeps clients throttled at the same time from coming back together
+        return min(max(delay, 0.0), maximum) + random.uniform(0, 0.1 * delay + 0.05)
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+######################
+# HTTP transport
+######################
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """Response body that frees the in-flight slot when closed, including streamed replies."""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if self._release:
+                self._release, release = None, self._release
+                release()
+
+
+# HTTP/2 multiplexes requests over one connection; it needs the h2 package (httpx[http2])
+HTTP2 = os.getenv("AOAI_HTTP2", "true").lower() == "true" and importlib.util.find_spec("h2") is not None
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """httpx transport applying the limiter and the retries; the SDK must use max_retries=0."""
+
+    def __init__(self, limiter: RateLimiter, max_retries: int = 5, transport=None):
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self._transport = transport or httpx.HTTPTransport(
+            http2=HTTP2,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=120),
+        )
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        tokens = estimate_tokens(request)
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(tokens)
+            try:
+                response = self._transport.handle_request(request)
+            except (httpx.TimeoutException, httpx.NetworkError):
+                self.limiter.release()
+                if attempt == self.max_retries:
+                    raise
+                delay = retry_delay(None, attempt)
+            except BaseException:
+                self.limiter.release()
+                raise
+            else:
+                self.limiter.sync(response.headers)
+                if response.status_code not in RETRY_STATUS or attempt == self.max_retries:
+                    return httpx.Response(response.status_code, headers=response.headers,
+                                          stream=_ReleasingStream(response.stream, self.limiter.release),
+                                          extensions=response.extensions)
+                response.close()
+                self.limiter.release()
+                delay = retry_delay(response, attempt)
+                if response.status_code == 429:
+                    self.limiter.pause(delay)
+            logger.info("Retrying Azure OpenAI request in %.2fs (attempt %d).", delay, attempt + 1)
+            self.limiter.count_retry()
+            time.sleep(delay)
+
+    def close(self):
+        self._transport.close()
+
+######################
+# Registry
+######################
+
+_lock = threading.Lock()
+_limiter = None
+_http_client = None
+_clients = {}
+
+
+def get_limiter() -> RateLimiter:
+    """Shared limiter, configured by AOAI_RPM, AOAI_TPM (0 = no limit) and AOAI_MAX_IN_FLIGHT."""
+    global _limiter
+    with _lock:
+        if _limiter is None:
+            _limiter = RateLimiter(
+                rpm=int(os.getenv("AOAI_RPM", "0")),
+                tpm=int(os.getenv("AOAI_TPM", "0")),
+                max_in_flight=int(os.getenv("AOAI_MAX_IN_FLIGHT", "16")),
+            )
+        return _limiter
+
+
+def get_http_client() -> httpx.Client:
+    """Shared httpx client; AOAI_MAX_RETRIES and AOAI_TIMEOUT tune retries and the read timeout."""
+    global _http_client
+    limiter = get_limiter()
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(
+                transport=RateLimitedTransport(limiter, int(os.getenv("AOAI_MAX_RETRIES", "5"))),
+                timeout=httpx.Timeout(float(os.getenv("AOAI_TIMEOUT", "60")), connect=10.0),
+            )
+        return _http_client
+
+
+def get_client(endpoint: str, api_key: str, api_version: str, deployment: str = None) -> AzureOpenAI:
+    """Return the process-wide AzureOpenAI client for this endpoint and deployment."""
+    key = (endpoint, api_key, api_version, deployment)
+    client = _clients.get(key)
+    if client is None:
+        client = AzureOpenAI(
+            api_key=api_key,
+            azure_endpoint=endpoint,
+            api_version=api_version,
+            azure_deployment=deployment,
+            max_retries=0,
+            http_client=get_http_client(),
+        )
+        with _lock:
+            client = _clients.setdefault(key, client)
+    return client
@@ -9,7 +9,8 @@ References:
 import os
 import streamlit as st
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from aoai_clients import get_client
+from context_manager import ConversationContext
 
 # Load environment variables from .env file
 load_dotenv('.env')
@@ -26,12 +27,16 @@ AOAI_ENDPOINT = os.getenv(f"AOAI_ENDPOINT_{env_type}")
 AOAI_DEPLOYMENT_NAME = os.getenv(f"AOAI_DEPLOYMENT_NAME_{env_type}")
 AOAI_API_KEY = os.getenv(f"AOAI_API_KEY_{env_type}")
 
-# Initialize the Azure OpenAI client
-client = AzureOpenAI(
+# Prompt size limits: tokens sent per request and size of the summary of older turns
+CONTEXT_BUDGET_TOKENS = int(os.getenv("CONTEXT_BUDGET_TOKENS", "3000"))
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "400"))
+
+# Get the Azure OpenAI client; it is created once per process and reused across reruns and sessions
+client = get_client(
+    endpoint=AOAI_ENDPOINT,
     api_key=AOAI_API_KEY,
-    azure_endpoint=AOAI_ENDPOINT,
     api_version="2024-06-01",
-    azure_deployment=AOAI_DEPLOYMENT_NAME
+    deployment=AOAI_DEPLOYMENT_NAME,
 )
 
 ######################
@@ -49,6 +54,15 @@ if "azure_openai_model" not in st.session_state:
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+# The context keeps the rolling summary across reruns
+if "context" not in st.session_state:
+    st.session_state.context = ConversationContext(
+        client,
+        model=st.session_state["azure_openai_model"],
+        budget_tokens=CONTEXT_BUDGET_TOKENS,
+        summary_tokens=CONTEXT_SUMMARY_TOKENS,
+    )
+
 # Display chat messages from history on app rerun
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
@@ -67,10 +81,8 @@ if prompt := st.chat_input("Digite algo"):
     with st.chat_message("assistant"):
         stream = client.chat.completions.create(
             model=st.session_state["azure_openai_model"],
-            messages=[
-                {"role": m["role"], "content": m["content"]}
-                for m in st.session_state.messages
-            ],
+            # Summary of older turns plus the most recent ones, within the token budget
+            messages=st.session_state.context.build(st.session_state.messages),
             stream=True,
         )
         
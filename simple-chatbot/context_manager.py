@@ -0,0 +1,192 @@
+'''
+Token-budgeted conversation context for the chat app.
+
+The full history stays in st.session_state.messages for display; only a bounded window is sent
+to the model:
+
+    [system prompt] [summary of older turns] [most recent turns, verbatim]
+
+When the verbatim turns outgrow the budget, the oldest ones are folded into the summary by a
+background call to the model, so the user never waits for it. The system/summary prefix only
+changes when a fold completes, which keeps it byte-identical across turns and lets the
+provider-side prompt cache reuse it.
+'''
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+######################
+# Token counting
+######################
+
+# Encoding used by the gpt-4o family; tiktoken is optional
+ENCODING_NAME = "o200k_base"
+
+# Fixed per-message cost of the chat format (role and separators) and of priming the reply
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(ENCODING_NAME)
+                except Exception:
+                    # Without tiktoken (or its cached BPE file) fall back to ~4 characters per token
+                    _encoding = None
+                _encoding_loaded = True
+    return _encoding
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """Count the tokens of a text offline. Results are cached, so each message is encoded once."""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def message_tokens(message: dict) -> int:
+    return TOKENS_PER_MESSAGE + count_tokens(message["content"])
+
+######################
+# Conversation context
+######################
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Merge the previous summary with the new turns into a single updated summary. Keep facts, "
+    "names, numbers, decisions, the user's preferences and any open questions; drop small talk. "
+    "Write in the language of the conversation, in at most {max_tokens} tokens."
+)
+
+
+class ConversationContext:
+    """
+    Builds the messages sent to the model within a token budget.
+
+    :param client: AzureOpenAI client, also used to generate the summaries.
+    :param model: Model (deployment) used for the summaries.
+    :param system_prompt: Optional system message placed first in every request.
+    :param budget_tokens: Maximum prompt size sent to the model.
+    :param summary_tokens: Maximum size of the rolling summary.
+    :param keep_ratio: After a fold, the verbatim turns take at most this share of the budget,
+        so the next fold (and the next prefix change) is several turns away.
+    :param min_recent: Messages that are always sent verbatim, even above the budget.
+    """
+
+    def __init__(self, client, model: str, system_prompt: str = None, budget_tokens: int = 3000,
+                 summary_tokens: int = 400, keep_ratio: float = 0.5, min_recent: int = 2):
+        self.client = client
+        self.model = model
+        self.system_prompt = system_prompt
+        self.budget_tokens = budget_tokens
+        self.summary_tokens = summary_tokens
+        self.keep_ratio = keep_ratio
+        self.min_recent = min_recent
+
+        self.summary = ""
+        # Index of the first message not covered by the summary
+        self.summarized_until = 0
+        self._pending = None
+        self._pending_until = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="context-summary")
+
+        self.last_prompt_tokens = 0
+        self.summaries_made = 0
+        self.summary_errors = 0
+
+    def _prefix(self) -> list:
+        prefix = []
+        if self.system_prompt:
+            prefix.append({"role": "system", "content": self.system_prompt})
+        if self.summary:
+            prefix.append({"role": "system", "content": f"Summary of the earlier conversation:\n{self.summary}"})
+        return prefix
+
+    def _collect_summary(self):
+        """Adopt the summary computed in the background, if it is ready."""
+        if self._pending is None or not self._pending.done():
+            return
+        try:
+            self.summary = self._pending.result()
+            self.summarized_until = self._pending_until
+            self.summaries_made += 1
+        except Exception:
+            # The turns stay verbatim and a new fold is attempted on the next turn
+            self.summary_errors += 1
+        self._pending = None
+
+    def _summarize(self, previous: str, messages: list) -> str:
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT.format(max_tokens=self.summary_tokens)},
+                {"role": "user", "content": f"Previous summary:\n{previous or '(none)'}\n\nNew turns:\n{transcript}"},
+            ],
+            max_tokens=self.summary_tokens,
+            temperature=0,
+        )
+        return response.choices[0].message.content.strip()
+
+    def _schedule_fold(self, messages: list, start: int):
+        """Fold the oldest verbatim turns into the summary in the background."""
+        target = int(self.budget_tokens * self.keep_ratio)
+        total = sum(message_tokens(m) for m in messages[start:])
+        cut = start
+        while cut < len(messages) - self.min_recent and total > target:
+            total -= message_tokens(messages[cut])
+            cut += 1
+        # The verbatim window starts at a user turn
+        while cut < len(messages) - self.min_recent and messages[cut]["role"] != "user":
+            cut += 1
+        if cut > start:
+            self._pending_until = cut
+            self._pending = self._executor.submit(self._summarize, self.summary, list(messages[start:cut]))
+
+    def build(self, messages: list) -> list:
+        """
+        Return the messages to send for the current turn.
+
+        :param messages: Full, append-only conversation history ({"role", "content"} dicts).
+        :return: Prefix (system prompt and summary) followed by the most recent turns.
+        """
+        self._collect_summary()
+        prefix = self._prefix()
+        available = self.budget_tokens - TOKENS_PER_REPLY - sum(message_tokens(m) for m in prefix)
+
+        start = min(self.summarized_until, max(len(messages) - self.min_recent, 0))
+        recent = [{"role": m["role"], "content": m["content"]} for m in messages[start:]]
+        recent_tokens = sum(message_tokens(m) for m in recent)
+
+        if recent_tokens > available:
+            if self._pending is None:
+                self._schedule_fold(messages, start)
+            # While the summary is being written, the oldest turns are left out of the request
+            while len(recent) > self.min_recent and recent_tokens > available:
+                recent_tokens -= message_tokens(recent.pop(0))
+
+        result = prefix + recent
+        self.last_prompt_tokens = TOKENS_PER_REPLY + sum(message_tokens(m) for m in result)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "prompt_tokens": self.last_prompt_tokens,
+            "prefix_tokens": sum(message_tokens(m) for m in self._prefix()),
+            "summarized_messages": self.summarized_until,
+            "summaries": self.summaries_made,
+            "summary_errors": self.summary_errors,
+            "summary_pending": self._pending is not None,
+        }
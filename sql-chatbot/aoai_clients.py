@@ -0,0 +1,459 @@
+#---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+import importlib.util
+from email.utils import parsedate_to_datetime
+
+import httpx
+from openai import AzureOpenAI, AsyncAzureOpenAI
+
+from tokens import contar_tokens
+
+logger = logging.getLogger(__name__)
+
+#------------------------------------------------- 2.0 Limite de Taxa --------------------------------------------------
+
+# Respostas que valem nova tentativa
+STATUS_RETENTATIVA = {408, 409, 429, 500, 502, 503, 504}
+
+# Tokens de saída presumidos quando a requisição não informa max_tokens
+SAIDA_ESTIMADA = 256
+
+
+class LimitadorTaxa:
+    """
+    Limite de requisições e tokens por minuto e de requisições simultâneas, compartilhado pelo processo.
+
+    Requisições e tokens são dois token buckets que se recompõem continuamente (limite / 60 por
+    segundo), de modo que uma rajada é espalhada ao longo do minuto em vez de esgotar a cota de uma
+    vez. Um 429 pausa todas as requisições pelo Retry-After, e os cabeçalhos x-ratelimit-remaining-*
+    do Azure corrigem os buckets quando o servidor enxerga menos cota que a estimativa local.
+
+    :param rpm: Requisições por minuto (0 sem limite).
+    :param tpm: Tokens por minuto (0 sem limite).
+    :param max_simultaneas: Requisições em andamento ao mesmo tempo.
+    """
+
+    def __init__(self, rpm: int = 0, tpm: int = 0, max_simultaneas: int = 16):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_simultaneas = max_simultaneas
+        self._requisicoes = float(rpm)
+        self._tokens = float(tpm)
+        self._atualizado = time.monotonic()
+        self._pausa_ate = 0.0
+        self._semaforo = threading.BoundedSemaphore(max_simultaneas)
+        self._lock = threading.Lock()
+        self.requisicoes = 0
+        self.retentativas = 0
+        self.limitadas = 0
+        self.espera_total = 0.0
+
+    def _reservar(self, tokens: int) -> float:
+        """Reserva a cota da requisição; devolve 0 se reservou ou os segundos até haver cota."""
+        with self._lock:
+            agora = time.monotonic()
+            decorrido, self._atualizado = agora - self._atualizado, agora
+            self._requisicoes = min(self.rpm, self._requisicoes + decorrido * self.rpm / 60)
+            self._tokens = min(self.tpm, self._tokens + decorrido * self.tpm / 60)
+            if agora < self._pausa_ate:
+                return self._pausa_ate - agora
+
+            # Uma requisição maior que a cota do minuto inteiro espera o bucket encher
+            tokens = min(tokens, self.tpm)
+            espera = 0.0
+            if self.rpm and self._requisicoes < 1:
+                espera = (1 - self._requisicoes) * 60 / self.rpm
+            if self.tpm and self._tokens < tokens:
+                espera = max(espera, (tokens - self._tokens) * 60 / self.tpm)
+            if espera:
+                return espera
+            if self.rpm:
+                self._requisicoes -= 1
+            if self.tpm:
+                self._tokens -= tokens
+            self.requisicoes += 1
+            return 0.0
+
+    def _registrar_espera(self, espera: float):
+        with self._lock:
+            self.espera_total += espera
+
+    def adquirir(self, tokens: int):
+        """Aguarda cota e uma vaga entre as requisições simultâneas (bloqueante)."""
+        inicio = time.monotonic()
+        while (espera := self._reservar(tokens)) > 0:
+            time.sleep(espera)
+        self._semaforo.acquire()
+        self._registrar_espera(time.monotonic() - inicio)
+
+    async def aadquirir(self, tokens: int):
+        """Versão assíncrona de `adquirir`, que não bloqueia o event loop."""
+        inicio = time.monotonic()
+        while (espera := self._reservar(tokens)) > 0:
+            await asyncio.sleep(espera)
+        # O semáforo é compartilhado com as threads: tenta sem bloquear e cede o loop
+        while not self._semaforo.acquire(blocking=False):
+            await asyncio.sleep(0.005)
+        self._registrar_espera(time.monotonic() - inicio)
+
+    def liberar(self):
+        self._semaforo.release()
+
+    def registrar_retentativa(self):
+        with self._lock:
+            self.retentativas += 1
+
+    def pausar(self, segundos: float):
+        """Suspende todas as requisições (429): evita que as demais reforcem a rajada."""
+        with self._lock:
+            self._pausa_ate = max(self._pausa_ate, time.monotonic() + segundos)
+            self.limitadas += 1
+
+    def sincronizar(self, cabecalhos):
+        """Reduz os buckets à cota restante informada pelo servidor."""
+        with self._lock:
+            for cabecalho, atributo, limite in (("x-ratelimit-remaining-requests", "_requisicoes", self.rpm),
+                                                ("x-ratelimit-remaining-tokens", "_tokens", self.tpm)):
+                valor = cabecalhos.get(cabecalho)
+                if limite and valor is not None:
+                    try:
+                        setattr(self, atributo, min(getattr(self, atributo), float(valor)))
+                    except ValueError:
+                        pass
+
+    def estatisticas(self) -> dict:
+        """
+        Retorna os contadores do limitador.
+
+        :return: Dicionário com requisições, retentativas, respostas 429, espera total e cota disponível.
+        """
+        with self._lock:
+            return {
+                "requisicoes": self.requisicoes,
+                "retentativas": self.retentativas,
+                "limitadas": self.limitadas,
+                "espera_total": self.espera_total,
+                "requisicoes_disponiveis": self._requisicoes if self.rpm else None,
+                "tokens_disponiveis": self._tokens if self.tpm else None,
+            }
+
+
+def estimar_tokens(request: httpx.Request) -> int:
+    """
+    Estima os tokens de uma requisição de chat: mensagens de entrada mais a saída máxima.
+
+    O Azure desconta da cota o max_tokens pedido, por isso ele entra na estimativa.
+
+    :param request: Requisição HTTP para a API.
+    :return: Número de tokens.
+    """
+    try:
+        corpo = json.loads(request.content or b"{}")
+    except (ValueError, httpx.RequestNotRead):
+        return SAIDA_ESTIMADA
+    entrada = 0
+    for mensagem in corpo.get("messages", []):
+        conteudo = mensagem.get("content") or ""
+        if not isinstance(conteudo, str):
+            conteudo = json.dumps(conteudo, ensure_ascii=False)
+        entrada += 3 + contar_tokens(conteudo)
+    if isinstance(corpo.get("prompt"), str):
+        entrada += contar_tokens(corpo["prompt"])
+    saida = corpo.get("max_tokens") or corpo.get("max_completion_tokens") or SAIDA_ESTIMADA
+    return entrada + int(saida) * (corpo.get("n") or 1)
+
+
+def espera_retentativa(resposta, tentativa: int, base: float = 0.5, maximo: float = 30.0) -> float:
+    """
+    Tempo até a próxima tentativa.
+
+    Respeita Retry-After (segundos ou data HTTP) e retry-after-ms; sem eles, usa backoff exponencial.
+    O jitter aleatório impede que clientes limitados ao mesmo tempo voltem todos juntos.
+
+    :param resposta: Resposta com erro, ou None em falha de conexão.
+    :param tentativa: Número da tentativa que falhou (0 na primeira).
+    :param base: Espera da primeira tentativa sem Retry-After.
+    :param maximo: Espera máxima.
+    :return: Segundos de espera.
+    """
+    cabecalhos = resposta.headers if resposta is not None else {}
+    espera = None
+    for cabecalho, escala in (("retry-after-ms", 1000), ("x-ms-retry-after-ms", 1000), ("retry-after", 1)):
+        valor = cabecalhos.get(cabecalho)
+        if valor is None:
+            continue
+        try:
+            espera = float(valor) / escala
+        except ValueError:
+            try:
+                espera = parsedate_to_datetime(valor).timestamp() - time.time()
+            except (TypeError, ValueError):
+                continue
+        break
+    if espera is not None:
+        return min(max(espera, 0.0), maximo) + random.uniform(0, 0.1 * espera + 0.05)
+    # "Full jitter": uniforme entre 0 e o backoff exponencial
+    return random.uniform(0, min(maximo, base * 2 ** tentativa))
+
+#----------------------------------------------- 3.0 Transportes HTTP --------------------------------------------------
+
+class _FluxoSync(httpx.SyncByteStream):
+    """Corpo da resposta que devolve a vaga de concorrência ao ser fechado (inclusive em streaming)."""
+
+    def __init__(self, fluxo, liberar):
+        self._fluxo = fluxo
+        self._liberar = liberar
+
+    def __iter__(self):
+        yield from self._fluxo
+
+    def close(self):
+        try:
+            self._fluxo.close()
+        finally:
+            if self._liberar:
+                self._liberar, liberar = None, self._liberar
+                liberar()
+
+
+class _FluxoAsync(httpx.AsyncByteStream):
+    def __init__(self, fluxo, liberar):
+        self._fluxo = fluxo
+        self._liberar = liberar
+
+    async def __aiter__(self):
+        async for parte in self._fluxo:
+            yield parte
+
+    async def aclose(self):
+        try:
+            await self._fluxo.aclose()
+        finally:
+            if self._liberar:
+                self._liberar, liberar = None, self._liberar
+                liberar()
+
+
+def _limites_conexao() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(os.getenv("AOAI_MAX_CONEXOES", "64")),
+        max_keepalive_connections=int(os.getenv("AOAI_MAX_CONEXOES_OCIOSAS", "32")),
+        keepalive_expiry=float(os.getenv("AOAI_KEEPALIVE", "120")),
+    )
+
+
+# HTTP/2 multiplexa as requisições numa única conexão; depende do pacote h2 (httpx[http2])
+HTTP2 = os.getenv("AOAI_HTTP2", "true").lower() == "true" and importlib.util.find_spec("h2") is not None
+
+
+class TransporteLimitado(httpx.BaseTransport):
+    """
+    Transporte do httpx que aplica o `LimitadorTaxa` e as retentativas a cada requisição.
+
+    Fica abaixo do SDK da OpenAI (e do LangChain), que deve ser criado com max_retries=0 para
+    que as retentativas não se acumulem.
+    """
+
+    def __init__(self, limitador: LimitadorTaxa, max_tentativas: int = 5, transporte=None):
+        self.limitador = limitador
+        self.max_tentativas = max_tentativas
+        self._transporte = transporte or httpx.HTTPTransport(http2=HTTP2, limits=_limites_conexao())
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        tokens = estimar_tokens(request)
+        for tentativa in range(self.max_tentativas + 1):
+            self.limitador.adquirir(tokens)
+            try:
+                resposta = self._transporte.handle_request(request)
+            except (httpx.TimeoutException, httpx.NetworkError):
+                self.limitador.liberar()
+                if tentativa == self.max_tentativas:
+                    raise
+                espera = espera_retentativa(None, tentativa)
+            except BaseException:
+                self.limitador.liberar()
+                raise
+            else:
+                self.limitador.sincronizar(resposta.headers)
+                if resposta.status_code not in STATUS_RETENTATIVA or tentativa == self.max_tentativas:
+                    return httpx.Response(resposta.status_code, headers=resposta.headers,
+                                          stream=_FluxoSync(resposta.stream, self.limitador.liberar),
+                                          extensions=resposta.extensions)
+                resposta.close()
+                self.limitador.liberar()
+                espera = espera_retentativa(resposta, tentativa)
+                if resposta.status_code == 429:
+                    self.limitador.pausar(espera)
+            logger.info("Nova tentativa da requisição ao Azure OpenAI em %.2fs (tentativa %d).", espera, tentativa + 1)
+            self.limitador.registrar_retentativa()
+            time.sleep(espera)
+
+    def close(self):
+        self._transporte.close()
+
+
+class TransporteLimitadoAsync(httpx.AsyncBaseTransport):
+    """
+    Versão assíncrona de `TransporteLimitado`.
+
+    As conexões assíncronas pertencem ao event loop que as abriu; por isso há um pool por loop,
+    e o limitador (thread-safe) é o mesmo das requisições síncronas.
+    """
+
+    def __init__(self, limitador: LimitadorTaxa, max_tentativas: int = 5):
+        self.limitador = limitador
+        self.max_tentativas = max_tentativas
+        self._transportes = {}
+        self._lock = threading.Lock()
+
+    def _transporte(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            # Descarta os pools de loops já encerrados
+            for outro in [l for l in self._transportes if l.is_closed()]:
+                del self._transportes[outro]
+            if loop not in self._transportes:
+                self._transportes[loop] = httpx.AsyncHTTPTransport(http2=HTTP2, limits=_limites_conexao())
+            return self._transportes[loop]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        tokens = estimar_tokens(request)
+        transporte = self._transporte()
+        for tentativa in range(self.max_tentativas + 1):
+            await self.limitador.aadquirir(tokens)
+            try:
+                resposta = await transporte.handle_async_request(request)
+            except (httpx.TimeoutException, httpx.NetworkError):
+                self.limitador.liberar()
+                if tentativa == self.max_tentativas:
+                    raise
+                espera = espera_retentativa(None, tentativa)
+            except BaseException:
+                # Cancelamento (asyncio.CancelledError) também devolve a vaga
+                self.limitador.liberar()
+                raise
+            else:
+                self.limitador.sincronizar(resposta.headers)
+                if resposta.status_code not in STATUS_RETENTATIVA or tentativa == self.max_tentativas:
+                    return httpx.Response(resposta.status_code, headers=resposta.headers,
+                                          stream=_FluxoAsync(resposta.stream, self.limitador.liberar),
+                                          extensions=resposta.extensions)
+                await resposta.aclose()
+                self.limitador.liberar()
+                espera = espera_retentativa(resposta, tentativa)
+                if resposta.status_code == 429:
+                    self.limitador.pausar(espera)
+            logger.info("Nova tentativa da requisição ao Azure OpenAI em %.2fs (tentativa %d).", espera, tentativa + 1)
+            self.limitador.registrar_retentativa()
+            await asyncio.sleep(espera)
+
+    async def aclose(self):
+        for transporte in list(self._transportes.values()):
+            await transporte.aclose()
+
+#--------------------------------------------------- 4.0 Registro ------------------------------------------------------
+
+_lock = threading.Lock()
+_limitador = None
+_http_clients = {}
+_clientes = {}
+
+
+def obter_limitador() -> LimitadorTaxa:
+    """
+    Limitador único do processo, configurado pelas variáveis de ambiente.
+
+    - AOAI_RPM: requisições por minuto da implantação (padrão 0, sem limite).
+    - AOAI_TPM: tokens por minuto da implantação (padrão 0, sem limite).
+    - AOAI_MAX_SIMULTANEAS: requisições em andamento ao mesmo tempo (padrão 16).
+
+    :return: Instância compartilhada do limitador.
+    """
+    global _limitador
+    with _lock:
+        if _limitador is None:
+            _limitador = LimitadorTaxa(
+                rpm=int(os.getenv("AOAI_RPM", "0")),
+                tpm=int(os.getenv("AOAI_TPM", "0")),
+                max_simultaneas=int(os.getenv("AOAI_MAX_SIMULTANEAS", "16")),
+            )
+        return _limitador
+
+
+def obter_http_client(assincrono: bool = False):
+    """
+    Cliente httpx compartilhado (keep-alive, HTTP/2 quando disponível, limite e retentativas).
+
+    - AOAI_MAX_TENTATIVAS: novas tentativas em 429/5xx e falhas de conexão (padrão 5).
+    - AOAI_TIMEOUT: timeout de leitura em segundos (padrão 60).
+
+    :param assincrono: True para o httpx.AsyncClient.
+    :return: Cliente httpx.
+    """
+    limitador = obter_limitador()
+    with _lock:
+        if assincrono not in _http_clients:
+            tentativas = int(os.getenv("AOAI_MAX_TENTATIVAS", "5"))
+            timeout = httpx.Timeout(float(os.getenv("AOAI_TIMEOUT", "60")), connect=10.0)
+            if assincrono:
+                _http_clients[assincrono] = httpx.AsyncClient(
+                    transport=TransporteLimitadoAsync(limitador, tentativas), timeout=timeout)
+            else:
+                _http_clients[assincrono] = httpx.Client(
+                    transport=TransporteLimitado(limitador, tentativas), timeout=timeout)
+        return _http_clients[assincrono]
+
+
+def obter_cliente(endpoint: str, api_key: str, api_version: str, deployment: str = None, assincrono: bool = False):
+    """
+    Cliente AzureOpenAI do processo para o endpoint e a implantação.
+
+    Chamadas repetidas (e.g., a cada rerun do Streamlit) devolvem o mesmo cliente, com o mesmo
+    pool de conexões.
+
+    :param endpoint: Endpoint do Azure OpenAI.
+    :param api_key: Chave da API.
+    :param api_version: Versão da API.
+    :param deployment: Implantação (opcional).
+    :param assincrono: True para o AsyncAzureOpenAI.
+    :return: Cliente da OpenAI.
+    """
+    chave = (endpoint, api_key, api_version, deployment, assincrono)
+    cliente = _clientes.get(chave)
+    if cliente is None:
+        classe = AsyncAzureOpenAI if assincrono else AzureOpenAI
+        cliente = classe(
+            api_key=api_key,
+            azure_endpoint=endpoint,
+            api_version=api_version,
+            azure_deployment=deployment,
+            max_retries=0,
+            http_client=obter_http_client(assincrono),
+        )
+        with _lock:
+            cliente = _clientes.setdefault(chave, cliente)
+    return cliente
+
+
+def parametros_langchain() -> dict:
+    """Argumentos para o AzureChatOpenAI do LangChain usar os clientes httpx compartilhados."""
+    return {
+        "http_client": obter_http_client(),
+        "http_async_client": obter_http_client(assincrono=True),
+        "max_retries": 0,
+    }
+
+
+def estatisticas_clientes() -> dict:
+    """
+    Retorna os contadores do limitador e o número de clientes registrados.
+
+    :return: Dicionário com os contadores de `LimitadorTaxa.estatisticas`, clientes e HTTP/2.
+    """
+    return {**obter_limitador().estatisticas(), "clientes": len(_clientes), "http2": HTTP2}
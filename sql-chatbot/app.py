@@ -0,0 +1,158 @@
+#---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+import os
+import time
+
+import pandas as pd
+import streamlit as st
+
+from db_engine import estatisticas_pool
+
+#------------------------------------------------------ 2.0 Setup ------------------------------------------------------
+
+# Linhas por bloco na exibição progressiva: blocos pequenos mostram a primeira linha mais cedo
+APP_TAMANHO_BLOCO = int(os.getenv("APP_TAMANHO_BLOCO", "500"))
+# Linhas guardadas no histórico da sessão para cada resposta
+APP_MAX_LINHAS_HISTORICO = int(os.getenv("APP_MAX_LINHAS_HISTORICO", "1000"))
+
+MODOS = {
+    "Duas etapas (SQL em streaming)": "duas_etapas",
+    "Fundido (uma chamada ao LLM)": "fundido",
+    "Especulativo (candidatos SQL validados)": "especulativo",
+}
+
+
+@st.cache_resource(show_spinner="Conectando ao banco e carregando o modelo...")
+def carregar_backend():
+    """
+    Importa o backend e inicia o contexto da aplicação uma única vez por processo.
+
+    A conexão com o banco é verificada antes de tudo; em seguida engine, pool de conexões, chains,
+    caches e o cubo de agregados são criados de uma vez (`ContextoApp.iniciar`), para que a primeira
+    pergunta não pague a criação, e reaproveitados por todos os reruns e sessões do Streamlit.
+    """
+    import backend
+
+    saude = backend.contexto_app.verificar_saude()
+    if not saude["ok"]:
+        raise RuntimeError(f"Erro ao conectar ao banco de dados: {saude['erro']}")
+    backend.contexto_app.iniciar()
+    return backend
+
+
+backend = carregar_backend()
+
+#------------------------------------------------------ 3.0 Exibição ---------------------------------------------------
+
+def exibir_resposta(mensagem: dict):
+    """Exibe uma resposta do histórico: SQL, resultado e tempos."""
+    if mensagem.get("erro"):
+        st.error(mensagem["erro"])
+    if mensagem.get("sql"):
+        st.code(mensagem["sql"], language="sql")
+    if mensagem.get("resultado") is not None:
+        st.dataframe(mensagem["resultado"], width="stretch")
+    if mensagem.get("legenda"):
+        st.caption(mensagem["legenda"])
+
+
+def processar_pergunta(pergunta: str, modo: str) -> dict:
+    """
+    Executa o pipeline e atualiza a tela a cada evento de `backend.responder_em_etapas`.
+
+    O SQL é exibido enquanto o LLM o gera e a tabela é redesenhada a cada bloco de linhas.
+
+    :param pergunta: Pergunta do usuário.
+    :param modo: Modo do pipeline.
+    :return: Mensagem do assistente para o histórico.
+    """
+    inicio = time.perf_counter()
+    primeira_linha = None
+    sql_parcial = ""
+    blocos = []
+    mensagem = {"role": "assistant"}
+
+    status = st.status("Interpretando a pergunta...", expanded=True)
+    area_sql = st.empty()
+    area_tabela = st.empty()
+    area_legenda = st.empty()
+
+    for evento in backend.responder_em_etapas(pergunta, modo=modo, tamanho_bloco=APP_TAMANHO_BLOCO):
+        tipo = evento["tipo"]
+        if tipo == "intencao":
+            if not evento["intent_data"]:
+                status.update(label="Não foi possível interpretar a pergunta.", state="error")
+                mensagem["erro"] = "Não foi possível interpretar a pergunta. Tente reformulá-la."
+                break
+            status.write(f"Intenção: {evento['intent_data'].get('intencao', '')} ({evento['modo']})")
+            status.update(label="Gerando a query SQL...")
+        elif tipo == "sql_token":
+            sql_parcial += evento["texto"]
+            area_sql.code(sql_parcial, language="sql")
+        elif tipo == "query":
+            mensagem["sql"] = evento["sql"]
+            area_sql.code(evento["sql"], language="sql")
+            status.update(label="Executando a query...")
+        elif tipo == "bloco":
+            if "erro" in evento["df"].attrs:
+                mensagem["erro"] = f"Erro ao executar a query: {evento['df'].attrs['erro']}"
+                area_tabela.error(mensagem["erro"])
+                continue
+            blocos.append(evento["df"])
+            if primeira_linha is None:
+                primeira_linha = time.perf_counter() - inicio
+                status.update(label="Recebendo linhas...")
+            area_tabela.dataframe(pd.concat(blocos, ignore_index=True), width="stretch")
+            area_legenda.caption(f"{sum(len(b) for b in blocos)} linhas até agora...")
+        elif tipo == "fim":
+            resultado = evento["resultado"]
+            if "erro" not in resultado.attrs:
+                if not blocos:
+                    area_tabela.info("A query não retornou linhas.")
+                mensagem["resultado"] = resultado.head(APP_MAX_LINHAS_HISTORICO)
+
+    total = time.perf_counter() - inicio
+    if "erro" in mensagem:
+        status.update(label="Falha", state="error", expanded=False)
+    else:
+        status.update(label="Concluído", state="complete", expanded=False)
+    linhas = sum(len(b) for b in blocos)
+    mensagem["legenda"] = (
+        f"{linhas} linhas · primeira linha em {primeira_linha:.2f}s · total {total:.2f}s"
+        if primeira_linha is not None else f"total {total:.2f}s"
+    )
+    area_legenda.caption(mensagem["legenda"])
+    return mensagem
+
+#---------------------------------------------------- 4.0 Aplicação ----------------------------------------------------
+
+st.title("Chatbot SQL - Acidentes de Trânsito em Porto Alegre")
+
+with st.sidebar:
+    modo = MODOS[st.selectbox("Modo do pipeline", list(MODOS))]
+    with st.expander("Estatísticas"):
+        st.write("Templates SQL:", backend.template_store.estatisticas() if backend.template_store else "desativado")
+        st.write("Cache semântico:", backend.semantic_cache.estatisticas() if backend.semantic_cache else "desativado")
+        st.write("Cubo de agregados:", backend.cubo_agregados.estatisticas() if backend.cubo_agregados else "desativado")
+        st.write("Snapshot do schema:", backend.schema_snapshot.estatisticas() if backend.schema_snapshot else "desativado")
+        st.write("Pool de conexões:", estatisticas_pool(backend.engine))
+        st.write("Prompts:", {p.nome: p.estatisticas() for p in (backend.prompt_intencao, backend.prompt_query,
+                                                                 backend.prompt_fundido)})
+
+if "mensagens" not in st.session_state:
+    st.session_state.mensagens = []
+
+# Histórico da conversa
+for mensagem in st.session_state.mensagens:
+    with st.chat_message(mensagem["role"]):
+        if mensagem["role"] == "user":
+            st.markdown(mensagem["content"])
+        else:
+            exibir_resposta(mensagem)
+
+if pergunta := st.chat_input("Pergunte sobre os acidentes de trânsito"):
+    st.session_state.mensagens.append({"role": "user", "content": pergunta})
+    with st.chat_message("user"):
+        st.markdown(pergunta)
+
+    with st.chat_message("assistant"):
+        st.session_state.mensagens.append(processar_pergunta(pergunta, modo))
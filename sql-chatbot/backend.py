@@ -1,22 +1,35 @@
 
 #---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+from __future__ import annotations
+
 import os
 import re
+import time
+import atexit
+import logging
+import queue
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
-from langchain_openai  import AzureChatOpenAI
-from langchain.chains.llm import LLMChain
-from langchain.prompts import PromptTemplate
-
-import pyodbc
 import json
-import pandas as pd
-import urllib.parse
-from sqlalchemy import create_engine, text
-from sqlalchemy.exc import SQLAlchemyError
+
+# pandas, SQLAlchemy (e o pyodbc), LangChain e os clientes do Azure OpenAI são importados no primeiro
+# uso, dentro das funções e do ContextoApp: importar o backend não carrega nem conecta nada
+from llm_cache import criar_cache_llm, gerar_chave, normalizar_texto
+from schema_retrieval import obter_indice
+from telemetry import telemetria, span, callbacks_llm
+from sql_params import parametrizar, preparar, renderizar, instanciar, tipos_colunas, estatisticas_statements
+from query_log import criar_registro_queries
+from prompt_builder import PromptEstavel, schema_compacto
 
 #------------------------------------------------------ 2.0 Setup ------------------------------------------------------
 
+logger = logging.getLogger(__name__)
+
+# Só a configuração é lida na importação; os recursos são criados no primeiro uso (ver ContextoApp)
 load_dotenv('.env')
 # Define o tipo de ambiente (DEV, PROD, etc.)
 env_type = "DEV"
@@ -27,33 +40,50 @@ AOAI_DEPLOYMENT_NAME = os.getenv(f"AOAI_DEPLOYMENT_NAME_{env_type}")
 AOAI_API_KEY = os.getenv(f"AOAI_API_KEY_{env_type}")
 AIOAI_API_VERSION = os.getenv(f"AOAI_API_VERSION") 
 
-# Carregar configurações do Azure SQL Server a partir das variáveis de ambiente
-server = os.getenv(f"AZURE_SQL_SERVER_{env_type}")
-database = os.getenv(f"AZURE_SQL_DATABASE_{env_type}")
-username = os.getenv(f"AZURE_SQL_USERNAME_{env_type}")
-password = os.getenv(f"AZURE_SQL_PASSWORD_{env_type}")
-driver = os.getenv("SQL_DRIVER")
-
-# Construir a string de conexão ODBC
-odbc_str = (
-    f'DRIVER={{{driver}}};'
-    f'SERVER={server};'
-    f'DATABASE={database};'
-    f'UID={username};'
-    f'PWD={password};'
-    'Encrypt=yes;'
-    'TrustServerCertificate=no;'
-    'Connection Timeout=30;'
-)
+# Limites de concorrência do pipeline assíncrono
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+DB_MAX_CONCURRENCY = int(os.getenv("DB_MAX_CONCURRENCY", "8"))
+
+# Modo padrão do pipeline: "duas_etapas" (intenção + SQL), "fundido" (uma única chamada) ou
+# "especulativo" (intenção + vários candidatos SQL validados, executa o primeiro válido)
+MODO_DUAS_ETAPAS = "duas_etapas"
+MODO_FUNDIDO = "fundido"
+MODO_ESPECULATIVO = "especulativo"
+MODO_CACHE_SEMANTICO = "cache_semantico"
+PIPELINE_MODO = os.getenv("PIPELINE_MODO", MODO_DUAS_ETAPAS)
+
+# Modo especulativo: número de candidatos, temperatura dos candidatos extras e geração em uma
+# única chamada com n candidatos (SQL_CANDIDATOS_UMA_CHAMADA) em vez de chamadas paralelas
+SQL_CANDIDATOS = int(os.getenv("SQL_CANDIDATOS", "3"))
+SQL_CANDIDATOS_TEMPERATURA = float(os.getenv("SQL_CANDIDATOS_TEMPERATURA", "0.7"))
+SQL_CANDIDATOS_UMA_CHAMADA = os.getenv("SQL_CANDIDATOS_UMA_CHAMADA", "false").lower() == "true"
+
+# Lote de perguntas (responder_lote): perguntas nas etapas de LLM ao mesmo tempo e queries por
+# ida ao banco (no SQL Server, um único batch com um result set por query)
+LOTE_PARALELISMO = int(os.getenv("LOTE_PARALELISMO", "8"))
+LOTE_QUERIES_POR_IDA = int(os.getenv("LOTE_QUERIES_POR_IDA", "25"))
+# O SQL Server aceita no máximo 2100 parâmetros por chamada
+LOTE_MAX_PARAMETROS_IDA = 2000
 
-# URL-encode a string ODBC
-params = urllib.parse.quote_plus(odbc_str)
+# Seleção de schema: apenas as colunas mais relevantes entram nos prompts
+SCHEMA_TOP_K = int(os.getenv("SCHEMA_TOP_K", "12"))
+SCHEMA_MAX_TOKENS = int(os.getenv("SCHEMA_MAX_TOKENS", "1500"))
+SCHEMA_VETORIAL = os.getenv("SCHEMA_VETORIAL", "false").lower() == "true"
 
-# Construir a URL de conexão SQLAlchemy com pyodbc
-connection_string = f'mssql+pyodbc:///?odbc_connect={params}'
+# Cache de resultados das queries: limite em MB (0 desativa) e intervalo mínimo entre sondas de versão
+RESULT_CACHE_MAX_MB = float(os.getenv("RESULT_CACHE_MAX_MB", "256"))
+RESULT_CACHE_INTERVALO_VERSAO = float(os.getenv("RESULT_CACHE_INTERVALO_VERSAO", "30"))
 
-# Criar o engine do SQLAlchemy
-engine = create_engine(connection_string)
+# Execução em blocos: tamanho de cada bloco e limites de linhas/memória por requisição
+STREAM_TAMANHO_BLOCO = int(os.getenv("STREAM_TAMANHO_BLOCO", "5000"))
+STREAM_MAX_LINHAS = int(os.getenv("STREAM_MAX_LINHAS", "100000"))
+STREAM_MAX_MB = float(os.getenv("STREAM_MAX_MB", "64"))
+
+# Snapshot do schema: segundos entre as verificações de mudança no schema ou no número de linhas
+SCHEMA_SNAPSHOT_INTERVALO = float(os.getenv("SCHEMA_SNAPSHOT_INTERVALO", "3600"))
+
+# Logs detalhados das chains do LangChain (substituídos pelos spans de telemetry.py; TELEMETRIA=true)
+LANGCHAIN_VERBOSE = os.getenv("LANGCHAIN_VERBOSE", "false").lower() == "true"
 
 target_columns = ['data', 'feridos', 'longitude', 'latitude', 'tipo_acid', 'hora', 'regiao']
 
@@ -93,10 +123,23 @@ data_dictionary_filtered = {key: value for key, value in {
     "consorcio": "Consórcio responsável pelo(s) ônibus urbano(s) envolvido(s) no acidente"
 }.items() if key in target_columns}
 
-data_dictionary = {
+# Tipos das colunas, usados para converter os valores dos parâmetros das queries
+column_types = {
+    "data": "str",
+    "feridos": "int",
+    "longitude": "float",
+    "latitude": "float",
+    "tipo_acid": "str",
+    "hora": "str",
+    "regiao": "str",
+}
+
+# Dicionário de dados declarado; o do pipeline (contexto_app.data_dictionary) o combina ao snapshot do schema
+data_dictionary_base = {
     "tables": {
         "poa_acidentes_transito": {
-            "columns": data_dictionary_filtered
+            "columns": data_dictionary_filtered,
+            "types": column_types
         }
     }
 }
@@ -104,7 +147,10 @@ data_dictionary = {
 #---------------------------------------------------- 3.0 Verificação da Conexão -------------------------------------
 
 def verify_connection(engine):
-    """Verifica se a conexão com o banco de dados está funcionando."""
+    """Verifica se a conexão com o banco de dados está funcionando (ver também `ContextoApp.verificar_saude`)."""
+    from sqlalchemy import text
+    from sqlalchemy.exc import SQLAlchemyError
+
     try:
         with engine.connect() as connection:
             result = connection.execute(text("SELECT 1"))
@@ -134,6 +180,65 @@ def extrair_json(response: str) -> str:
         return response.strip()
     
 
+def contexto_schema(texto: str, data_dictionary: dict) -> dict:
+    """
+    Reduz o dicionário de dados às tabelas e colunas relevantes para o texto.
+
+    :param texto: Pergunta do usuário ou descrição da intenção.
+    :param data_dictionary: Dicionário de dados completo.
+    :return: Dicionário de dados limitado a SCHEMA_TOP_K colunas e SCHEMA_MAX_TOKENS tokens.
+    """
+    indice = obter_indice(data_dictionary, usar_vetores=SCHEMA_VETORIAL)
+    return indice.selecionar(texto, top_k=SCHEMA_TOP_K, max_tokens=SCHEMA_MAX_TOKENS)
+
+
+def _texto_intencao(intent_data: dict) -> str:
+    """Descreve a intenção (texto, entidades e valores) para a seleção de schema."""
+    entidades = intent_data.get("entidades", {})
+    partes = [str(intent_data.get("intencao", ""))]
+    partes += [f"{chave} {valor}" for chave, valor in entidades.items()]
+    return " ".join(partes)
+
+
+def _entradas_intencao(user_input: str, data_dictionary: dict) -> dict:
+    """
+    Monta as variáveis do prompt de intenção.
+
+    :param user_input: Entrada em linguagem natural do usuário.
+    :param data_dictionary: Dicionário de dados da base de dados.
+    :return: Dicionário com as variáveis de `intent_prompt`.
+    """
+    return {
+        "user_input": user_input,
+        "data_dictionary": schema_compacto(data_dictionary),
+    }
+
+
+def _decodificar_intencao(response: str, chave: str, em_cache: bool) -> dict:
+    """
+    Decodifica a resposta do LLM de intenção e a armazena no cache quando válida.
+
+    :param response: Resposta do modelo.
+    :param chave: Chave de cache da etapa de intenção.
+    :param em_cache: Indica se a resposta veio do cache.
+    :return: Dicionário contendo a intenção, entidades e ação.
+    """
+    with span("extrair_json") as s:
+        # Extrair o JSON da resposta
+        json_str = extrair_json(response)
+
+        try:
+            intent_data = json.loads(json_str)
+            # Apenas respostas válidas são armazenadas no cache
+            if not em_cache:
+                contexto_app.llm_cache.set(chave, response)
+            return intent_data
+        except json.JSONDecodeError as e:
+            s.set(erro=str(e))
+            logger.warning("Erro ao decodificar a resposta do LLM: %s. Resposta recebida: %s", e, response)
+            return {}
+
+
 def interpretar_intencao(user_input: str, data_dictionary: dict) -> dict:
     """
     Interpreta a intenção do usuário a partir da entrada em linguagem natural.
@@ -142,177 +247,1780 @@ def interpretar_intencao(user_input: str, data_dictionary: dict) -> dict:
     :param data_dictionary: Dicionário de dados da base de dados.
     :return: Dicionário contendo a intenção, entidades e ação.
     """
-    # Converter o dicionário de dados para string JSON formatada
-    data_dict_str = json.dumps(data_dictionary, ensure_ascii=False, indent=4)
-    
-    response = intent_chain.run({
-        "user_input": user_input,
-        "data_dictionary": data_dict_str
-    })
-    
-    # Extrair o JSON da resposta
-    json_str = extrair_json(response)
-    
-    try:
-        intent_data = json.loads(json_str)
-        return intent_data
-    except json.JSONDecodeError as e:
-        print("Erro ao decodificar a resposta do LLM:", e)
-        print("Resposta recebida:", response)
-        return {}
+    with span("interpretar_intencao") as s:
+        contexto = contexto_schema(user_input, data_dictionary)
+        chave = gerar_chave("intencao", normalizar_texto(user_input), contexto)
+        response = contexto_app.llm_cache.get(chave)
+        em_cache = response is not None
+        s.set(cache_hit=em_cache)
+
+        if not em_cache:
+            with span("renderizar_prompt") as s_prompt:
+                entradas = _entradas_intencao(user_input, contexto)
+                s_prompt.set(**prompt_intencao.medir(entradas))
+            with span("chamada_llm", chain="intencao") as s_llm:
+                response = contexto_app.intent_chain.run(entradas, callbacks=callbacks_llm(s_llm))
+
+        return _decodificar_intencao(response, chave, em_cache)
+
+
+def _entradas_query(intent_data: dict) -> dict:
+    """
+    Extrai da intenção os campos consumidos pelo prompt de geração de SQL.
+
+    :param intent_data: Dicionário contendo a intenção, entidades e ação.
+    :return: Dicionário com intenção, nomes das entidades e ação.
+    """
+    return {
+        "intencao": intent_data.get("intencao", ""),
+        "entidades": ", ".join(intent_data.get("entidades", {}).keys()),
+        "acao": intent_data.get("acao", "").upper(),
+    }
+
+
+def _chave_query(entradas: dict, data_dictionary: dict) -> str:
+    """Gera a chave de cache da etapa de geração de SQL."""
+    return gerar_chave(
+        "query",
+        [normalizar_texto(str(entradas["intencao"])), entradas["entidades"], entradas["acao"]],
+        data_dictionary,
+    )
+
+
+def _finalizar_query(query: str, intent_data: dict, data_dictionary: dict) -> tuple:
+    """
+    Converte os placeholders da query gerada em parâmetros vinculados.
+
+    :param query: Query SQL com placeholders.
+    :param intent_data: Dicionário contendo a intenção, entidades e ação.
+    :param data_dictionary: Dicionário de dados, com os tipos das colunas.
+    :return: Tupla (template, params) pronta para `executar_query`.
+    """
+    with span("parametrizar_query") as s:
+        entidades_valores = intent_data.get("entidades", {})
+        template, params = parametrizar(query, entidades_valores, tipos_colunas(data_dictionary))
+        s.set(parametros=len(params))
+
+    return template, params
+
+
+def _buscar_template(intent_data: dict, data_dictionary: dict):
+    """Instancia o template aprendido para a intenção, se houver um confiável."""
+    if contexto_app.template_store is None:
+        return None
+    with span("buscar_template"):
+        return contexto_app.template_store.buscar(intent_data, data_dictionary)
+
+
+def _resposta_semantica(user_input: str):
+    """
+    Busca no cache semântico uma pergunta equivalente já respondida.
+
+    :param user_input: Entrada em linguagem natural do usuário.
+    :return: Tupla (intent_data, query, params) ou None.
+    """
+    if contexto_app.semantic_cache is None:
+        return None
+    with span("cache_semantico") as s:
+        encontrada = contexto_app.semantic_cache.buscar(user_input)
+        s.set(cache_hit=encontrada is not None)
+    return _instanciar_semantica(encontrada)
+
+
+def _respostas_semanticas(perguntas: list) -> list:
+    """
+    Versão em lote de `_resposta_semantica`, com uma única busca no cache semântico.
+
+    :param perguntas: Lista de perguntas.
+    :return: Lista com a tupla (intent_data, query, params) ou None para cada pergunta.
+    """
+    if contexto_app.semantic_cache is None:
+        return [None] * len(perguntas)
+    with span("cache_semantico", perguntas=len(perguntas)) as s:
+        encontradas = contexto_app.semantic_cache.buscar_lote(perguntas)
+        s.set(cache_hits=sum(encontrada is not None for encontrada in encontradas))
+    return [_instanciar_semantica(encontrada) for encontrada in encontradas]
+
+
+def _instanciar_semantica(encontrada: dict):
+    """Instancia a query de uma resposta do cache semântico com as entidades da intenção."""
+    if encontrada is None:
+        return None
+    intent_data = encontrada["intent_data"]
+    tipos = tipos_colunas(contexto_app.data_dictionary)
+    instanciado = instanciar(encontrada["query"], intent_data.get("entidades", {}), tipos)
+    return (intent_data, *instanciado) if instanciado is not None else None
+
+
+def _registrar_execucao(user_input: str, intent_data: dict, query: str, params: dict, resultado: pd.DataFrame,
+                        modo: str):
+    """
+    Alimenta a biblioteca de templates, o cache semântico e o registro de queries com o resultado
+    da execução da query.
+    """
+    if not intent_data or not query:
+        return
+    sucesso = "erro" not in resultado.attrs
+    if contexto_app.registro_queries is not None:
+        contexto_app.registro_queries.registrar(query, params, sucesso, len(resultado))
+    if contexto_app.template_store is not None:
+        contexto_app.template_store.registrar(intent_data, contexto_app.data_dictionary, query, params, sucesso)
+    if contexto_app.semantic_cache is not None and sucesso and modo != MODO_CACHE_SEMANTICO:
+        contexto_app.semantic_cache.adicionar(user_input, intent_data, query)
+
+
+def gerar_query_parametrizada(intent_data: dict, data_dictionary: dict) -> tuple:
+    """
+    Gera uma query T-SQL com base na intenção do usuário, mantendo os valores das entidades como parâmetros.
+
+    Intenções com a mesma assinatura de uma query já executada com sucesso reutilizam o template
+    aprendido, sem chamar o LLM.
+
+    :param intent_data: Dicionário contendo a intenção, entidades e ação.
+    :param data_dictionary: Dicionário de dados da base de dados.
+    :return: Tupla (template, params) com a query parametrizada e os valores convertidos.
+    """
+    with span("gerar_query_sql") as s:
+        instanciado = _buscar_template(intent_data, data_dictionary)
+        s.set(template_hit=instanciado is not None)
+        if instanciado is not None:
+            return instanciado
+
+        contexto = contexto_schema(_texto_intencao(intent_data), data_dictionary)
+        entradas = _entradas_query(intent_data)
+        chave = _chave_query(entradas, contexto)
+        query = contexto_app.llm_cache.get(chave)
+        s.set(cache_hit=query is not None)
+
+        if query is None:
+            with span("renderizar_prompt") as s_prompt:
+                entradas["data_dictionary"] = schema_compacto(contexto)
+                s_prompt.set(**prompt_query.medir(entradas))
+
+            # Gerar a query usando a cadeia de geração
+            with span("chamada_llm", chain="query") as s_llm:
+                query = contexto_app.query_chain.run(entradas, callbacks=callbacks_llm(s_llm))
+            if query.strip():
+                contexto_app.llm_cache.set(chave, query)
+
+        return _finalizar_query(query, intent_data, data_dictionary)
 
 
 def gerar_query_sql(intent_data: dict, data_dictionary: dict) -> str:
     """
     Gera uma query T-SQL válida com base na intenção do usuário e no dicionário de dados.
 
+    Os valores são embutidos como literais; para executar, prefira `gerar_query_parametrizada`.
+
     :param intent_data: Dicionário contendo a intenção, entidades e ação.
     :param data_dictionary: Dicionário de dados da base de dados.
     :return: String contendo a query SQL gerada.
     """
-    intencao = intent_data.get("intencao", "")
-    entidades = ", ".join(intent_data.get("entidades", {}).keys())
-    acao = intent_data.get("acao", "").upper()
-    
-    # Converter o dicionário de dados para string JSON formatada
-    data_dict_str = json.dumps(data_dictionary, ensure_ascii=False, indent=4)
-    
-    # Gerar a query usando a cadeia de geração
-    query = query_chain.run({
-        "intencao": intencao,
-        "entidades": entidades,
-        "acao": acao,
-        "data_dictionary": data_dict_str
-    })
-    
-    # Substituir os placeholders na query com os valores reais
-    entidades_valores = intent_data.get("entidades", {})
-    query_substituida = substituir_placeholders(query, entidades_valores)
-    
-    return query_substituida.strip()
+    return renderizar(*gerar_query_parametrizada(intent_data, data_dictionary))
+
+
+def _preparar_candidatos(intent_data: dict, data_dictionary: dict) -> tuple:
+    """
+    Prepara a geração especulativa de SQL.
+
+    :return: Tupla (resolvido, chave, prompt); `resolvido` é o (template, params) de um template
+        aprendido ou do cache de LLM, caso em que não há candidatos a gerar.
+    """
+    instanciado = _buscar_template(intent_data, data_dictionary)
+    if instanciado is not None:
+        return instanciado, None, None
+    contexto = contexto_schema(_texto_intencao(intent_data), data_dictionary)
+    entradas = _entradas_query(intent_data)
+    chave = _chave_query(entradas, contexto)
+    query = contexto_app.llm_cache.get(chave)
+    if query is not None:
+        return _finalizar_query(query, intent_data, data_dictionary), chave, None
+    with span("renderizar_prompt") as s_prompt:
+        entradas["data_dictionary"] = schema_compacto(contexto)
+        s_prompt.set(**prompt_query.medir(entradas))
+        return None, chave, prompt_query.formatar(entradas)
+
+
+def _modelos_candidatos(n: int) -> list:
+    """O primeiro candidato usa a temperatura do llm_sql; os demais variam com SQL_CANDIDATOS_TEMPERATURA."""
+    variado = contexto_app.query_chain.llm.bind(temperature=SQL_CANDIDATOS_TEMPERATURA)
+    return [contexto_app.query_chain.llm] + [variado] * (n - 1)
+
+
+def _gerar_candidato(modelo, prompt: str) -> str:
+    """Gera um candidato; uma falha do LLM descarta só este candidato."""
+    with span("chamada_llm", chain="query", especulativo=True) as s_llm:
+        try:
+            return modelo.invoke(prompt, config={"callbacks": callbacks_llm(s_llm)}).content
+        except Exception as e:
+            s_llm.set(erro=str(e))
+            logger.warning("Falha ao gerar um candidato SQL: %s", e)
+            return ""
+
+
+class _Candidatos:
+    """Escolhe o primeiro candidato válido, na ordem de chegada, sem revalidar repetidos."""
 
-def executar_query(query: str, engine) -> pd.DataFrame:
+    def __init__(self, intent_data: dict, data_dictionary: dict):
+        self.intent_data = intent_data
+        self.data_dictionary = data_dictionary
+        self.primeiro = None
+        self.rejeitados = 0
+        self._vistos = set()
+
+    def avaliar(self, resposta: str):
+        """Devolve (template, params) se o candidato ainda não foi visto, senão None."""
+        candidato = _finalizar_query(resposta, self.intent_data, self.data_dictionary)
+        # Uma chamada que falhou devolve um candidato vazio; o fallback fica com o primeiro não vazio
+        if self.primeiro is None and candidato[0]:
+            self.primeiro = candidato
+        if candidato[0] in self._vistos:
+            return None
+        self._vistos.add(candidato[0])
+        return candidato
+
+    def rejeitar(self, candidato: tuple, motivo: str):
+        self.rejeitados += 1
+        logger.info("Candidato SQL rejeitado (%s): %s", motivo, candidato[0])
+
+    def fallback(self, n: int) -> tuple:
+        """Sem candidato válido, executa o primeiro: o erro chega ao usuário como no pipeline de duas etapas."""
+        logger.warning("Nenhum dos %d candidatos SQL passou na validação; executando o primeiro.", n)
+        return self.primeiro or ("", {})
+
+
+def gerar_query_especulativa(intent_data: dict, data_dictionary: dict, n: int = None) -> tuple:
+    """
+    Gera `n` candidatos SQL em paralelo e devolve o primeiro que passar na validação.
+
+    Cada candidato é validado assim que chega (sintaxe, colunas do dicionário de dados e compilação
+    no servidor, ver `sql_validation`); os que ainda não começaram são cancelados. Troca alguns tokens
+    a mais por menos respostas com erro e por uma cauda de latência menor que a de perguntar de novo.
+
+    :param intent_data: Dicionário contendo a intenção, entidades e ação.
+    :param data_dictionary: Dicionário de dados da base de dados.
+    :param n: Número de candidatos (padrão: SQL_CANDIDATOS).
+    :return: Tupla (template, params) com a query parametrizada e os valores convertidos.
+    """
+    n = n or SQL_CANDIDATOS
+    with span("gerar_query_especulativa", candidatos=n) as s:
+        resolvido, chave, prompt = _preparar_candidatos(intent_data, data_dictionary)
+        s.set(resolvido=resolvido is not None)
+        if resolvido is not None:
+            return resolvido
+
+        futuros = []
+        if SQL_CANDIDATOS_UMA_CHAMADA:
+            from langchain_core.messages import HumanMessage
+            with span("chamada_llm", chain="query", candidatos=n) as s_llm:
+                geracao = contexto_app.query_chain.llm.generate(
+                    [[HumanMessage(content=prompt)]], callbacks=callbacks_llm(s_llm), n=n
+                )
+            respostas = [g.text for g in geracao.generations[0]]
+        else:
+            # Cada thread recebe uma cópia do contexto, para os spans ficarem no trace da pergunta
+            futuros = [
+                llm_executor.submit(contextvars.copy_context().run, _gerar_candidato, modelo, prompt)
+                for modelo in _modelos_candidatos(n)
+            ]
+            respostas = (futuro.result() for futuro in as_completed(futuros))
+
+        candidatos = _Candidatos(intent_data, data_dictionary)
+        escolhido = None
+        try:
+            for resposta in respostas:
+                candidato = candidatos.avaliar(resposta)
+                if candidato is None:
+                    continue
+                motivo = contexto_app.validador_sql.validar(*candidato)
+                if not motivo:
+                    escolhido = candidato
+                    contexto_app.llm_cache.set(chave, resposta)
+                    break
+                candidatos.rejeitar(candidato, motivo)
+        finally:
+            for futuro in futuros:
+                futuro.cancel()
+        s.set(rejeitados=candidatos.rejeitados, valido=escolhido is not None)
+
+    return escolhido or candidatos.fallback(n)
+
+
+def _executar(connection, query: str, params: dict = None):
+    """Executa a query como texto puro (params=None) ou pelo statement preparado do template."""
+    if params is None:
+        return connection.exec_driver_sql(query)
+    return connection.execute(preparar(query, params), params)
+
+
+def _dataframe_erro(mensagem: str) -> pd.DataFrame:
+    """DataFrame vazio marcado com o erro, para diferenciar a falha de um resultado vazio (e.g., templates)."""
+    import pandas as pd
+
+    df = pd.DataFrame()
+    df.attrs["erro"] = mensagem
+    return df
+
+
+def _aplicar_guarda(query: str, params: dict, max_linhas: int = None) -> dict:
+    """
+    Passa a query pelo guarda de custo antes de ela chegar ao banco.
+
+    :return: Decisão do guarda (ver `GuardaSQL.avaliar`); sem guarda, a query original sem tempo limite.
+    """
+    if contexto_app.guarda_sql is None:
+        return {"acao": "executar", "query": query, "params": params, "timeout": None, "motivo": ""}
+    with span("guarda_sql") as s:
+        decisao = contexto_app.guarda_sql.avaliar(query, params, max_linhas)
+        s.set(acao=decisao["acao"], custo=decisao["custo"], fonte=decisao["fonte"])
+    if decisao["acao"] == "rejeitar":
+        logger.warning("%s Query: %s", decisao["motivo"], query)
+    elif decisao["acao"] == "rebaixar":
+        logger.info("Query acima do orçamento de custo (%.0f, %s); executando rebaixada.",
+                    decisao["custo"], decisao["fonte"])
+    return decisao
+
+
+def _limitar(query: str, max_linhas: int = None) -> str:
+    """Limite de linhas do guarda de custo, aplicado sem acessar o banco; sem guarda, a query original."""
+    if contexto_app.guarda_sql is None:
+        return query
+    return contexto_app.guarda_sql.limitar(query, max_linhas)
+
+
+def executar_query(query: str, engine, params: dict = None) -> pd.DataFrame:
     """
     Executa a query no banco de dados e retorna os resultados em um DataFrame.
+
+    O limite de linhas do guarda de custo vale para qualquer resposta, inclusive quando algum dos `roteadores_execucao` consegue respondê-la (e.g., agregações cobertas
+    pelo cubo de agregados ou o espelho colunar) sem ir ao banco. As demais passam pelo guarda, que
+    as reescreve, estima o custo e aplica o tempo limite, ou as rejeita.
     
-    :param query: Query SQL a ser executada.
+    :param query: Query SQL a ser executada (com parâmetros :nome quando `params` é informado).
     :param engine: Engine de conexão do SQLAlchemy.
+    :param params: Valores dos parâmetros vinculados; None executa a query como texto puro.
     :return: DataFrame contendo os resultados da query.
     """
+    import pandas as pd
+    from sql_guard import limite_tempo
+
+    with span("executar_query") as s:
+        # O limite de linhas vale também para as respostas locais e separa as chaves do cache
+        limitada = _limitar(query)
+        for roteador in contexto_app.roteadores_execucao:
+            with span("roteador", roteador=getattr(roteador, "__qualname__", str(roteador))) as s_rot:
+                df = roteador(limitada, params)
+                s_rot.set(roteado=df is not None)
+            if df is not None:
+                s.set(roteado=True, linhas=len(df))
+                return df
+
+        if contexto_app.result_cache is not None:
+            df = contexto_app.result_cache.get(limitada, params)
+            s.set(cache_hit=df is not None)
+            if df is not None:
+                s.set(linhas=len(df))
+                return df
+
+        decisao = _aplicar_guarda(query, params)
+        if decisao["acao"] == "rejeitar":
+            s.set(erro=decisao["motivo"])
+            return _dataframe_erro(decisao["motivo"])
+
+        try:
+            with span("execucao_sql"):
+                with engine.connect() as connection, limite_tempo(connection, decisao["timeout"]):
+                    result = _executar(connection, decisao["query"], decisao["params"])
+                    colunas = list(result.keys())
+                    rows = result.fetchall()
+            with span("montar_dataframe"):
+                df = pd.DataFrame.from_records(rows, columns=colunas, coerce_float=True)
+            s.set(linhas=len(df))
+            if contexto_app.result_cache is not None and decisao["acao"] != "rebaixar":
+                # Resultados em cache são devolvidos somente leitura; os rebaixados têm menos linhas
+                df = contexto_app.result_cache.set(limitada, params, df)
+            return df
+        except Exception as e:
+            s.set(erro=str(e))
+            logger.error("Erro ao executar a query: %s. Query executada: %s", e, decisao["query"])
+            return _dataframe_erro(str(e))
+
+
+def _compilar_posicional(engine, query: str, params: dict = None) -> tuple:
+    """
+    Compila a query para o dialeto do engine, com as listas já expandidas.
+
+    :return: Tupla (sql com marcadores posicionais, valores na ordem dos marcadores).
+    """
+    if params is None:
+        return query, []
+    usados = {nome: valor for nome, valor in params.items() if re.search(rf"(?<![\w:]):{nome}\b", query)}
+    compilado = preparar(query, params).bindparams(**usados).compile(
+        dialect=engine.dialect, compile_kwargs={"render_postcompile": True}
+    )
+    valores = compilado.construct_params()
+    return str(compilado), [valores[nome] for nome in compilado.positiontup]
+
+
+def _executar_batch(connection, consultas: list) -> list:
+    """
+    Executa as queries em um único batch T-SQL, lendo um result set por query com `nextset()`.
+
+    :param connection: Conexão do SQLAlchemy (SQL Server).
+    :param consultas: Lista de tuplas (query, params).
+    :return: Lista de DataFrames na ordem de `consultas`.
+    """
+    import pandas as pd
+
+    sqls, valores = [], []
+    for query, params in consultas:
+        sql, posicionais = _compilar_posicional(connection.engine, query, params)
+        sqls.append(sql.strip().rstrip(";"))
+        valores.extend(posicionais)
+
+    resultados = []
+    cursor = connection.connection.cursor()
+    try:
+        # NOCOUNT evita as mensagens de contagem de linhas entre os result sets
+        cursor.execute("SET NOCOUNT ON;\n" + ";\n".join(sqls), valores)
+        while True:
+            if cursor.description is not None:
+                colunas = [coluna[0] for coluna in cursor.description]
+                rows = [tuple(row) for row in cursor.fetchall()]
+                resultados.append(pd.DataFrame.from_records(rows, columns=colunas, coerce_float=True))
+            if not cursor.nextset():
+                break
+    finally:
+        cursor.close()
+    if len(resultados) != len(consultas):
+        raise RuntimeError(f"{len(resultados)} result sets para {len(consultas)} queries")
+    return resultados
+
+
+def _executar_ida(engine, consultas: list, timeout: float = None) -> list:
+    """
+    Executa um grupo de queries em uma única ida ao banco, com uma conexão do pool.
+
+    No SQL Server as queries seguem em um único batch (`_executar_batch`). Os demais dialetos não
+    aceitam vários statements por chamada, e as queries rodam em sequência na mesma conexão. Se o
+    batch falhar, as queries são repetidas uma a uma, para que o erro fique só na que o causou.
+
+    :param engine: Engine de conexão do SQLAlchemy.
+    :param consultas: Lista de tuplas (query, params).
+    :param timeout: Tempo limite do grupo.
+    :return: Lista de DataFrames na ordem de `consultas`; falhas vêm vazias com attrs["erro"].
+    """
+    import pandas as pd
+    from sql_guard import limite_tempo
+
+    with span("execucao_sql", queries=len(consultas)) as s:
+        try:
+            with engine.connect() as connection, limite_tempo(connection, timeout):
+                if engine.dialect.name == "mssql" and len(consultas) > 1:
+                    try:
+                        resultados = _executar_batch(connection, consultas)
+                        s.set(batch=True)
+                        return resultados
+                    except Exception as e:
+                        logger.warning("Falha no batch de %d queries (%s); executando uma a uma.", len(consultas), e)
+                        connection.rollback()
+
+                resultados = []
+                for query, params in consultas:
+                    try:
+                        result = _executar(connection, query, params)
+                        colunas = list(result.keys())
+                        resultados.append(pd.DataFrame.from_records(result.fetchall(), columns=colunas, coerce_float=True))
+                    except Exception as e:
+                        logger.error("Erro ao executar a query: %s. Query executada: %s", e, query)
+                        connection.rollback()
+                        resultados.append(_dataframe_erro(str(e)))
+                return resultados
+        except Exception as e:
+            s.set(erro=str(e))
+            logger.error("Erro ao executar o grupo de %d queries: %s", len(consultas), e)
+            return [_dataframe_erro(str(e)) for _ in consultas]
+
+
+def _num_parametros(params: dict) -> int:
+    """Número de marcadores da query depois da expansão das listas."""
+    return sum(len(valor) if isinstance(valor, list) else 1 for valor in (params or {}).values())
+
+
+def _planejar_idas(consultas: list, queries_por_ida: int = None) -> tuple:
+    """
+    Resolve as queries que não precisam do banco e agrupa as demais em idas.
+
+    Queries repetidas (mesmo SQL normalizado e parâmetros) são consideradas uma única vez. As que
+    os `roteadores_execucao` ou o cache de resultados respondem e as rejeitadas pelo guarda de
+    custo saem já resolvidas; as demais formam grupos de até `queries_por_ida` queries.
+
+    :param consultas: Lista de tuplas (query, params).
+    :param queries_por_ida: Máximo de queries por ida (padrão: LOTE_QUERIES_POR_IDA).
+    :return: Tupla (resolvidas, idas): dicionário chave -> DataFrame e lista de idas, cada uma
+             uma lista de tuplas (chave, query limitada, params, decisão do guarda).
+    """
+    from result_cache import chave_resultado
+
+    queries_por_ida = queries_por_ida or LOTE_QUERIES_POR_IDA
+    resolvidas, vistas = {}, set()
+    idas, ida, parametros = [], [], 0
+    for query, params in consultas:
+        chave = chave_resultado(query, params)
+        if chave in vistas:
+            continue
+        vistas.add(chave)
+
+        # Como em executar_query: o limite de linhas vale para as respostas locais e para o cache
+        limitada = _limitar(query)
+        roteadores = contexto_app.roteadores_execucao
+        df = next((df for df in (roteador(limitada, params) for roteador in roteadores) if df is not None), None)
+        if df is None and contexto_app.result_cache is not None:
+            df = contexto_app.result_cache.get(limitada, params)
+        if df is not None:
+            resolvidas[chave] = df
+            continue
+
+        decisao = _aplicar_guarda(query, params)
+        if decisao["acao"] == "rejeitar":
+            resolvidas[chave] = _dataframe_erro(decisao["motivo"])
+            continue
+
+        n = _num_parametros(decisao["params"])
+        if ida and (len(ida) >= queries_por_ida or parametros + n > LOTE_MAX_PARAMETROS_IDA):
+            idas.append(ida)
+            ida, parametros = [], 0
+        ida.append((chave, limitada, params, decisao))
+        parametros += n
+    if ida:
+        idas.append(ida)
+    return resolvidas, idas
+
+
+def _executar_planejada(engine, ida: list) -> list:
+    """Executa uma ida de `_planejar_idas`, com o maior tempo limite entre as suas queries."""
+    timeouts = [decisao["timeout"] for _, _, _, decisao in ida]
+    timeout = None if None in timeouts else max(timeouts)
+    return _executar_ida(engine, [(decisao["query"], decisao["params"]) for _, _, _, decisao in ida], timeout)
+
+
+def _concluir_ida(ida: list, dfs: list, resolvidas: dict):
+    """Guarda os resultados de uma ida em `resolvidas` e, os bem-sucedidos, no cache de resultados."""
+    for (chave, query, params, decisao), df in zip(ida, dfs):
+        if contexto_app.result_cache is not None and "erro" not in df.attrs and decisao["acao"] != "rebaixar":
+            df = contexto_app.result_cache.set(query, params, df)
+        resolvidas[chave] = df
+
+
+def executar_queries_em_lote(consultas: list, engine, queries_por_ida: int = None) -> list:
+    """
+    Executa várias queries no menor número possível de idas ao banco.
+
+    As queries são agrupadas por `_planejar_idas` e cada ida ocupa uma conexão do pool; as idas
+    rodam em paralelo em `db_executor` (até DB_MAX_CONCURRENCY ao mesmo tempo).
+
+    :param consultas: Lista de tuplas (query, params).
+    :param engine: Engine de conexão do SQLAlchemy.
+    :param queries_por_ida: Máximo de queries por ida (padrão: LOTE_QUERIES_POR_IDA).
+    :return: Lista de DataFrames na ordem de `consultas`; falhas vêm vazias com attrs["erro"].
+    """
+    from result_cache import chave_resultado
+
+    with span("executar_queries_em_lote", queries=len(consultas)) as s:
+        resolvidas, idas = _planejar_idas(consultas, queries_por_ida)
+        futuros = [
+            db_executor.submit(contextvars.copy_context().run, _executar_planejada, engine, ida) for ida in idas
+        ]
+        for ida, futuro in zip(idas, futuros):
+            _concluir_ida(ida, futuro.result(), resolvidas)
+        s.set(unicas=len(resolvidas), idas=len(idas))
+    return [resolvidas[chave_resultado(query, params)] for query, params in consultas]
+
+
+def _ler_blocos(query: str, params: dict, engine, tamanho_bloco: int, max_linhas: int, max_bytes: int,
+                timeout: float = None):
+    """
+    Lê o resultado da query bloco a bloco a partir do cursor, sem materializar tudo em memória.
+
+    A leitura é interrompida assim que `max_linhas` ou `max_bytes` são atingidos; as linhas
+    restantes não chegam a ser buscadas no servidor e o último bloco recebe attrs["truncado"].
+    """
+    import pandas as pd
+    from sql_guard import limite_tempo
+
+    linhas = 0
+    total_bytes = 0
     try:
-        df = pd.read_sql_query(query, engine)
-        return df
+        with engine.connect() as connection, limite_tempo(connection, timeout):
+            # Cursor no servidor quando o dialeto suportar; o pyodbc já busca as linhas sob demanda
+            result = _executar(connection.execution_options(stream_results=True), query, params)
+            colunas = list(result.keys())
+            try:
+                while linhas < max_linhas and total_bytes < max_bytes:
+                    rows = result.fetchmany(min(tamanho_bloco, max_linhas - linhas))
+                    if not rows:
+                        break
+                    df = pd.DataFrame.from_records(rows, columns=colunas)
+                    linhas += len(df)
+                    total_bytes += int(df.memory_usage(index=True, deep=True).sum())
+                    if linhas >= max_linhas or total_bytes >= max_bytes:
+                        # Último bloco lido: o resultado pode ter sido cortado no limite
+                        df.attrs["truncado"] = True
+                    yield df
+                else:
+                    logger.info("Leitura interrompida no limite de %d linhas / %d bytes.", linhas, total_bytes)
+                    cancelar = getattr(result.cursor, "cancel", None)
+                    if cancelar is not None:
+                        # Descarta no servidor as linhas ainda não lidas
+                        cancelar()
+            finally:
+                result.close()
     except Exception as e:
-        print("Erro ao executar a query:", e)
-        print("Query executada:", query)
-        return pd.DataFrame()
+        logger.error("Erro ao executar a query: %s. Query executada: %s", e, query)
+        # Bloco vazio marcado com o erro, como o DataFrame devolvido por executar_query
+        yield _dataframe_erro(str(e))
+
+
+def _antecipar(blocos, quantidade: int):
+    """
+    Consome o gerador de blocos em uma thread, mantendo até `quantidade` blocos prontos na fila.
+
+    Permite que o chamador processe o primeiro bloco enquanto os seguintes ainda estão chegando.
+    """
+    fila = queue.Queue(maxsize=quantidade)
+    parar = threading.Event()
+    fim = object()
+
+    def produzir():
+        try:
+            for bloco in blocos:
+                while not parar.is_set():
+                    try:
+                        fila.put(bloco, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if parar.is_set():
+                    break
+        finally:
+            blocos.close()
+            while not parar.is_set():
+                try:
+                    fila.put(fim, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+    threading.Thread(target=produzir, daemon=True, name="sql-blocos").start()
+    try:
+        while True:
+            bloco = fila.get()
+            if bloco is fim:
+                return
+            yield bloco
+    finally:
+        parar.set()
+
+
+def executar_query_em_blocos(query: str, engine, tamanho_bloco: int = None, max_linhas: int = None,
+                             max_mb: float = None, formato: str = "pandas", antecipar: int = 1,
+                             params: dict = None):
+    """
+    Executa a query e devolve os resultados em blocos, à medida que chegam do banco de dados.
+
+    :param query: Query SQL a ser executada.
+    :param engine: Engine de conexão do SQLAlchemy.
+    :param tamanho_bloco: Número de linhas por bloco (padrão: STREAM_TAMANHO_BLOCO).
+    :param max_linhas: Máximo de linhas lidas (padrão: STREAM_MAX_LINHAS).
+    :param max_mb: Máximo de memória lida em MB (padrão: STREAM_MAX_MB).
+    :param formato: "pandas" para DataFrames ou "arrow" para RecordBatches do PyArrow.
+    :param antecipar: Número de blocos buscados antecipadamente em segundo plano (0 desativa).
+    :param params: Valores dos parâmetros vinculados; None executa a query como texto puro.
+    :return: Gerador de blocos.
+    """
+    max_linhas = max_linhas or STREAM_MAX_LINHAS
+    decisao = _aplicar_guarda(query, params, max_linhas)
+    if decisao["acao"] == "rejeitar":
+        # Gerador, e não lista: _antecipar fecha os blocos ao terminar
+        blocos = (bloco for bloco in [_dataframe_erro(decisao["motivo"])])
+    else:
+        blocos = _ler_blocos(
+            decisao["query"],
+            decisao["params"],
+            engine,
+            tamanho_bloco or STREAM_TAMANHO_BLOCO,
+            max_linhas,
+            int((max_mb or STREAM_MAX_MB) * 1024 ** 2),
+            decisao["timeout"],
+        )
+    if antecipar > 0:
+        blocos = _antecipar(blocos, antecipar)
+
+    if formato == "arrow":
+        import pyarrow as pa
+        for bloco in blocos:
+            yield pa.RecordBatch.from_pandas(bloco, preserve_index=False)
+    else:
+        for bloco in blocos:
+            if decisao["acao"] == "rebaixar":
+                # A query rebaixada tem um limite de linhas menor que o pedido
+                bloco.attrs["truncado"] = True
+            yield bloco
 
 
 def substituir_placeholders(query: str, entidades: dict) -> str:
     """
     Substitui os placeholders na query pelos valores correspondentes em entidades.
 
+    Gera texto para exibição; a execução usa os parâmetros vinculados de `parametrizar`.
+
     :param query: A query SQL com placeholders (e.g., @ano).
     :param entidades: Dicionário contendo os valores para substituição.
     :return: Query SQL com os placeholders substituídos pelos valores reais.
     """
-    for chave, valor in entidades.items():
-        placeholder = f"@{chave}"
-        # Determinar se o valor é numérico ou string para adicionar aspas se necessário
-        if isinstance(valor, str):
-            valor_str = f"'{valor}'"
+    return renderizar(*parametrizar(query, entidades, column_types))
+
+
+def _decodificar_fundido(response: str):
+    """
+    Decodifica e valida a resposta do modo fundido (intenção + SQL em uma única chamada).
+
+    :param response: Resposta do modelo.
+    :return: Tupla (intent_data, query) ou None se a resposta for inválida.
+    """
+    try:
+        dados = json.loads(extrair_json(response))
+    except json.JSONDecodeError:
+        return None
+
+    if not isinstance(dados, dict):
+        return None
+    entidades = dados.get("entidades")
+    query = dados.get("query")
+    if not isinstance(entidades, dict) or not isinstance(query, str) or not dados.get("intencao"):
+        return None
+    if not re.match(r"\s*(SELECT|WITH)\b", query, re.IGNORECASE):
+        return None
+    # Todos os placeholders da query precisam ter um valor correspondente nas entidades
+    placeholders = set(re.findall(r"(?<!@)@(\w+)", query))
+    if not placeholders <= set(entidades):
+        return None
+
+    intent_data = {
+        "intencao": dados["intencao"],
+        "entidades": entidades,
+        "acao": dados.get("acao", "SELECT"),
+    }
+    return intent_data, query
+
+
+def interpretar_e_gerar_query(user_input: str, data_dictionary: dict) -> tuple:
+    """
+    Interpreta a intenção e gera a query T-SQL em uma única chamada ao LLM (modo fundido).
+
+    Se a resposta não puder ser decodificada ou validada, recorre ao pipeline de duas etapas.
+
+    :param user_input: Entrada em linguagem natural do usuário.
+    :param data_dictionary: Dicionário de dados da base de dados.
+    :return: Tupla (intent_data, query, params, modo efetivamente utilizado).
+    """
+    with span("interpretar_e_gerar_query") as s:
+        contexto = contexto_schema(user_input, data_dictionary)
+        chave = gerar_chave("fundido", normalizar_texto(user_input), contexto)
+        response = contexto_app.llm_cache.get(chave)
+        em_cache = response is not None
+        s.set(cache_hit=em_cache)
+
+        if not em_cache:
+            with span("renderizar_prompt") as s_prompt:
+                entradas = _entradas_intencao(user_input, contexto)
+                s_prompt.set(**prompt_fundido.medir(entradas))
+            with span("chamada_llm", chain="fundido") as s_llm:
+                response = contexto_app.fused_chain.run(entradas, callbacks=callbacks_llm(s_llm))
+
+        with span("extrair_json"):
+            decodificado = _decodificar_fundido(response)
+        s.set(valido=decodificado is not None)
+    if decodificado is None:
+        logger.warning("Resposta do modo fundido inválida; utilizando o pipeline de duas etapas.")
+        intent_data = interpretar_intencao(user_input, data_dictionary)
+        query, params = gerar_query_parametrizada(intent_data, data_dictionary) if intent_data else ("", {})
+        return intent_data, query, params, MODO_DUAS_ETAPAS
+
+    if not em_cache:
+        contexto_app.llm_cache.set(chave, response)
+    intent_data, query = decodificado
+    return (intent_data, *_finalizar_query(query, intent_data, data_dictionary), MODO_FUNDIDO)
+
+
+def _gerar_resposta(user_input: str, modo: str) -> tuple:
+    """
+    Interpreta a pergunta e gera a query no modo escolhido, sem consultar o cache semântico.
+
+    :param user_input: Entrada em linguagem natural do usuário.
+    :param modo: "duas_etapas", "fundido" ou "especulativo".
+    :return: Tupla (intent_data, query, params, modo efetivamente utilizado).
+    """
+    if modo == MODO_FUNDIDO:
+        return interpretar_e_gerar_query(user_input, contexto_app.data_dictionary)
+    intent_data = interpretar_intencao(user_input, contexto_app.data_dictionary)
+    if not intent_data:
+        return intent_data, "", {}, modo
+    gerar = gerar_query_especulativa if modo == MODO_ESPECULATIVO else gerar_query_parametrizada
+    return (intent_data, *gerar(intent_data, contexto_app.data_dictionary), modo)
+
+
+def responder(user_input: str, modo: str = None) -> dict:
+    """
+    Executa o pipeline completo (intenção, geração de SQL e execução).
+
+    Perguntas equivalentes a uma já respondida reutilizam a intenção e a query do cache semântico.
+
+    :param user_input: Entrada em linguagem natural do usuário.
+    :param modo: "duas_etapas", "fundido" ou "especulativo"; se omitido, usa PIPELINE_MODO.
+    :return: Dicionário com a intenção interpretada, a query gerada, seus parâmetros, o DataFrame de resultado e o modo utilizado.
+    """
+    import pandas as pd
+
+    modo = modo or PIPELINE_MODO
+    with span("responder") as s:
+        semantica = _resposta_semantica(user_input)
+        if semantica is not None:
+            intent_data, query, params = semantica
+            modo = MODO_CACHE_SEMANTICO
         else:
-            valor_str = str(valor)
-        query = query.replace(placeholder, valor_str)
-    return query
+            intent_data, query, params, modo = _gerar_resposta(user_input, modo)
+        resultado = executar_query(query, contexto_app.engine, params) if query else pd.DataFrame()
+        _registrar_execucao(user_input, intent_data, query, params, resultado, modo)
+        s.set(modo=modo, linhas=len(resultado))
+
+    return {
+        "intent_data": intent_data,
+        "query": query,
+        "params": params,
+        "resultado": resultado,
+        "modo": modo,
+    }
 
 
+def _gerar_query_em_tokens(intent_data: dict, data_dictionary: dict):
+    """
+    Gera a query parametrizada transmitindo os tokens do LLM à medida que chegam.
 
-#---------------------------------------------------- 4.0 Configuração do Modelo de Linguagem --------------------------
-# Verificar a conexão antes de prosseguir
-verify_connection(engine)
+    Templates aprendidos e respostas em cache não passam pelo LLM e não emitem tokens.
 
-# Configurar o modelo de chat OpenAI
-llm = AzureChatOpenAI(
-    temperature=0.7,
-    azure_endpoint=AOAI_ENDPOINT,
-    deployment_name=AOAI_DEPLOYMENT_NAME,
-    openai_api_version=AIOAI_API_VERSION,
-    openai_api_key=AOAI_API_KEY,
-)
+    :param intent_data: Dicionário contendo a intenção, entidades e ação.
+    :param data_dictionary: Dicionário de dados da base de dados.
+    :return: Gerador de tuplas ("token", texto) seguidas de ("query", (template, params)).
+    """
+    with span("gerar_query_sql") as s:
+        instanciado = _buscar_template(intent_data, data_dictionary)
+        s.set(template_hit=instanciado is not None)
+        if instanciado is None:
+            contexto = contexto_schema(_texto_intencao(intent_data), data_dictionary)
+            entradas = _entradas_query(intent_data)
+            chave = _chave_query(entradas, contexto)
+            query = contexto_app.llm_cache.get(chave)
+            s.set(cache_hit=query is not None)
+    if instanciado is not None:
+        yield "query", instanciado
+        return
 
-llm_sql = AzureChatOpenAI(
-    temperature=0.1,
-    azure_endpoint=AOAI_ENDPOINT,
-    deployment_name=AOAI_DEPLOYMENT_NAME,
-    openai_api_version=AIOAI_API_VERSION,
-    openai_api_key=AOAI_API_KEY,
-)
+    if query is None:
+        with span("renderizar_prompt") as s_prompt:
+            entradas["data_dictionary"] = schema_compacto(contexto)
+            s_prompt.set(**prompt_query.medir(entradas))
+            prompt = prompt_query.formatar(entradas)
+        partes = []
+        with span("chamada_llm", chain="query", streaming=True) as s_llm:
+            for parte in contexto_app.query_chain.llm.stream(prompt, config={"callbacks": callbacks_llm(s_llm)}):
+                partes.append(parte.content)
+                yield "token", parte.content
+        query = "".join(partes)
+        if query.strip():
+            contexto_app.llm_cache.set(chave, query)
 
+    yield "query", _finalizar_query(query, intent_data, data_dictionary)
 
-#---------------------------------------------------- 5.0 Configuração do SQLDatabase e SQLDatabaseChain ----------------
-intent_prompt = PromptTemplate(
-    input_variables=["user_input", "data_dictionary"],
-    template="""
-        Você é um assistente que interpreta a intenção do usuário para construir queries de banco de dados.
 
-        Aqui está o dicionário de dados da base de dados em formato JSON:
+def executar_query_progressiva(query: str, engine, params: dict = None, tamanho_bloco: int = None):
+    """
+    Executa a query devolvendo as linhas em blocos, para exibir as primeiras antes do fim da leitura.
+
+    Respostas dos `roteadores_execucao` e do cache de resultados chegam em um único bloco; as
+    demais são lidas do banco com `executar_query_em_blocos` e, se a leitura não parou em
+    STREAM_MAX_LINHAS ou STREAM_MAX_MB, entram no cache. A chave do cache é a query com o limite
+    de linhas da leitura em blocos, distinta da de `executar_query`, que tem o limite do guarda.
+
+    :param query: Query SQL a ser executada (com parâmetros :nome quando `params` é informado).
+    :param engine: Engine de conexão do SQLAlchemy.
+    :param params: Valores dos parâmetros vinculados.
+    :param tamanho_bloco: Número de linhas por bloco (padrão: STREAM_TAMANHO_BLOCO).
+    :return: Gerador de DataFrames; um bloco vazio com attrs["erro"] indica falha.
+    """
+    import pandas as pd
+
+    limitada = _limitar(query, STREAM_MAX_LINHAS)
+    for roteador in contexto_app.roteadores_execucao:
+        df = roteador(limitada, params)
+        if df is not None:
+            yield df
+            return
+    if contexto_app.result_cache is not None:
+        df = contexto_app.result_cache.get(limitada, params)
+        if df is not None:
+            yield df
+            return
+
+    blocos = []
+    for bloco in executar_query_em_blocos(query, engine, tamanho_bloco=tamanho_bloco, params=params):
+        blocos.append(bloco)
+        yield bloco
+    completo = not any("erro" in b.attrs or "truncado" in b.attrs for b in blocos)
+    if contexto_app.result_cache is not None and blocos and completo:
+        contexto_app.result_cache.set(limitada, params, pd.concat(blocos, ignore_index=True))
+
+
+def responder_em_etapas(user_input: str, modo: str = None, tamanho_bloco: int = None):
+    """
+    Executa o pipeline completo emitindo eventos à medida que cada etapa avança.
+
+    Para interfaces interativas: o SQL aparece enquanto é gerado e as primeiras linhas antes
+    de o banco terminar de enviar o resultado. Eventos (dicionários com a chave "tipo"):
+
+    - "intencao": intent_data interpretada (ou recuperada do cache semântico) e o modo;
+    - "sql_token": trecho da query recebido do LLM;
+    - "query": template, params e o SQL renderizado para exibição;
+    - "bloco": DataFrame com o próximo bloco de linhas;
+    - "fim": o mesmo dicionário devolvido por `responder`.
+
+    :param user_input: Entrada em linguagem natural do usuário.
+    :param modo: "duas_etapas", "fundido" ou "especulativo"; se omitido, usa PIPELINE_MODO.
+    :param tamanho_bloco: Número de linhas por bloco do resultado.
+    :return: Gerador de eventos.
+    """
+    import pandas as pd
+
+    modo = modo or PIPELINE_MODO
+    query, params = "", {}
+    semantica = _resposta_semantica(user_input)
+    if semantica is not None:
+        intent_data, query, params = semantica
+        modo = MODO_CACHE_SEMANTICO
+    elif modo == MODO_FUNDIDO:
+        intent_data, query, params, modo = interpretar_e_gerar_query(user_input, contexto_app.data_dictionary)
+    else:
+        intent_data = interpretar_intencao(user_input, contexto_app.data_dictionary)
+    yield {"tipo": "intencao", "intent_data": intent_data, "modo": modo}
+
+    if modo == MODO_DUAS_ETAPAS and intent_data and not query:
+        for tipo, valor in _gerar_query_em_tokens(intent_data, contexto_app.data_dictionary):
+            if tipo == "token":
+                yield {"tipo": "sql_token", "texto": valor}
+            else:
+                query, params = valor
+    elif modo == MODO_ESPECULATIVO and intent_data:
+        # Os candidatos são validados antes de exibidos; não há tokens a transmitir
+        query, params = gerar_query_especulativa(intent_data, contexto_app.data_dictionary)
+    yield {"tipo": "query", "query": query, "params": params, "sql": renderizar(query, params) if query else ""}
+
+    blocos = []
+    if query:
+        with span("executar_query_progressiva"):
+            for bloco in executar_query_progressiva(query, contexto_app.engine, params, tamanho_bloco):
+                blocos.append(bloco)
+                yield {"tipo": "bloco", "df": bloco}
+    resultado = pd.concat(blocos, ignore_index=True) if len(blocos) > 1 else (blocos[0] if blocos else pd.DataFrame())
+    erros = [b.attrs["erro"] for b in blocos if "erro" in b.attrs]
+    if erros:
+        resultado.attrs["erro"] = erros[0]
+    _registrar_execucao(user_input, intent_data, query, params, resultado, modo)
+
+    yield {
+        "tipo": "fim",
+        "intent_data": intent_data,
+        "query": query,
+        "params": params,
+        "resultado": resultado,
+        "modo": modo,
+    }
+
+
+def _agrupar_perguntas(perguntas: list) -> tuple:
+    """
+    Elimina as perguntas repetidas (após normalização).
+
+    :return: Tupla (únicas, índices): perguntas únicas e, para cada pergunta, a posição da sua única.
+    """
+    posicoes, unicas, indices = {}, [], []
+    for pergunta in perguntas:
+        chave = normalizar_texto(pergunta)
+        if chave not in posicoes:
+            posicoes[chave] = len(unicas)
+            unicas.append(pergunta)
+        indices.append(posicoes[chave])
+    return unicas, indices
+
+
+def _consultas_do_lote(geracoes: list) -> list:
+    """Queries (query, params) das gerações bem-sucedidas de um lote."""
+    return [(g[1], g[2]) for g in geracoes if not isinstance(g, BaseException) and g[1]]
+
+
+def _concluir_lote(perguntas: list, unicas: list, indices: list, geracoes: list, resultados: list) -> list:
+    """
+    Monta as respostas de um lote na ordem das perguntas, com o erro de cada item.
+
+    :param geracoes: Para cada pergunta única, a tupla (intent_data, query, params, modo) ou a exceção da geração.
+    :param resultados: DataFrames na ordem de `_consultas_do_lote(geracoes)`.
+    """
+    import pandas as pd
+
+    resultados = iter(resultados)
+    respostas = []
+    for pergunta, geracao in zip(unicas, geracoes):
+        if isinstance(geracao, BaseException):
+            logger.error("Falha ao gerar a query da pergunta %r: %s", pergunta, geracao)
+            respostas.append({"intent_data": {}, "query": "", "params": {}, "resultado": pd.DataFrame(),
+                              "modo": None, "erro": f"Falha ao gerar a query: {geracao}"})
+            continue
+        intent_data, query, params, modo = geracao
+        resultado = next(resultados) if query else pd.DataFrame()
+        if not intent_data:
+            erro = "Não foi possível interpretar a pergunta."
+        elif not query:
+            erro = "Não foi possível gerar a query."
+        else:
+            erro = resultado.attrs.get("erro")
+        _registrar_execucao(pergunta, intent_data, query, params, resultado, modo)
+        respostas.append({"intent_data": intent_data, "query": query, "params": params, "resultado": resultado,
+                          "modo": modo, "erro": erro})
+    return [{"pergunta": pergunta, **respostas[i]} for pergunta, i in zip(perguntas, indices)]
+
+
+def responder_lote(perguntas: list, modo: str = None, paralelismo: int = None) -> list:
+    """
+    Responde uma lista de perguntas de uma vez, para cargas em lote (e.g., relatórios noturnos).
+
+    - perguntas idênticas (após normalização) são processadas uma única vez;
+    - o cache semântico é consultado com uma única busca para todo o lote;
+    - as etapas de LLM rodam em paralelo, até `paralelismo` perguntas ao mesmo tempo;
+    - as queries são agrupadas em poucas idas ao banco por `executar_queries_em_lote`.
+
+    Uma falha afeta apenas a própria pergunta: a resposta traz a mensagem em "erro".
+
+    :param perguntas: Lista de perguntas em linguagem natural.
+    :param modo: "duas_etapas", "fundido" ou "especulativo"; se omitido, usa PIPELINE_MODO.
+    :param paralelismo: Perguntas nas etapas de LLM ao mesmo tempo (padrão: LOTE_PARALELISMO).
+    :return: Lista na ordem de `perguntas` com os dicionários de `responder`, acrescidos da
+             pergunta e do erro ("pergunta" e "erro", None quando a pergunta foi respondida).
+    """
+    modo = modo or PIPELINE_MODO
+    with span("responder_lote", perguntas=len(perguntas)) as s:
+        unicas, indices = _agrupar_perguntas(perguntas)
+        semanticas = _respostas_semanticas(unicas)
+
+        # Pool próprio do lote: o modo especulativo usa llm_executor dentro de cada pergunta
+        with ThreadPoolExecutor(max_workers=paralelismo or LOTE_PARALELISMO, thread_name_prefix="lote") as executor:
+            futuros = [
+                executor.submit(contextvars.copy_context().run, _gerar_resposta, pergunta, modo)
+                for pergunta, semantica in zip(unicas, semanticas) if semantica is None
+            ]
+        geradas = iter(futuro.exception() or futuro.result() for futuro in futuros)
+        geracoes = [
+            (*semantica, MODO_CACHE_SEMANTICO) if semantica is not None else next(geradas) for semantica in semanticas
+        ]
+
+        resultados = executar_queries_em_lote(_consultas_do_lote(geracoes), contexto_app.engine)
+        s.set(unicas=len(unicas))
+    return _concluir_lote(perguntas, unicas, indices, geracoes, resultados)
+
+
+
+#---------------------------------------------- 4.0 Contexto da Aplicação ----------------------------------------------
+
+class sob_demanda:
+    """
+    Recurso do ContextoApp criado no primeiro acesso e reaproveitado nos seguintes.
+
+    A criação roda sob o lock do contexto, uma única vez mesmo com várias threads; depois o valor
+    fica no __dict__ da instância e é lido sem lock. Atribuir o atributo substitui o recurso (e.g.,
+    o benchmark troca as chains antes de o modelo do Azure OpenAI ser criado).
+    """
+
+    def __init__(self, criar):
+        self.criar = criar
+        self.nome = criar.__name__
+        self.__doc__ = criar.__doc__
+
+    def __get__(self, contexto, tipo=None):
+        if contexto is None:
+            return self
+        with contexto._lock:
+            if self.nome not in contexto.__dict__:
+                contexto.__dict__[self.nome] = self.criar(contexto)
+        return contexto.__dict__[self.nome]
+
+
+class ContextoApp:
+    """
+    Engine, caches, schema, validação, modelos e chains do backend, criados no primeiro uso.
+
+    Importar o backend apenas lê a configuração: nenhum recurso é criado, nenhuma biblioteca pesada
+    é importada e nenhuma conexão é aberta. Cada recurso nasce quando uma função do pipeline o usa
+    pela primeira vez; `iniciar` cria todos de uma vez, para servidores que preferem pagar o custo
+    na inicialização. A conexão com o banco é verificada em `verificar_saude`.
+
+    Os recursos também são lidos como atributos do módulo (e.g., `backend.engine`, ver `__getattr__`).
+    """
+
+    def __init__(self):
+        # Reentrante: um recurso pode criar outros (e.g., o cache de resultados cria o engine)
+        self._lock = threading.RLock()
+
+    @classmethod
+    def recursos(cls) -> list:
+        """Nomes dos recursos criados sob demanda."""
+        return [nome for nome, valor in vars(cls).items() if isinstance(valor, sob_demanda)]
+
+    def criados(self) -> list:
+        """Nomes dos recursos já criados."""
+        return [nome for nome in self.recursos() if nome in self.__dict__]
+
+    def iniciar(self) -> "ContextoApp":
+        """Cria todos os recursos, para que a primeira pergunta não pague a criação."""
+        for nome in self.recursos():
+            getattr(self, nome)
+        return self
+
+    def verificar_saude(self) -> dict:
+        """
+        Verifica a conexão com o banco de dados (antes feita na importação do módulo).
+
+        Executa um SELECT 1, mede a latência e abre as conexões do pool antecipadamente
+        (SQL_POOL_AQUECER). O LLM não é chamado: apenas a presença da configuração é conferida.
+
+        :return: Dicionário com "ok", a latência do banco em ms, as conexões aquecidas, o erro da
+                 conexão (None se ok), se o Azure OpenAI está configurado e os recursos já criados.
+        """
+        from sqlalchemy import text
+        from db_engine import aquecer_pool
+
+        saude = {"ok": False, "latencia_banco_ms": None, "conexoes_aquecidas": 0, "erro": None}
+        with span("verificar_saude") as s:
+            try:
+                inicio = time.perf_counter()
+                with self.engine.connect() as connection:
+                    connection.execute(text("SELECT 1")).fetchone()
+                saude["latencia_banco_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+                saude["conexoes_aquecidas"] = aquecer_pool(self.engine)
+                saude["ok"] = True
+            except Exception as e:
+                saude["erro"] = str(e)
+                logger.error("Erro ao conectar ao banco de dados: %s", e)
+            s.set(ok=saude["ok"])
+        saude["llm_configurado"] = all([AOAI_ENDPOINT, AOAI_DEPLOYMENT_NAME, AOAI_API_KEY, AIOAI_API_VERSION])
+        saude["recursos"] = self.criados()
+        return saude
+
+    @sob_demanda
+    def engine(self):
+        """Engine do SQLAlchemy, compartilhado e com pool configurável (ver db_engine.py)."""
+        from db_engine import obter_engine
+        return obter_engine(env_type)
+
+    @sob_demanda
+    def llm_cache(self):
+        """Cache das respostas das etapas de LLM (intenção e geração de SQL)."""
+        return criar_cache_llm()
+
+    @sob_demanda
+    def result_cache(self):
+        """Cache dos resultados das queries, invalidado quando a versão das tabelas muda."""
+        if RESULT_CACHE_MAX_MB <= 0:
+            return None
+        from result_cache import CacheResultados
+        return CacheResultados(
+            self.engine,
+            max_bytes=int(RESULT_CACHE_MAX_MB * 1024 ** 2),
+            intervalo_versao=RESULT_CACHE_INTERVALO_VERSAO,
+        )
+
+    @sob_demanda
+    def registro_queries(self):
+        """Registro das queries executadas (SQL_LOG): carga de trabalho lida pelo schema_optimizer.py."""
+        return criar_registro_queries()
+
+    @sob_demanda
+    def template_store(self):
+        """Templates SQL aprendidos por assinatura de intenção; evitam a chamada ao LLM de geração de SQL."""
+        from sql_templates import criar_repositorio_templates
+        template_store = criar_repositorio_templates()
+        if template_store is not None and template_store.caminho:
+            atexit.register(template_store.salvar)
+        return template_store
+
+    @sob_demanda
+    def semantic_cache(self):
+        """Perguntas equivalentes já respondidas (paráfrases); evitam as duas chamadas ao LLM."""
+        from semantic_cache import criar_cache_semantico
+        semantic_cache = criar_cache_semantico()
+        if semantic_cache is not None and semantic_cache.caminho:
+            atexit.register(semantic_cache.salvar)
+        return semantic_cache
+
+    @sob_demanda
+    def schema_snapshot(self):
+        """
+        Snapshot do schema (SCHEMA_SNAPSHOT): tipos reais, valores das colunas categóricas e faixas das
+        numéricas e de data, lido do disco; conferido em segundo plano e só refeito quando o schema ou
+        o número de linhas muda.
+        """
+        from schema_snapshot import criar_snapshot
+        schema_snapshot = criar_snapshot(self.engine, data_dictionary_base)
+        if schema_snapshot is not None:
+            schema_snapshot.ao_atualizar(self._ao_atualizar_schema)
+            schema_snapshot.iniciar_atualizacao(SCHEMA_SNAPSHOT_INTERVALO)
+        return schema_snapshot
+
+    @sob_demanda
+    def data_dictionary(self):
+        """Dicionário de dados do pipeline: `data_dictionary_base` combinado ao snapshot do schema, já indexado."""
+        data_dictionary = data_dictionary_base
+        if self.schema_snapshot is not None:
+            data_dictionary = self.schema_snapshot.data_dictionary
+        obter_indice(data_dictionary, usar_vetores=SCHEMA_VETORIAL)
+        return data_dictionary
+
+    def _ao_atualizar_schema(self, novo: dict):
+        """Publica o dicionário de dados de uma nova versão do snapshot do schema."""
+        obter_indice(novo, usar_vetores=SCHEMA_VETORIAL)
+        with self._lock:
+            validador_sql = self.__dict__.get("validador_sql")
+            if validador_sql is not None:
+                validador_sql.data_dictionary = novo
+            self.data_dictionary = novo
+
+    @sob_demanda
+    def validador_sql(self):
+        """Validação dos candidatos do modo especulativo (SQL_VALIDAR_SERVIDOR compila no servidor sem executar)."""
+        from sql_validation import criar_validador
+        return criar_validador(self.data_dictionary, self.engine)
+
+    @sob_demanda
+    def guarda_sql(self):
+        """Guarda de custo entre a geração e a execução: reescritas, limite de linhas, orçamento e tempo limite."""
+        from sql_guard import criar_guarda
+        return criar_guarda(self.engine)
+
+    @sob_demanda
+    def cubo_agregados(self):
+        """Cubo de agregados em memória: contagens e somas comuns são respondidas sem ir ao banco."""
+        from rollups import criar_cubo
+        return criar_cubo(self.engine)
+
+    @sob_demanda
+    def espelho_colunar(self):
+        """
+        Espelho colunar local (Arrow + DuckDB): queries analíticas traduzíveis não vão ao banco. Os tipos
+        vêm do dicionário de dados, que usa os tipos do snapshot do schema quando ele está ativo.
+        """
+        from columnar_mirror import criar_espelho_colunar
+        return criar_espelho_colunar(self.engine, tipos_colunas(self.data_dictionary))
+
+    @sob_demanda
+    def roteadores_execucao(self):
+        """
+        Funções consultadas antes do banco em executar_query: recebem (query, params) e devolvem
+        um DataFrame quando conseguem responder localmente ou None para seguir ao banco.
+        """
+        return [recurso.responder for recurso in (self.cubo_agregados, self.espelho_colunar) if recurso is not None]
+
+    def _criar_llm(self, temperature: float):
+        """
+        Modelo de chat do Azure OpenAI; os modelos compartilham o pool de conexões, o limite de
+        requisições/tokens por minuto e as retentativas de aoai_clients.py.
+        """
+        from langchain_openai import AzureChatOpenAI
+        from aoai_clients import parametros_langchain
+        return AzureChatOpenAI(
+            temperature=temperature,
+            azure_endpoint=AOAI_ENDPOINT,
+            deployment_name=AOAI_DEPLOYMENT_NAME,
+            openai_api_version=AIOAI_API_VERSION,
+            openai_api_key=AOAI_API_KEY,
+            **parametros_langchain(),
+        )
+
+    @sob_demanda
+    def llm(self):
+        """Modelo da interpretação da intenção."""
+        return self._criar_llm(temperature=0.7)
+
+    @sob_demanda
+    def llm_sql(self):
+        """Modelo da geração de SQL e do modo fundido."""
+        return self._criar_llm(temperature=0.1)
+
+    @sob_demanda
+    def intent_prompt(self):
+        """PromptTemplate do LangChain equivalente a prompt_intencao."""
+        return prompt_intencao.prompt_template()
+
+    @sob_demanda
+    def query_prompt(self):
+        """PromptTemplate do LangChain equivalente a prompt_query."""
+        return prompt_query.prompt_template()
+
+    @sob_demanda
+    def fused_prompt(self):
+        """PromptTemplate do LangChain equivalente a prompt_fundido."""
+        return prompt_fundido.prompt_template()
+
+    @sob_demanda
+    def intent_chain(self):
+        """Cadeia (chain) para interpretar a intenção."""
+        from langchain.chains.llm import LLMChain
+        return LLMChain(llm=self.llm, prompt=self.intent_prompt, verbose=LANGCHAIN_VERBOSE)
+
+    @sob_demanda
+    def query_chain(self):
+        """Cadeia (chain) para gerar a query SQL."""
+        from langchain.chains.llm import LLMChain
+        return LLMChain(llm=self.llm_sql, prompt=self.query_prompt, verbose=LANGCHAIN_VERBOSE)
+
+    @sob_demanda
+    def fused_chain(self):
+        """Cadeia (chain) do modo fundido, com saída restrita a um objeto JSON."""
+        from langchain.chains.llm import LLMChain
+        return LLMChain(
+            llm=self.llm_sql.bind(response_format={"type": "json_object"}),
+            prompt=self.fused_prompt,
+            verbose=LANGCHAIN_VERBOSE,
+        )
+
+
+# Contexto do processo; o nome `contexto` já designa, nas funções, o contexto das threads e do schema
+contexto_app = ContextoApp()
+
 
-        {data_dictionary}
+def __getattr__(nome: str):
+    """Recursos do contexto lidos como atributos do módulo (e.g., `backend.engine`), criados no primeiro acesso."""
+    if isinstance(getattr(ContextoApp, nome, None), sob_demanda):
+        return getattr(contexto_app, nome)
+    raise AttributeError(f"module {__name__!r} has no attribute {nome!r}")
 
-        Dada a seguinte entrada do usuário: "{user_input}",
-        identifique a intenção e estruture a saída como JSON com os seguintes campos:
+
+#----------------------------------------------------- 5.0 Prompts -----------------------------------------------------
+# Instruções e schema formam um prefixo idêntico entre as chamadas (prompt caching do Azure
+# OpenAI); as variáveis de cada pergunta vêm no fim, uma única vez (ver prompt_builder.py)
+prompt_intencao = PromptEstavel(
+    "intencao",
+    instrucoes="""
+        Você é um assistente que interpreta a intenção do usuário para construir queries de banco de dados.
+
+        Dada a entrada do usuário, identifique a intenção e estruture a saída como JSON com os seguintes campos:
 
         - **intencao**: A intenção principal do usuário.
         - **entidades**: Os principais elementos ou filtros mencionados.
         - **acao**: A ação a ser realizada (e.g., SELECT, UPDATE).
 
-        **Resposta apenas o JSON, sem blocos de código ou texto adicional.**
+        **Responda apenas o JSON, sem blocos de código ou texto adicional.**
 
+        O dicionário de dados abaixo tem uma linha por tabela e uma por coluna: `- coluna (tipo): descrição`.
+        """,
+    sufixo="""
         Entrada do usuário: "{user_input}"
         Saída:
-        """
-        )
+        """,
+)
 
-query_prompt = PromptTemplate(
-    input_variables=["intencao", "entidades", "acao", "data_dictionary"],
-    template="""
+prompt_query = PromptEstavel(
+    "query",
+    instrucoes="""
         Você é um assistente que cria queries SQL baseadas na intenção do usuário e na estrutura do banco de dados fornecida.
 
-        Aqui está o dicionário de dados da base de dados em formato JSON:
+        Com base na intenção, entidades e ação informadas ao final, gere uma query T-SQL válida que possa ser executada no banco de dados.
 
-        {data_dictionary}
-
-        Com base na intenção, entidades e ação abaixo, gere uma query T-SQL válida que possa ser executada no banco de dados.
+        **Regras:**
+        1. Utilize apenas as tabelas e colunas fornecidas no dicionário de dados.
+        2. A query deve ser sintaticamente correta em T-SQL.
+        3. Use @nome_da_entidade como placeholder para o valor de cada entidade, nunca o valor literal.
+        4. Não inclua blocos de código ou formatação adicional; retorne apenas a query.
 
+        O dicionário de dados abaixo tem uma linha por tabela e uma por coluna: `- coluna (tipo): descrição`.
+        """,
+    sufixo="""
         Intenção: {intencao}
         Entidades: {entidades}
         Ação: {acao}
 
+        **Saída:**
+        """,
+)
+
+prompt_fundido = PromptEstavel(
+    "fundido",
+    instrucoes="""
+        Você é um assistente que interpreta a intenção do usuário e cria a query T-SQL correspondente.
+
+        Dada a entrada do usuário, retorne um único objeto JSON com os seguintes campos:
+
+        - **intencao**: A intenção principal do usuário.
+        - **entidades**: Objeto com os principais elementos ou filtros mencionados e seus valores.
+        - **acao**: A ação a ser realizada (e.g., SELECT).
+        - **query**: Query T-SQL válida que atende à intenção, usando @nome_da_entidade como placeholder para cada valor de entidades.
+
         **Regras:**
         1. Utilize apenas as tabelas e colunas fornecidas no dicionário de dados.
         2. A query deve ser sintaticamente correta em T-SQL.
-        3. Não inclua blocos de código ou formatação adicional; retorne apenas a query.
+        3. Responda apenas o JSON, sem blocos de código ou texto adicional.
 
-        **Saída:**
-        """
-        )
+        O dicionário de dados abaixo tem uma linha por tabela e uma por coluna: `- coluna (tipo): descrição`.
+        """,
+    sufixo="""
+        Entrada do usuário: "{user_input}"
+        Saída:
+        """,
+)
 
 
-# Criar a cadeia (chain) para interpretar a intenção
-intent_chain = LLMChain(
-    llm=llm,
-    prompt=intent_prompt,
-    verbose=True
-)
+#------------------------------------------------ 6.0 Pipeline Assíncrono ----------------------------------------------
 
+# Limites de concorrência independentes para o LLM e para o banco de dados
+_semaforos_llm = {}
+_semaforos_lock = threading.Lock()
+db_executor = ThreadPoolExecutor(max_workers=DB_MAX_CONCURRENCY, thread_name_prefix="sql")
+# Chamadas paralelas ao LLM do modo especulativo síncrono
+llm_executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix="llm")
+
+
+
+def llm_semaforo() -> asyncio.Semaphore:
+    """
+    Semáforo das chamadas ao LLM do event loop em execução.
+
+    Um asyncio.Semaphore fica preso ao primeiro loop que espera por ele; como cada `asyncio.run`
+    cria um loop novo, há um semáforo por loop.
+    """
+    loop = asyncio.get_running_loop()
+    with _semaforos_lock:
+        # Descarta os semáforos de loops já encerrados
+        for outro in [l for l in _semaforos_llm if l.is_closed()]:
+            del _semaforos_llm[outro]
+        semaforo = _semaforos_llm.get(loop)
+        if semaforo is None:
+            semaforo = _semaforos_llm[loop] = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return semaforo
+
+
+async def ainterpretar_intencao(user_input: str, data_dictionary: dict) -> dict:
+    """
+    Versão assíncrona de `interpretar_intencao`.
+
+    :param user_input: Entrada em linguagem natural do usuário.
+    :param data_dictionary: Dicionário de dados da base de dados.
+    :return: Dicionário contendo a intenção, entidades e ação.
+    """
+    with span("interpretar_intencao") as s:
+        contexto = contexto_schema(user_input, data_dictionary)
+        chave = gerar_chave("intencao", normalizar_texto(user_input), contexto)
+        response = contexto_app.llm_cache.get(chave)
+        em_cache = response is not None
+        s.set(cache_hit=em_cache)
+
+        if not em_cache:
+            with span("renderizar_prompt") as s_prompt:
+                entradas = _entradas_intencao(user_input, contexto)
+                s_prompt.set(**prompt_intencao.medir(entradas))
+            async with llm_semaforo():
+                with span("chamada_llm", chain="intencao") as s_llm:
+                    resultado = await contexto_app.intent_chain.ainvoke(
+                        entradas, config={"callbacks": callbacks_llm(s_llm)}
+                    )
+            response = resultado[contexto_app.intent_chain.output_key]
+
+        return _decodificar_intencao(response, chave, em_cache)
+
+
+async def agerar_query_parametrizada(intent_data: dict, data_dictionary: dict) -> tuple:
+    """
+    Versão assíncrona de `gerar_query_parametrizada`.
+
+    :param intent_data: Dicionário contendo a intenção, entidades e ação.
+    :param data_dictionary: Dicionário de dados da base de dados.
+    :return: Tupla (template, params) com a query parametrizada e os valores convertidos.
+    """
+    with span("gerar_query_sql") as s:
+        instanciado = _buscar_template(intent_data, data_dictionary)
+        s.set(template_hit=instanciado is not None)
+        if instanciado is not None:
+            return instanciado
+
+        contexto = contexto_schema(_texto_intencao(intent_data), data_dictionary)
+        entradas = _entradas_query(intent_data)
+        chave = _chave_query(entradas, contexto)
+        query = contexto_app.llm_cache.get(chave)
+        s.set(cache_hit=query is not None)
+
+        if query is None:
+            with span("renderizar_prompt") as s_prompt:
+                entradas["data_dictionary"] = schema_compacto(contexto)
+                s_prompt.set(**prompt_query.medir(entradas))
+            async with llm_semaforo():
+                with span("chamada_llm", chain="query") as s_llm:
+                    resultado = await contexto_app.query_chain.ainvoke(
+                        entradas, config={"callbacks": callbacks_llm(s_llm)}
+                    )
+            query = resultado[contexto_app.query_chain.output_key]
+            if query.strip():
+                contexto_app.llm_cache.set(chave, query)
+
+        return _finalizar_query(query, intent_data, data_dictionary)
+
+
+async def agerar_query_sql(intent_data: dict, data_dictionary: dict) -> str:
+    """
+    Versão assíncrona de `gerar_query_sql`.
+
+    :param intent_data: Dicionário contendo a intenção, entidades e ação.
+    :param data_dictionary: Dicionário de dados da base de dados.
+    :return: String contendo a query SQL gerada.
+    """
+    return renderizar(*await agerar_query_parametrizada(intent_data, data_dictionary))
+
+
+async def _agerar_candidato(modelo, prompt: str) -> str:
+    """Versão assíncrona de `_gerar_candidato`."""
+    async with llm_semaforo():
+        with span("chamada_llm", chain="query", especulativo=True) as s_llm:
+            try:
+                resposta = await modelo.ainvoke(prompt, config={"callbacks": callbacks_llm(s_llm)})
+                return resposta.content
+            except Exception as e:
+                s_llm.set(erro=str(e))
+                logger.warning("Falha ao gerar um candidato SQL: %s", e)
+                return ""
 
-# Criar a cadeia (chain) para gerar a query SQL
-query_chain = LLMChain(
-    llm=llm_sql,
-    prompt=query_prompt,
-    verbose=True
-)
+
+async def agerar_query_especulativa(intent_data: dict, data_dictionary: dict, n: int = None) -> tuple:
+    """
+    Versão assíncrona de `gerar_query_especulativa`.
+
+    Os candidatos que ainda não chegaram são cancelados assim que um deles é validado, o que também
+    encerra as requisições HTTP em andamento.
+
+    :param intent_data: Dicionário contendo a intenção, entidades e ação.
+    :param data_dictionary: Dicionário de dados da base de dados.
+    :param n: Número de candidatos (padrão: SQL_CANDIDATOS).
+    :return: Tupla (template, params) com a query parametrizada e os valores convertidos.
+    """
+    n = n or SQL_CANDIDATOS
+    with span("gerar_query_especulativa", candidatos=n) as s:
+        resolvido, chave, prompt = _preparar_candidatos(intent_data, data_dictionary)
+        s.set(resolvido=resolvido is not None)
+        if resolvido is not None:
+            return resolvido
+
+        tarefas = []
+        if SQL_CANDIDATOS_UMA_CHAMADA:
+            from langchain_core.messages import HumanMessage
+            async with llm_semaforo():
+                with span("chamada_llm", chain="query", candidatos=n) as s_llm:
+                    geracao = await contexto_app.query_chain.llm.agenerate(
+                        [[HumanMessage(content=prompt)]], callbacks=callbacks_llm(s_llm), n=n
+                    )
+            respostas = [g.text for g in geracao.generations[0]]
+        else:
+            tarefas = [asyncio.create_task(_agerar_candidato(modelo, prompt)) for modelo in _modelos_candidatos(n)]
+            respostas = asyncio.as_completed(tarefas)
+
+        loop = asyncio.get_running_loop()
+        candidatos = _Candidatos(intent_data, data_dictionary)
+        escolhido = None
+        try:
+            for proxima in respostas:
+                resposta = await proxima if tarefas else proxima
+                candidato = candidatos.avaliar(resposta)
+                if candidato is None:
+                    continue
+                # A compilação no servidor ocupa uma conexão; roda no pool do banco
+                contexto = contextvars.copy_context()
+                validar = contexto_app.validador_sql.validar
+                motivo = await loop.run_in_executor(db_executor, contexto.run, validar, *candidato)
+                if not motivo:
+                    escolhido = candidato
+                    contexto_app.llm_cache.set(chave, resposta)
+                    break
+                candidatos.rejeitar(candidato, motivo)
+        finally:
+            for tarefa in tarefas:
+                tarefa.cancel()
+        s.set(rejeitados=candidatos.rejeitados, valido=escolhido is not None)
+
+    return escolhido or candidatos.fallback(n)
+
+
+async def aexecutar_query(query: str, engine, params: dict = None) -> pd.DataFrame:
+    """
+    Executa a query em um pool limitado de threads, sem bloquear o event loop.
+
+    O pyodbc não possui API assíncrona; o tamanho de `db_executor` (DB_MAX_CONCURRENCY)
+    limita quantas queries ocupam conexões ao mesmo tempo.
+
+    :param query: Query SQL a ser executada.
+    :param engine: Engine de conexão do SQLAlchemy.
+    :param params: Valores dos parâmetros vinculados.
+    :return: DataFrame contendo os resultados da query.
+    """
+    loop = asyncio.get_running_loop()
+    # Copia o contexto para que os spans da execução fiquem no mesmo trace da pergunta
+    contexto = contextvars.copy_context()
+    return await loop.run_in_executor(db_executor, contexto.run, executar_query, query, engine, params)
+
+
+async def ainterpretar_e_gerar_query(user_input: str, data_dictionary: dict) -> tuple:
+    """
+    Versão assíncrona de `interpretar_e_gerar_query`.
+
+    :param user_input: Entrada em linguagem natural do usuário.
+    :param data_dictionary: Dicionário de dados da base de dados.
+    :return: Tupla (intent_data, query, params, modo efetivamente utilizado).
+    """
+    with span("interpretar_e_gerar_query") as s:
+        contexto = contexto_schema(user_input, data_dictionary)
+        chave = gerar_chave("fundido", normalizar_texto(user_input), contexto)
+        response = contexto_app.llm_cache.get(chave)
+        em_cache = response is not None
+        s.set(cache_hit=em_cache)
+
+        if not em_cache:
+            with span("renderizar_prompt") as s_prompt:
+                entradas = _entradas_intencao(user_input, contexto)
+                s_prompt.set(**prompt_fundido.medir(entradas))
+            async with llm_semaforo():
+                with span("chamada_llm", chain="fundido") as s_llm:
+                    resultado = await contexto_app.fused_chain.ainvoke(
+                        entradas, config={"callbacks": callbacks_llm(s_llm)}
+                    )
+            response = resultado[contexto_app.fused_chain.output_key]
+
+        with span("extrair_json"):
+            decodificado = _decodificar_fundido(response)
+        s.set(valido=decodificado is not None)
+    if decodificado is None:
+        logger.warning("Resposta do modo fundido inválida; utilizando o pipeline de duas etapas.")
+        intent_data = await ainterpretar_intencao(user_input, data_dictionary)
+        query, params = await agerar_query_parametrizada(intent_data, data_dictionary) if intent_data else ("", {})
+        return intent_data, query, params, MODO_DUAS_ETAPAS
+
+    if not em_cache:
+        contexto_app.llm_cache.set(chave, response)
+    intent_data, query = decodificado
+    return (intent_data, *_finalizar_query(query, intent_data, data_dictionary), MODO_FUNDIDO)
+
+
+async def _agerar_resposta(user_input: str, modo: str) -> tuple:
+    """Versão assíncrona de `_gerar_resposta`."""
+    if modo == MODO_FUNDIDO:
+        return await ainterpretar_e_gerar_query(user_input, contexto_app.data_dictionary)
+    intent_data = await ainterpretar_intencao(user_input, contexto_app.data_dictionary)
+    if not intent_data:
+        return intent_data, "", {}, modo
+    gerar = agerar_query_especulativa if modo == MODO_ESPECULATIVO else agerar_query_parametrizada
+    return (intent_data, *await gerar(intent_data, contexto_app.data_dictionary), modo)
+
+
+async def aresponder(user_input: str, modo: str = None) -> dict:
+    """
+    Executa o pipeline completo (intenção, geração de SQL e execução) de forma assíncrona.
+
+    :param user_input: Entrada em linguagem natural do usuário.
+    :param modo: "duas_etapas", "fundido" ou "especulativo"; se omitido, usa PIPELINE_MODO.
+    :return: Dicionário com a intenção interpretada, a query gerada, seus parâmetros, o DataFrame de resultado e o modo utilizado.
+    """
+    import pandas as pd
+
+    modo = modo or PIPELINE_MODO
+    with span("responder") as s:
+        semantica = _resposta_semantica(user_input)
+        if semantica is not None:
+            intent_data, query, params = semantica
+            modo = MODO_CACHE_SEMANTICO
+        else:
+            intent_data, query, params, modo = await _agerar_resposta(user_input, modo)
+        resultado = await aexecutar_query(query, contexto_app.engine, params) if query else pd.DataFrame()
+        _registrar_execucao(user_input, intent_data, query, params, resultado, modo)
+        s.set(modo=modo, linhas=len(resultado))
+
+    return {
+        "intent_data": intent_data,
+        "query": query,
+        "params": params,
+        "resultado": resultado,
+        "modo": modo,
+    }
+
+
+async def aexecutar_queries_em_lote(consultas: list, engine, queries_por_ida: int = None) -> list:
+    """
+    Versão assíncrona de `executar_queries_em_lote`.
+
+    :param consultas: Lista de tuplas (query, params).
+    :param engine: Engine de conexão do SQLAlchemy.
+    :param queries_por_ida: Máximo de queries por ida (padrão: LOTE_QUERIES_POR_IDA).
+    :return: Lista de DataFrames na ordem de `consultas`.
+    """
+    from result_cache import chave_resultado
+
+    loop = asyncio.get_running_loop()
+    with span("executar_queries_em_lote", queries=len(consultas)) as s:
+        # O guarda de custo pode consultar o plano no servidor; o planejamento também roda no pool do banco
+        contexto = contextvars.copy_context()
+        resolvidas, idas = await loop.run_in_executor(db_executor, contexto.run, _planejar_idas, consultas,
+                                                      queries_por_ida)
+        dfs = await asyncio.gather(*(
+            loop.run_in_executor(db_executor, contextvars.copy_context().run, _executar_planejada, engine, ida)
+            for ida in idas
+        ))
+        for ida, resultado in zip(idas, dfs):
+            _concluir_ida(ida, resultado, resolvidas)
+        s.set(unicas=len(resolvidas), idas=len(idas))
+    return [resolvidas[chave_resultado(query, params)] for query, params in consultas]
+
+
+async def aresponder_lote(perguntas: list, modo: str = None, paralelismo: int = None) -> list:
+    """
+    Versão assíncrona de `responder_lote`.
+
+    :param perguntas: Lista de perguntas em linguagem natural.
+    :param modo: "duas_etapas", "fundido" ou "especulativo"; se omitido, usa PIPELINE_MODO.
+    :param paralelismo: Perguntas nas etapas de LLM ao mesmo tempo (padrão: LOTE_PARALELISMO).
+    :return: Lista na ordem de `perguntas` com os dicionários de `responder`, acrescidos de "pergunta" e "erro".
+    """
+    modo = modo or PIPELINE_MODO
+    # Limite do lote, somado ao limite global de chamadas ao LLM (llm_semaforo)
+    limite = asyncio.Semaphore(paralelismo or LOTE_PARALELISMO)
+
+    async def gerar(pergunta: str) -> tuple:
+        async with limite:
+            return await _agerar_resposta(pergunta, modo)
+
+    with span("responder_lote", perguntas=len(perguntas)) as s:
+        unicas, indices = _agrupar_perguntas(perguntas)
+        semanticas = _respostas_semanticas(unicas)
+
+        geradas = iter(await asyncio.gather(
+            *(gerar(pergunta) for pergunta, semantica in zip(unicas, semanticas) if semantica is None),
+            return_exceptions=True,
+        ))
+        geracoes = [
+            (*semantica, MODO_CACHE_SEMANTICO) if semantica is not None else next(geradas) for semantica in semanticas
+        ]
+
+        resultados = await aexecutar_queries_em_lote(_consultas_do_lote(geracoes), contexto_app.engine)
+        s.set(unicas=len(unicas))
+    return _concluir_lote(perguntas, unicas, indices, geracoes, resultados)
 
 
 if __name__ == "__main__":
@@ -320,6 +2028,13 @@ if __name__ == "__main__":
     user_input = "Quero saber o número de acidentes de trânsito no ano de 2019."
     # user_input = "Me mostre os últimos 5 acidentes da zona sul"
     user_input = "Me mostre os 5 registros mais recentes de acidentes, ordenados por data decrescente."
+
+    # Verificação explícita da conexão, antes feita na importação do módulo
+    saude = contexto_app.verificar_saude()
+    print("Saúde:", saude)
+    if not saude["ok"]:
+        raise SystemExit(1)
+    data_dictionary = contexto_app.data_dictionary
     
     # Interpretar a intenção
     intent_data = interpretar_intencao(user_input, data_dictionary)
@@ -328,13 +2043,38 @@ if __name__ == "__main__":
     print(json.dumps(intent_data, indent=4, ensure_ascii=False))
     
     # Gerar a query SQL com base na intenção e no dicionário de dados
-    query = gerar_query_sql(intent_data, data_dictionary)
+    query, params = gerar_query_parametrizada(intent_data, data_dictionary)
     
     print("\nQuery Gerada:")
     print(query)
+    print("Parâmetros:", params)
     
     # Executar a query no banco de dados
     if query:
-        df_resultado = executar_query(query, engine)
+        df_resultado = executar_query(query, contexto_app.engine, params)
         print("\nResultado da Query:")
-        print(df_resultado)
\ No newline at end of file
+        print(df_resultado)
+
+    print("\nCache de LLM:", contexto_app.llm_cache.estatisticas())
+    if contexto_app.result_cache is not None:
+        print("Cache de resultados:", contexto_app.result_cache.estatisticas())
+    from db_engine import estatisticas_pool
+    from aoai_clients import estatisticas_clientes
+    print("Pool de conexões:", estatisticas_pool(contexto_app.engine))
+    print("Statements preparados:", estatisticas_statements())
+    if contexto_app.template_store is not None:
+        print("Templates SQL:", contexto_app.template_store.estatisticas())
+    if contexto_app.semantic_cache is not None:
+        print("Cache semântico:", contexto_app.semantic_cache.estatisticas())
+    if contexto_app.cubo_agregados is not None:
+        print("Cubo de agregados:", contexto_app.cubo_agregados.estatisticas())
+    if contexto_app.espelho_colunar is not None:
+        print("Espelho colunar:", contexto_app.espelho_colunar.estatisticas())
+    print("Clientes Azure OpenAI:", estatisticas_clientes())
+    print("Validação de SQL:", contexto_app.validador_sql.estatisticas())
+    if contexto_app.guarda_sql is not None:
+        print("Guarda de custo:", contexto_app.guarda_sql.estatisticas())
+
+    if telemetria.ativa:
+        print("\nMétricas:")
+        print(telemetria.exportar_prometheus())
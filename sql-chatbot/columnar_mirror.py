@@ -0,0 +1,661 @@
+#---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+import os
+import re
+import json
+import time
+import logging
+import threading
+from datetime import date, datetime
+from functools import lru_cache
+
+from sqlalchemy import text
+
+from result_cache import tabelas_referenciadas
+
+# Dependências opcionais: sem elas o espelho fica desativado e as queries seguem para o banco
+try:
+    import duckdb
+    import pyarrow as pa
+except ImportError:
+    duckdb = pa = None
+
+logger = logging.getLogger(__name__)
+
+#--------------------------------------------- 2.0 Tradução T-SQL → DuckDB ---------------------------------------------
+
+class _NaoTraduzivel(Exception):
+    """Construção T-SQL sem equivalente seguro no DuckDB; a query segue para o banco."""
+
+
+# Literais (N'...'), identificadores entre colchetes e entre aspas duplas
+_TOKENS = re.compile(r"(?<!\w)N?'(?:[^']|'')*'|\[[^\]]*\]|\"(?:[^\"]|\"\")*\"")
+_MARCA = re.compile(r"\x00(\d+)\x00")
+
+# Somente leitura: qualquer uma destas palavras faz a query ir ao banco
+_PROIBIDAS = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|MERGE|DROP|ALTER|CREATE|TRUNCATE|EXEC|EXECUTE|INTO|GRANT|REVOKE|DECLARE|SET|"
+    r"OPENROWSET|OPENQUERY|PRAGMA|ATTACH|COPY|INSTALL|LOAD|INFORMATION_SCHEMA|SYS|DUCKDB_\w+)\b",
+    re.IGNORECASE,
+)
+
+_TOP = re.compile(
+    r"\bSELECT\s+(?:(?:DISTINCT|ALL)\s+)?(?P<top>TOP\s*(?:\(\s*(?P<n>\d+|\$\w+)\s*\)|(?P<n2>\d+))"
+    r"(?P<extra>\s+PERCENT|\s+WITH\s+TIES)?\s*)",
+    re.IGNORECASE,
+)
+
+# Partes de data do DATEPART/DATEADD/DATEDIFF e seus nomes no DuckDB
+PARTES_DATA = {
+    "year": "year", "yy": "year", "yyyy": "year",
+    "quarter": "quarter", "qq": "quarter", "q": "quarter",
+    "month": "month", "mm": "month", "m": "month",
+    "dayofyear": "doy", "dy": "doy", "y": "doy",
+    "day": "day", "dd": "day", "d": "day",
+    "weekday": "dow", "dw": "dow", "w": "dow",
+    "hour": "hour", "hh": "hour",
+    "minute": "minute", "mi": "minute", "n": "minute",
+    "second": "second", "ss": "second", "s": "second",
+}
+
+# Tipos T-SQL e equivalentes no DuckDB
+TIPOS_SQL = [
+    (r"N?(?:VAR)?CHAR(?:\s*\(\s*(?:\d+|MAX)\s*\))?|N?TEXT", "VARCHAR"),
+    (r"(?:SMALL)?DATETIME2?(?:\s*\(\s*\d+\s*\))?", "TIMESTAMP"),
+    (r"DATE", "DATE"),
+    (r"TIME(?:\s*\(\s*\d+\s*\))?", "TIME"),
+    (r"BIGINT", "BIGINT"),
+    (r"INT|INTEGER", "INTEGER"),
+    (r"SMALLINT", "SMALLINT"),
+    (r"TINYINT", "UTINYINT"),
+    (r"BIT", "BOOLEAN"),
+    (r"FLOAT(?:\s*\(\s*\d+\s*\))?|REAL", "DOUBLE"),
+    (r"(?:DECIMAL|NUMERIC)\s*(\(\s*\d+\s*(?:,\s*\d+\s*)?\))", r"DECIMAL\1"),
+    # Sem precisão, o SQL Server usa DECIMAL(18, 0)
+    (r"DECIMAL|NUMERIC", "DECIMAL(18, 0)"),
+    (r"MONEY", "DECIMAL(19, 4)"),
+]
+
+# Conversão implícita do SQL Server para datetime: textos só com hora recebem a data 1900-01-01
+MACRO_DATAHORA = """
+    CREATE MACRO tsql_datahora(x) AS COALESCE(
+        TRY_CAST(x AS TIMESTAMP),
+        TRY_CAST('1900-01-01 ' || CAST(x AS VARCHAR) AS TIMESTAMP)
+    )
+"""
+
+
+def _fechamento(sql: str, abre: int) -> int:
+    """Posição do parêntese que fecha o aberto em `abre`."""
+    profundidade = 0
+    for i in range(abre, len(sql)):
+        if sql[i] == "(":
+            profundidade += 1
+        elif sql[i] == ")":
+            profundidade -= 1
+            if profundidade == 0:
+                return i
+    raise _NaoTraduzivel("parênteses desbalanceados")
+
+
+def _abertura(sql: str, posicao: int) -> int:
+    """Posição do parêntese que envolve `posicao`, ou -1 no nível externo."""
+    profundidade = 0
+    for i in range(posicao - 1, -1, -1):
+        if sql[i] == ")":
+            profundidade += 1
+        elif sql[i] == "(":
+            if profundidade == 0:
+                return i
+            profundidade -= 1
+    return -1
+
+
+def _argumentos(texto: str) -> list:
+    """Divide os argumentos de uma chamada nas vírgulas de primeiro nível."""
+    argumentos, profundidade, inicio = [], 0, 0
+    for i, c in enumerate(texto):
+        if c == "(":
+            profundidade += 1
+        elif c == ")":
+            profundidade -= 1
+        elif c == "," and profundidade == 0:
+            argumentos.append(texto[inicio:i].strip())
+            inicio = i + 1
+    argumentos.append(texto[inicio:].strip())
+    return argumentos
+
+
+def _reescrever_chamadas(sql: str, nome: str, reescrever) -> str:
+    """
+    Substitui cada chamada `nome(...)` pelo texto devolvido por `reescrever(argumentos)`.
+
+    As chamadas são tratadas da direita para a esquerda, de modo que chamadas aninhadas já chegam
+    reescritas nos argumentos da externa.
+    """
+    for m in reversed(list(re.finditer(rf"\b{nome}\s*\(", sql, re.IGNORECASE))):
+        fim = _fechamento(sql, m.end() - 1)
+        sql = sql[:m.start()] + reescrever(_argumentos(sql[m.end():fim])) + sql[fim + 1:]
+    return sql
+
+
+def _parte(texto: str) -> str:
+    parte = PARTES_DATA.get(texto.strip().lower())
+    if parte is None:
+        raise _NaoTraduzivel(f"parte de data {texto}")
+    return parte
+
+
+def _tipo(texto: str) -> str:
+    texto = texto.strip()
+    for padrao, tipo in TIPOS_SQL:
+        m = re.fullmatch(padrao, texto, re.IGNORECASE)
+        if m:
+            return m.expand(tipo)
+    raise _NaoTraduzivel(f"tipo {texto}")
+
+
+def _converter(expressao: str, tipo: str, funcao: str = "CAST") -> str:
+    tipo = _tipo(tipo)
+    if tipo in ("DATE", "TIME", "TIMESTAMP"):
+        expressao = f"tsql_datahora({expressao})"
+    return f"{funcao}({expressao} AS {tipo})"
+
+
+def _cast(funcao: str):
+    def reescrever(args):
+        partes = re.split(r"\s+AS\s+", args[0], flags=re.IGNORECASE)
+        if len(args) != 1 or len(partes) < 2:
+            raise _NaoTraduzivel(funcao)
+        return _converter(" AS ".join(partes[:-1]), partes[-1], funcao)
+    return reescrever
+
+
+def _convert(funcao: str):
+    def reescrever(args):
+        # O estilo (3º argumento) muda a formatação de datas e números: sem equivalente direto
+        if len(args) != 2:
+            raise _NaoTraduzivel(f"{funcao} com estilo")
+        return _converter(args[1], args[0], funcao)
+    return reescrever
+
+
+def _datepart(args):
+    parte = _parte(args[0])
+    expressao = f"date_part('{parte}', tsql_datahora({args[1]}))"
+    # DATEPART(weekday) no SQL Server começa em 1 no domingo (DATEFIRST 7); no DuckDB, em 0
+    return f"({expressao} + 1)" if parte == "dow" else expressao
+
+
+def _dateadd(args):
+    parte, quantidade = _parte(args[0]), args[1]
+    if parte == "quarter":
+        parte, quantidade = "month", f"3 * ({quantidade})"
+    elif parte in ("doy", "dow"):
+        parte = "day"
+    return f"(tsql_datahora({args[2]}) + INTERVAL ({quantidade}) {parte.upper()})"
+
+
+def _datediff(args):
+    parte = _parte(args[0])
+    if parte in ("doy", "dow"):
+        parte = "day"
+    return f"date_diff('{parte}', tsql_datahora({args[1]}), tsql_datahora({args[2]}))"
+
+
+def _charindex(args):
+    if len(args) != 2:
+        raise _NaoTraduzivel("CHARINDEX com posição inicial")
+    return f"strpos({args[1]}, {args[0]})"
+
+
+# Em ordem: o CAST gerado pelo CONVERT não passa de novo pela reescrita do CAST
+REESCRITAS = [
+    ("TRY_CAST", _cast("TRY_CAST")),
+    ("CAST", _cast("CAST")),
+    ("TRY_CONVERT", _convert("TRY_CAST")),
+    ("CONVERT", _convert("CAST")),
+    ("YEAR", lambda a: f"date_part('year', tsql_datahora({a[0]}))"),
+    ("MONTH", lambda a: f"date_part('month', tsql_datahora({a[0]}))"),
+    ("DAY", lambda a: f"date_part('day', tsql_datahora({a[0]}))"),
+    ("DATEPART", _datepart),
+    ("DATEADD", _dateadd),
+    ("DATEDIFF", _datediff),
+    ("ISNULL", lambda a: f"coalesce({', '.join(a)})"),
+    # LEN ignora espaços à direita
+    ("LEN", lambda a: f"length(rtrim({a[0]}))"),
+    ("CHARINDEX", _charindex),
+    ("IIF", lambda a: f"CASE WHEN {a[0]} THEN {a[1]} ELSE {a[2]} END"),
+    ("GETDATE", lambda a: "current_localtimestamp()"),
+    ("SYSDATETIME", lambda a: "current_localtimestamp()"),
+]
+
+
+def _converter_top(sql: str) -> str:
+    """Troca cada TOP n por um LIMIT n no fim do SELECT correspondente."""
+    for m in reversed(list(_TOP.finditer(sql))):
+        if m.group("extra"):
+            raise _NaoTraduzivel("TOP PERCENT/WITH TIES")
+        if re.search(r"\b(UNION|EXCEPT|INTERSECT)\b", sql, re.IGNORECASE):
+            raise _NaoTraduzivel("TOP com operação de conjuntos")
+        limite = m.group("n") or m.group("n2")
+        sql = sql[:m.start("top")] + sql[m.end("top"):]
+        abre = _abertura(sql, m.start())
+        fim = len(sql) if abre < 0 else _fechamento(sql, abre)
+        sql = f"{sql[:fim].rstrip()} LIMIT {limite}{sql[fim:]}"
+    return sql
+
+
+@lru_cache(maxsize=512)
+def traduzir_tsql(query: str, tabela: str = "poa_acidentes_transito", com_params: bool = False,
+                  inteiros: frozenset = frozenset()):
+    """
+    Traduz uma query T-SQL de leitura para o dialeto do DuckDB.
+
+    Cobre TOP, OFFSET/FETCH, colchetes, N'...', CONVERT/CAST, YEAR/MONTH/DAY, DATEPART, DATEADD,
+    DATEDIFF, ISNULL, LEN, CHARINDEX, IIF e GETDATE, e a média inteira de colunas inteiras. O que
+    não tiver tradução segura (e.g., estilos do CONVERT, DATENAME, variáveis, outras tabelas)
+    devolve None para que a query siga para o banco.
+
+    :param query: Query T-SQL (com parâmetros :nome quando `com_params` é verdadeiro).
+    :param tabela: Única tabela que a query pode consultar.
+    :param com_params: Indica se a query usa parâmetros vinculados (:nome viram $nome).
+    :param inteiros: Colunas inteiras, cuja média o SQL Server trunca.
+    :return: Query DuckDB ou None.
+    """
+    tokens = []
+
+    def mascarar(m):
+        token = m.group(0)
+        if token.startswith("["):
+            token = '"' + token[1:-1].replace('"', '""') + '"'
+        elif not token.startswith('"'):
+            token = token[token.index("'"):]
+            if com_params:
+                token = token.replace(r"\:", ":")
+        tokens.append(token)
+        return f"\x00{len(tokens) - 1}\x00"
+
+    def restaurar(texto):
+        return _MARCA.sub(lambda m: tokens[int(m.group(1))], texto)
+
+    # O espelho não tem schemas: dbo.tabela passa a tabela
+    sql = re.sub(r"(?i)(?<![\w.\]])(?:\[dbo\]|dbo)\.", "", query.strip().rstrip(";"))
+    sql = _TOKENS.sub(mascarar, sql)
+    sql = re.sub(r"--[^\n]*|/\*.*?\*/", " ", sql, flags=re.DOTALL).strip()
+
+    if not re.match(r"(?i)(SELECT|WITH)\b", sql) or ";" in sql or "@" in sql or "#" in sql:
+        return None
+    if _PROIBIDAS.search(sql):
+        return None
+    ctes = {nome.lower() for nome in re.findall(r"(?i)(?:\bWITH|,)\s*(\w+)\s+AS\s*\(", sql)}
+    if tabelas_referenciadas(restaurar(sql).replace('"', "")) - ctes - {tabela.lower()}:
+        return None
+
+    if com_params:
+        sql = re.sub(r"(?<![\\\w:]):(\w+)", r"$\1", sql)
+        # Listas são vinculadas inteiras: "IN :regioes" passa a "IN (SELECT UNNEST($regioes))"
+        sql = re.sub(r"(?i)\bIN\s+\$(\w+)", r"IN (SELECT UNNEST($\1))", sql).replace(r"\:", ":")
+
+    try:
+        sql = re.sub(r"(?i)\bWITH\s*\(\s*NOLOCK\s*\)", "", sql)
+        sql = re.sub(r"(?i)\bOFFSET\s+(\S+)\s+ROWS?\s+FETCH\s+(?:NEXT|FIRST)\s+(\S+)\s+ROWS?\s+ONLY\b",
+                     r"LIMIT \2 OFFSET \1", sql)
+        sql = re.sub(r"(?i)\bOFFSET\s+(\S+)\s+ROWS?\b", r"OFFSET \1", sql)
+        sql = _converter_top(sql)
+        for nome, reescrever in REESCRITAS:
+            sql = _reescrever_chamadas(sql, nome, reescrever)
+        # AVG de coluna inteira devolve inteiro truncado no SQL Server
+        sql = _reescrever_chamadas(sql, "AVG", lambda a: (
+            f"CAST(trunc(avg({a[0]})) AS BIGINT)" if restaurar(a[0]).split(".")[-1].strip('"').lower() in inteiros
+            else f"avg({', '.join(a)})"))
+    except _NaoTraduzivel as e:
+        logger.debug("Query sem tradução para o espelho colunar (%s): %s", e, query)
+        return None
+    return restaurar(sql)
+
+#----------------------------------------------------- 3.0 Espelho -----------------------------------------------------
+
+# Tipos declarados em data_dictionary["tables"][tabela]["types"] e seus equivalentes no Arrow
+TIPOS_ARROW = {
+    "int": "int64",
+    "float": "float64",
+    "str": "string",
+    "date": "date32",
+    "datetime": "timestamp[us]",
+}
+
+# Partição das linhas sem data
+SEM_DATA = "sem_data"
+
+
+def _meses(inicio: date, fim: date) -> list:
+    """Primeiros dias dos meses de `inicio` até `fim`, inclusive."""
+    meses, atual = [], date(inicio.year, inicio.month, 1)
+    while atual <= fim:
+        meses.append(atual)
+        atual = date(atual.year + atual.month // 12, atual.month % 12 + 1, 1)
+    return meses
+
+
+def _para_duckdb(valor):
+    # `data` é texto na tabela de origem: datas comparam como texto ISO, como no renderizar
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    if isinstance(valor, (list, tuple)):
+        return [_para_duckdb(v) for v in valor]
+    return valor
+
+
+class EspelhoColunar:
+    """
+    Cópia local da tabela de acidentes em arquivos Arrow IPC, consultada pelo DuckDB.
+
+    A tabela é exportada em uma partição por mês de `data`; cada arquivo é aberto mapeado em
+    memória (leitura sem cópia) e todas as partições são expostas ao DuckDB como uma única tabela
+    Arrow. `responder` traduz a query T-SQL com `traduzir_tsql` e a executa localmente; queries
+    sem tradução, ou que falhem no DuckDB, seguem para o banco.
+
+    A sessão do DuckDB imita o SQL Server onde a diferença muda resultados: divisão inteira,
+    comparação de texto sem diferenciar maiúsculas e NULLs primeiro na ordem crescente. O acesso
+    a arquivos e extensões pelo SQL é desativado.
+
+    O espelho é eventualmente consistente: os meses recentes são reexportados periodicamente
+    (ver `iniciar_atualizacao`).
+    """
+
+    def __init__(self, engine, tabela: str = "poa_acidentes_transito", diretorio: str = "data/espelho",
+                 tipos: dict = None, tamanho_bloco: int = 50_000):
+        if duckdb is None or pa is None:
+            raise ImportError("O espelho colunar requer os pacotes duckdb e pyarrow.")
+        self.engine = engine
+        self.tabela = tabela
+        self.diretorio = os.path.join(diretorio, tabela)
+        self.tipos = dict(tipos or {})
+        self.tamanho_bloco = tamanho_bloco
+        self._inteiros = frozenset(c.lower() for c, t in self.tipos.items() if t == "int")
+        self._manifesto = {"particoes": {}}
+        self._particoes = {}
+        self._dados = None
+        self._atualizado_em = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._conexao = duckdb.connect(config={
+            "integer_division": True,
+            "default_collation": "nocase",
+            "default_null_order": "nulls_first_on_asc_last_on_desc",
+            "enable_external_access": False,
+        })
+        self._conexao.execute(MACRO_DATAHORA)
+        self.hits = 0
+        self.misses = 0
+        self.nao_traduzidas = 0
+        self.falhas = 0
+
+    @property
+    def pronto(self) -> bool:
+        return self._dados is not None
+
+    # Exportação
+
+    def _esquema(self, colunas: list):
+        return pa.schema([(c, pa.type_for_alias(TIPOS_ARROW.get(self.tipos.get(c), "string"))) for c in colunas])
+
+    def _exportar(self, chave: str, filtro: str, params: dict) -> dict:
+        """Exporta as linhas do filtro para um novo arquivo Arrow, lendo o cursor em blocos."""
+        os.makedirs(self.diretorio, exist_ok=True)
+        arquivo = os.path.join(self.diretorio, f"{chave}.{time.time_ns()}.arrow")
+        linhas = 0
+        with self.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True).execute(
+                text(f"SELECT * FROM {self.tabela} WHERE {filtro}"), params)
+            colunas = list(result.keys())
+            esquema = self._esquema(colunas)
+            with pa.OSFile(f"{arquivo}.tmp", "wb") as destino, pa.ipc.new_file(destino, esquema) as escritor:
+                while True:
+                    rows = result.fetchmany(self.tamanho_bloco)
+                    if not rows:
+                        break
+                    arrays = []
+                    for campo, valores in zip(esquema, zip(*rows)):
+                        if pa.types.is_string(campo.type):
+                            valores = [None if v is None else str(v) for v in valores]
+                        arrays.append(pa.array(valores, type=campo.type))
+                    escritor.write_batch(pa.record_batch(arrays, schema=esquema))
+                    linhas += len(rows)
+        os.replace(f"{arquivo}.tmp", arquivo)
+        return {"arquivo": os.path.basename(arquivo), "linhas": linhas}
+
+    def _exportar_mes(self, mes: date) -> dict:
+        seguinte = date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+        return self._exportar(mes.strftime("%Y-%m"), "data >= :inicio AND data < :fim",
+                              {"inicio": mes.isoformat(), "fim": seguinte.isoformat()})
+
+    def _contar(self) -> int:
+        with self.engine.connect() as connection:
+            return connection.execute(text(f"SELECT COUNT(*) FROM {self.tabela}")).scalar()
+
+    def _limites(self):
+        with self.engine.connect() as connection:
+            menor, maior = connection.execute(text(f"SELECT MIN(data), MAX(data) FROM {self.tabela}")).one()
+        if menor is None:
+            return None, None
+        return date.fromisoformat(str(menor)[:10]), date.fromisoformat(str(maior)[:10])
+
+    # Carga
+
+    def _abrir(self, particao: dict):
+        """Abre a partição mapeada em memória; os buffers da tabela apontam para o arquivo."""
+        caminho = os.path.join(self.diretorio, particao["arquivo"])
+        return pa.ipc.open_file(pa.memory_map(caminho, "r")).read_all()
+
+    def _publicar(self, particoes: dict, exportadas: dict):
+        """Abre as partições reexportadas, troca a tabela servida e grava o manifesto."""
+        abertas = {chave: self._particoes[chave] for chave in particoes if chave not in exportadas}
+        abertas.update({chave: self._abrir(particoes[chave]) for chave in exportadas})
+        dados = pa.concat_tables([abertas[chave] for chave in sorted(abertas)]) if abertas else None
+        antigas = [p["arquivo"] for chave, p in self._manifesto["particoes"].items()
+                   if particoes.get(chave) is not p]
+
+        manifesto = {"tabela": self.tabela, "colunas": self.tipos, "particoes": particoes,
+                     "exportado_em": time.time()}
+        temporario = os.path.join(self.diretorio, "manifesto.json.tmp")
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(manifesto, f, ensure_ascii=False, indent=2)
+        os.replace(temporario, os.path.join(self.diretorio, "manifesto.json"))
+
+        with self._lock:
+            self._manifesto, self._particoes, self._dados = manifesto, abertas, dados
+            self._atualizado_em = time.time()
+
+        for arquivo in antigas:
+            try:
+                os.remove(os.path.join(self.diretorio, arquivo))
+            except OSError:
+                # Ainda mapeado por uma consulta em andamento (Windows): fica para a próxima limpeza
+                pass
+
+    def carregar(self) -> bool:
+        """
+        Reabre o espelho gravado anteriormente, sem ir ao banco.
+
+        :return: True se o manifesto existir e corresponder à tabela e às colunas atuais.
+        """
+        caminho = os.path.join(self.diretorio, "manifesto.json")
+        if not os.path.exists(caminho):
+            return False
+        with open(caminho, encoding="utf-8") as f:
+            manifesto = json.load(f)
+        if manifesto.get("tabela") != self.tabela or manifesto.get("colunas") != self.tipos:
+            return False
+        self._manifesto = {"particoes": {}}
+        self._publicar(manifesto["particoes"], manifesto["particoes"])
+        return True
+
+    def reconstruir(self):
+        """Exporta a tabela inteira, mês a mês, e confere o total de linhas com o banco."""
+        inicio = time.perf_counter()
+        total = self._contar()
+        menor, maior = self._limites()
+        particoes = {SEM_DATA: self._exportar(SEM_DATA, "data IS NULL", {})}
+        for mes in _meses(menor, maior) if menor else []:
+            particoes[mes.strftime("%Y-%m")] = self._exportar_mes(mes)
+        exportadas = sum(p["linhas"] for p in particoes.values())
+        if exportadas != total:
+            # Datas fora do formato ISO não caem em nenhuma partição mensal
+            raise ValueError(f"Espelho colunar incompleto: {exportadas} de {total} linhas exportadas.")
+        self._publicar(particoes, particoes)
+        logger.info("Espelho colunar exportado: %d linhas em %.2fs.", total, time.perf_counter() - inicio)
+
+    def atualizar(self, meses: int = 2):
+        """
+        Reexporta os meses mais recentes e as linhas sem data.
+
+        Os `meses` últimos meses já exportados e os posteriores a eles são lidos novamente do banco.
+        Se o total de linhas não bater com o banco (e.g., alterações em meses antigos), o espelho
+        é reconstruído.
+
+        :param meses: Número de meses reexportados.
+        """
+        particoes = dict(self._manifesto["particoes"])
+        existentes = sorted(chave for chave in particoes if chave != SEM_DATA)
+        total = self._contar()
+        _, maior = self._limites()
+        if not existentes or maior is None:
+            return self.reconstruir()
+
+        desde = date.fromisoformat(f"{existentes[max(len(existentes) - meses, 0)]}-01")
+        exportadas = {SEM_DATA: self._exportar(SEM_DATA, "data IS NULL", {})}
+        for mes in _meses(desde, max(maior, desde)):
+            exportadas[mes.strftime("%Y-%m")] = self._exportar_mes(mes)
+        particoes.update(exportadas)
+        if sum(p["linhas"] for p in particoes.values()) != total:
+            for particao in exportadas.values():
+                os.remove(os.path.join(self.diretorio, particao["arquivo"]))
+            return self.reconstruir()
+        self._publicar(particoes, exportadas)
+
+    def iniciar_atualizacao(self, intervalo: float = 300, meses: int = 2) -> threading.Thread:
+        """
+        Carrega (ou exporta) o espelho e reexporta os meses recentes periodicamente, em segundo plano.
+
+        Enquanto a primeira carga não termina, `responder` devolve None e as queries vão ao banco.
+
+        :param intervalo: Segundos entre atualizações (0 apenas carrega).
+        :param meses: Meses reexportados a cada atualização.
+        :return: Thread iniciada.
+        """
+        def executar():
+            try:
+                if self.carregar():
+                    self.atualizar(meses)
+                else:
+                    self.reconstruir()
+            except Exception as e:
+                logger.warning("Espelho colunar indisponível; as queries seguem para o banco: %s", e)
+            while intervalo > 0:
+                time.sleep(intervalo)
+                try:
+                    self.atualizar(meses)
+                except Exception as e:
+                    logger.warning("Erro ao atualizar o espelho colunar: %s", e)
+
+        thread = threading.Thread(target=executar, daemon=True, name="espelho-colunar")
+        thread.start()
+        return thread
+
+    # Consulta
+
+    def _cursor(self, dados):
+        """Cursor do DuckDB da thread atual, com a tabela Arrow vigente registrada."""
+        local = self._local
+        if getattr(local, "cursor", None) is None:
+            with self._lock:
+                local.cursor = self._conexao.cursor()
+            local.dados = None
+        if local.dados is not dados:
+            local.cursor.register(self.tabela, dados)
+            local.dados = dados
+        return local.cursor
+
+    def responder(self, query: str, params: dict = None):
+        """
+        Executa a query no espelho local, se ela puder ser traduzida para o DuckDB.
+
+        :param query: Query T-SQL (com parâmetros :nome quando `params` é informado).
+        :param params: Valores dos parâmetros vinculados.
+        :return: DataFrame com o resultado ou None se a query precisar ir ao banco.
+        """
+        dados = self._dados
+        sql = traduzir_tsql(query, self.tabela, params is not None, self._inteiros) if dados is not None else None
+        if sql is None:
+            with self._lock:
+                self.misses += 1
+                self.nao_traduzidas += dados is not None
+            return None
+
+        # O DuckDB rejeita parâmetros que não aparecem na query
+        usados = {k: _para_duckdb(v) for k, v in (params or {}).items() if f"${k}" in sql}
+        try:
+            df = self._cursor(dados).execute(sql, usados).fetch_df()
+        except duckdb.Error as e:
+            logger.debug("Query falhou no espelho colunar (%s): %s", e, sql)
+            with self._lock:
+                self.misses += 1
+                self.falhas += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return df
+
+    def estatisticas(self) -> dict:
+        """
+        Retorna os contadores e o tamanho do espelho.
+
+        :return: Dicionário com hits, misses, taxa de acerto, queries não traduzidas, falhas no
+            DuckDB, linhas, partições, bytes e idade em segundos.
+        """
+        dados = self._dados
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "taxa_acerto": self.hits / total if total else 0.0,
+            "nao_traduzidas": self.nao_traduzidas,
+            "falhas": self.falhas,
+            "linhas": dados.num_rows if dados is not None else 0,
+            "particoes": len(self._particoes),
+            "bytes": dados.nbytes if dados is not None else 0,
+            "idade": time.time() - self._atualizado_em if self._atualizado_em else None,
+        }
+
+#----------------------------------------------------- 4.0 Fábrica -----------------------------------------------------
+
+def criar_espelho_colunar(engine, tipos: dict = None):
+    """
+    Cria o espelho colunar a partir das variáveis de ambiente e inicia sua carga em segundo plano.
+
+    - ESPELHO_COLUNAR: "true" ou "false" (padrão) para desativar.
+    - ESPELHO_COLUNAR_DIR: diretório dos arquivos Arrow (padrão data/espelho).
+    - ESPELHO_COLUNAR_INTERVALO: segundos entre atualizações incrementais (padrão 300; 0 desativa).
+    - ESPELHO_COLUNAR_MESES: meses recentes reexportados a cada atualização (padrão 2).
+    - ESPELHO_COLUNAR_BLOCO: linhas lidas do banco por bloco na exportação (padrão 50000).
+
+    :param engine: Engine do SQLAlchemy.
+    :param tipos: Tipos das colunas ({coluna: tipo}), ver `sql_params.tipos_colunas`.
+    :return: Espelho ou None se desativado ou sem as dependências (duckdb, pyarrow).
+    """
+    if os.getenv("ESPELHO_COLUNAR", "false").lower() != "true":
+        return None
+    try:
+        espelho = EspelhoColunar(
+            engine,
+            diretorio=os.getenv("ESPELHO_COLUNAR_DIR", "data/espelho"),
+            tipos=tipos,
+            tamanho_bloco=int(os.getenv("ESPELHO_COLUNAR_BLOCO", "50000")),
+        )
+    except ImportError as e:
+        logger.warning("%s As queries seguem para o banco.", e)
+        return None
+    espelho.iniciar_atualizacao(float(os.getenv("ESPELHO_COLUNAR_INTERVALO", "300")),
+                                int(os.getenv("ESPELHO_COLUNAR_MESES", "2")))
+    return espelho
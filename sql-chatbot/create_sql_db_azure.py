@@ -2,15 +2,19 @@
 #pip install sqlalchemy pandas pyodbc
 
 import os
-import urllib
+import time
+import argparse
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, inspect, text
+from sqlalchemy import inspect, text
 from sqlalchemy.types import (
     Integer, Float, String, Date, DateTime, Boolean
 )
 from sqlalchemy.exc import SQLAlchemyError
 
+from db_engine import obter_engine
+
 #------------------------------------------------------ 2.0 Setup ------------------------------------------------------
 
 # Load environment variables
@@ -18,31 +22,14 @@ load_dotenv('.env')
 # Define the environment type (DEV, PROD, etc.)
 env_type = "DEV"
 
-# Get the Azure SQL configurations from environment variables
-server = os.getenv(f"AZURE_SQL_SERVER_{env_type}")
+# Get the Azure SQL database name (used in log messages)
 database = os.getenv(f"AZURE_SQL_DATABASE_{env_type}")
-username = os.getenv(f"AZURE_SQL_USERNAME_{env_type}")
-password = os.getenv(f"AZURE_SQL_PASSWORD_{env_type}")
-driver = os.getenv("SQL_DRIVER")
-
-# Construir a string de conexão ODBC
-odbc_str = (
-    f'DRIVER={{{driver}}};'
-    f'SERVER={server};'
-    f'DATABASE={database};'
-    f'UID={username};'
-    f'PWD={password};'
-    'Encrypt=yes;'
-    'TrustServerCertificate=no;'
-    'Connection Timeout=30;'
-)
 
-# URL-encode a string ODBC
-params = urllib.parse.quote_plus(odbc_str)
+# Shared engine with configurable pool settings (see db_engine.py)
+engine = obter_engine(env_type)
 
-# Construir a URL de conexão SQLAlchemy com pyodbc
-connection_string = f'mssql+pyodbc:///?odbc_connect={params}'
-engine = create_engine(connection_string)
+# Engine for the bulk load: pyodbc sends each chunk's parameters as a single array
+bulk_engine = obter_engine(env_type, fast_executemany=True)
 
 #---------------------------------------------------- 3.0 Functions ----------------------------------------------------
 
@@ -58,12 +45,36 @@ def map_dtype(dtype):
     else:
         return String(255)
 
+# Colunas carregadas e seus tipos no CSV (evita inferência e colunas object desnecessárias)
+TARGET_COLUMNS = ['data', 'feridos', 'longitude', 'latitude', 'tipo_acid', 'dia_sem', 'hora', 'regiao']
+CSV_DTYPES = {
+    'data': 'string',
+    'feridos': 'Int32',
+    'longitude': 'float64',
+    'latitude': 'float64',
+    'tipo_acid': 'string',
+    'dia_sem': 'string',
+    'hora': 'string',
+    'regiao': 'string',
+}
+CHECKPOINT_TABLE = '_load_checkpoint'
+
+def read_csv_chunks(csv_path, chunksize=50_000, nrows=None):
+    # Ler o CSV em blocos, apenas com as colunas de interesse e tipos explícitos
+    return pd.read_csv(
+        csv_path,
+        sep=';',
+        encoding='utf-8',
+        usecols=TARGET_COLUMNS,
+        dtype=CSV_DTYPES,
+        chunksize=chunksize,
+        nrows=nrows,
+    )
+
 def create_table_from_csv(engine, table_name, csv_path, drop_if_exist=None):
     try:
-        # Ler o CSV em um DataFrame
-        df = pd.read_csv(csv_path, sep=';', encoding='utf-8')
-        target_columns = ['data', 'feridos', 'longitude', 'latitude', 'tipo_acid', 'dia_sem', 'hora', 'regiao']
-        df = df[target_columns].head(5000)
+        # Uma amostra do CSV basta para definir o schema da tabela
+        df = next(iter(read_csv_chunks(csv_path, chunksize=1000, nrows=1000)))[TARGET_COLUMNS]
 
         # Inferir os tipos de dados do SQLAlchemy
         dtype_mapping = {col: map_dtype(dtype) for col, dtype in df.dtypes.items()}
@@ -79,25 +90,137 @@ def create_table_from_csv(engine, table_name, csv_path, drop_if_exist=None):
                     connection.execute(text(f"DROP TABLE [{table_name}]"))
                 # Criar a tabela novamente
                 df.head(0).to_sql(table_name, con=engine, index=False, if_exists='fail', dtype=dtype_mapping)
+                # A carga anterior deixou de existir junto com a tabela
+                reset_checkpoint(engine, table_name)
                 print(f"Tabela '{table_name}' recriada com sucesso.")
             else:
                 print(f"A tabela '{table_name}' já existe no banco de dados '{database}'. Nenhuma ação foi realizada.")
         else:
             # Criar a tabela no banco de dados
             df.head(0).to_sql(table_name, con=engine, index=False, if_exists='fail', dtype=dtype_mapping)
+            reset_checkpoint(engine, table_name)
             print(f"Tabela '{table_name}' criada com sucesso.")
     except Exception as e:
         print(f"Erro inesperado: {e}")
 
+def ensure_checkpoint_table(engine):
+    # Tabela de controle: um registro por bloco carregado, gravado na mesma transação dos dados
+    with engine.begin() as connection:
+        connection.execute(text(f"""
+            IF OBJECT_ID('{CHECKPOINT_TABLE}', 'U') IS NULL
+            CREATE TABLE [{CHECKPOINT_TABLE}] (
+                table_name NVARCHAR(128) NOT NULL,
+                source NVARCHAR(400) NOT NULL,
+                chunk_id INT NOT NULL,
+                rows_loaded INT NOT NULL,
+                loaded_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+                PRIMARY KEY (table_name, source, chunk_id)
+            )
+        """))
+
+def reset_checkpoint(engine, table_name):
+    ensure_checkpoint_table(engine)
+    with engine.begin() as connection:
+        connection.execute(text(f"DELETE FROM [{CHECKPOINT_TABLE}] WHERE table_name = :table_name"),
+                           {"table_name": table_name})
+
+def source_fingerprint(csv_path, chunksize):
+    # Identifica o arquivo pelo nome, tamanho e data de modificação; um CSV novo gera uma nova carga.
+    # Os checkpoints guardam o índice do bloco, então o tamanho do bloco também faz parte da origem
+    stat = os.stat(csv_path)
+    return f"{os.path.basename(csv_path)}|{stat.st_size}|{int(stat.st_mtime)}|{chunksize}"
+
+def check_resume_chunksize(engine, table_name, source):
+    # Retomar o mesmo arquivo com outro --chunksize pularia ou repetiria linhas: a carga é recusada
+    file_part, chunksize = source.rsplit("|", 1)
+    file_name = file_part.split("|")[0]
+    with engine.connect() as connection:
+        result = connection.execute(
+            text(f"SELECT DISTINCT source FROM [{CHECKPOINT_TABLE}] WHERE table_name = :table_name"),
+            {"table_name": table_name},
+        )
+        previous = [row[0] for row in result]
+    for other in previous:
+        if other == file_part:
+            # Checkpoint anterior ao registro do tamanho do bloco: não há como conferir
+            raise ValueError(
+                f"A carga de '{file_name}' não registrou o tamanho do bloco; recrie a tabela sem --resume."
+            )
+        other_file, _, other_chunksize = other.rpartition("|")
+        if other_file == file_part and other_chunksize != chunksize:
+            raise ValueError(
+                f"A carga de '{file_name}' foi iniciada com outro tamanho de bloco ({other_chunksize}); "
+                f"retome com --chunksize {other_chunksize} ou recrie a tabela sem --resume."
+            )
+
+def loaded_chunks(engine, table_name, source):
+    with engine.connect() as connection:
+        result = connection.execute(
+            text(f"SELECT chunk_id FROM [{CHECKPOINT_TABLE}] WHERE table_name = :table_name AND source = :source"),
+            {"table_name": table_name, "source": source},
+        )
+        return {row[0] for row in result}
+
+def insert_chunk(engine, table_name, source, chunk_id, df):
+    # Valores ausentes precisam chegar ao driver como None
+    rows = list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+    columns = ", ".join(f"[{col}]" for col in df.columns)
+    placeholders = ", ".join("?" for _ in df.columns)
+
+    # Dados e checkpoint na mesma transação: um bloco é gravado por inteiro ou não é gravado
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"INSERT INTO [{table_name}] ({columns}) VALUES ({placeholders})", rows)
+        connection.exec_driver_sql(
+            f"INSERT INTO [{CHECKPOINT_TABLE}] (table_name, source, chunk_id, rows_loaded) VALUES (?, ?, ?, ?)",
+            (table_name, source, chunk_id, len(rows)),
+        )
+    return len(rows)
+
+# Carrega o CSV completo em blocos paralelos. O engine deve ser criado com fast_executemany=True.
+# Blocos já registrados em _load_checkpoint para o mesmo arquivo são ignorados, então a carga pode
+# ser interrompida e executada novamente sem duplicar linhas.
+def bulk_load_csv(engine, table_name, csv_path, chunksize=50_000, workers=4):
+    ensure_checkpoint_table(engine)
+    source = source_fingerprint(csv_path, chunksize)
+    check_resume_chunksize(engine, table_name, source)
+    done = loaded_chunks(engine, table_name, source)
+    if done:
+        print(f"Retomando a carga: {len(done)} blocos de '{source}' já carregados.")
+
+    start = time.perf_counter()
+    total_rows = 0
+    pending = set()
+
+    def collect(futures):
+        nonlocal total_rows
+        if not futures:
+            return
+        for future in futures:
+            total_rows += future.result()
+        elapsed = time.perf_counter() - start
+        print(f"{total_rows} linhas carregadas ({total_rows / elapsed:,.0f} linhas/s).")
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk-load") as executor:
+        for chunk_id, df in enumerate(read_csv_chunks(csv_path, chunksize=chunksize)):
+            if chunk_id in done:
+                continue
+            pending.add(executor.submit(insert_chunk, engine, table_name, source, chunk_id, df[TARGET_COLUMNS]))
+            # Limita os blocos em memória a duas vezes o número de workers
+            if len(pending) >= 2 * workers:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+        finished, _ = wait(pending)
+        collect(finished)
+
+    elapsed = time.perf_counter() - start
+    rate = total_rows / elapsed if elapsed else 0.0
+    print(f"Carga concluída: {total_rows} linhas em {elapsed:.1f}s ({rate:,.0f} linhas/s).")
+    return total_rows
+
 # Função para inserir dados na tabela
-def insert_data_from_csv(engine, table_name, csv_path):
+def insert_data_from_csv(engine, table_name, csv_path, chunksize=50_000, workers=4):
     try:
-        # Ler o CSV em um DataFrame
-        df = pd.read_csv(csv_path, sep=';', encoding='utf-8')
-        target_columns = ['data', 'feridos', 'longitude', 'latitude', 'tipo_acid', 'dia_sem', 'hora', 'regiao']
-        df = df[target_columns].head(5000)
-        # Inserir os dados no banco de dados
-        df.to_sql(table_name, con=engine, index=False, if_exists='append', chunksize=1000, method=None)
+        bulk_load_csv(engine, table_name, csv_path, chunksize=chunksize, workers=workers)
         print(f"Dados inseridos com sucesso na tabela '{table_name}'.")
     except SQLAlchemyError as e:
         print(f"Erro ao inserir dados: {e}")
@@ -109,11 +232,17 @@ def insert_data_from_csv(engine, table_name, csv_path):
 #------------------------------------------------------- 4.0 Main ------------------------------------------------------
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cria a tabela de acidentes e carrega o CSV no Azure SQL.")
+    parser.add_argument("--resume", action="store_true", help="Mantém a tabela e retoma a carga a partir do checkpoint.")
+    parser.add_argument("--chunksize", type=int, default=50_000)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
     table_name = "poa_acidentes_transito"
     csv_file = os.path.join('data', 'poa_acidentes_transito_from_201901_to_202409.csv')  # Ajuste conforme necessário
 
     # Criar a tabela
-    create_table_from_csv(engine, table_name, csv_file, drop_if_exist=True)
+    create_table_from_csv(engine, table_name, csv_file, drop_if_exist=not args.resume)
 
     # Inserir os dados
-    insert_data_from_csv(engine, table_name, csv_file)
\ No newline at end of file
+    insert_data_from_csv(bulk_engine, table_name, csv_file, chunksize=args.chunksize, workers=args.workers)
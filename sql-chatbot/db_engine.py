@@ -0,0 +1,196 @@
+#---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+import os
+import time
+import threading
+import urllib.parse
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+
+#-------------------------------------------------- 2.0 Configuração ---------------------------------------------------
+
+def montar_connection_string(env_type: str = "DEV", driver: str = None) -> str:
+    """
+    Monta a URL SQLAlchemy do Azure SQL a partir das variáveis de ambiente.
+
+    Se SQL_CONNECTION_URL estiver definida, ela é usada diretamente (útil para bancos locais).
+
+    :param env_type: Tipo de ambiente (DEV, PROD, etc.).
+    :param driver: Driver ODBC; se omitido, usa a variável SQL_DRIVER.
+    :return: URL de conexão do SQLAlchemy.
+    """
+    url = os.getenv("SQL_CONNECTION_URL")
+    if url:
+        return url
+
+    server = os.getenv(f"AZURE_SQL_SERVER_{env_type}")
+    database = os.getenv(f"AZURE_SQL_DATABASE_{env_type}")
+    username = os.getenv(f"AZURE_SQL_USERNAME_{env_type}")
+    password = os.getenv(f"AZURE_SQL_PASSWORD_{env_type}")
+    driver = driver or os.getenv("SQL_DRIVER")
+
+    # Construir a string de conexão ODBC
+    odbc_str = (
+        f'DRIVER={{{driver}}};'
+        f'SERVER={server};'
+        f'DATABASE={database};'
+        f'UID={username};'
+        f'PWD={password};'
+        'Encrypt=yes;'
+        'TrustServerCertificate=no;'
+        'Connection Timeout=30;'
+    )
+
+    # URL-encode a string ODBC
+    params = urllib.parse.quote_plus(odbc_str)
+
+    # Construir a URL de conexão SQLAlchemy com pyodbc
+    return f'mssql+pyodbc:///?odbc_connect={params}'
+
+
+def opcoes_pool() -> dict:
+    """
+    Lê as opções do pool de conexões das variáveis de ambiente.
+
+    - SQL_POOL_SIZE: conexões mantidas abertas (padrão 5).
+    - SQL_MAX_OVERFLOW: conexões extras permitidas em picos (padrão 10).
+    - SQL_POOL_TIMEOUT: segundos aguardando uma conexão livre (padrão 30).
+    - SQL_POOL_RECYCLE: segundos até reciclar uma conexão; abaixo do timeout de ociosidade do Azure (padrão 1800).
+    - SQL_POOL_PRE_PING: testa a conexão antes de entregá-la (padrão true).
+
+    :return: Dicionário de opções para `criar_engine`.
+    """
+    return {
+        "pool_size": int(os.getenv("SQL_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("SQL_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("SQL_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("SQL_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv("SQL_POOL_PRE_PING", "true").lower() == "true",
+    }
+
+#----------------------------------------------- 3.0 Pool Instrumentado ------------------------------------------------
+
+class PoolInstrumentado(QueuePool):
+    """QueuePool que contabiliza quantas vezes e por quanto tempo um checkout esperou por conexão livre."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock_metricas = threading.Lock()
+        self.checkouts = 0
+        self.esperas = 0
+        self.tempo_espera = 0.0
+
+    def _do_get(self):
+        # Sem conexões ociosas e sem overflow disponível o checkout fica bloqueado até uma devolução
+        sem_livres = self.checkedin() == 0 and self._max_overflow > -1 and self.overflow() >= self._max_overflow
+        inicio = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            duracao = time.perf_counter() - inicio
+            with self._lock_metricas:
+                self.checkouts += 1
+                if sem_livres:
+                    self.esperas += 1
+                    self.tempo_espera += duracao
+
+#----------------------------------------------- 4.0 Fábrica de Engines ------------------------------------------------
+
+_engines = {}
+_lock = threading.Lock()
+
+
+def criar_engine(connection_string: str, fast_executemany: bool = False, **opcoes):
+    """
+    Cria um engine com pool instrumentado e opções de pool configuráveis.
+
+    :param connection_string: URL de conexão do SQLAlchemy.
+    :param fast_executemany: Habilita o envio de parâmetros em lote do pyodbc (cargas em massa).
+    :param opcoes: Opções de pool; as ausentes são lidas de `opcoes_pool()`.
+    :return: Engine do SQLAlchemy.
+    """
+    opcoes = {**opcoes_pool(), **opcoes}
+    kwargs = {}
+
+    if connection_string.startswith("mssql+pyodbc"):
+        kwargs["fast_executemany"] = fast_executemany
+        # O pooling do ODBC duplica o pool do SQLAlchemy; SQL_ODBC_POOLING permite ajustá-lo
+        pooling_odbc = os.getenv("SQL_ODBC_POOLING")
+        if pooling_odbc is not None:
+            import pyodbc
+            pyodbc.pooling = pooling_odbc.lower() == "true"
+
+    return create_engine(connection_string, poolclass=PoolInstrumentado, **opcoes, **kwargs)
+
+
+def obter_engine(env_type: str = "DEV", driver: str = None, fast_executemany: bool = False, **opcoes):
+    """
+    Retorna o engine compartilhado do processo, criando-o na primeira chamada.
+
+    Chamadas com a mesma conexão e as mesmas opções reutilizam o mesmo engine (e o mesmo pool).
+
+    :param env_type: Tipo de ambiente (DEV, PROD, etc.).
+    :param driver: Driver ODBC; se omitido, usa a variável SQL_DRIVER.
+    :param fast_executemany: Habilita o envio de parâmetros em lote do pyodbc.
+    :param opcoes: Opções de pool que sobrescrevem as variáveis de ambiente.
+    :return: Engine do SQLAlchemy.
+    """
+    connection_string = montar_connection_string(env_type, driver)
+    chave = (connection_string, fast_executemany, tuple(sorted(opcoes.items())))
+    with _lock:
+        engine = _engines.get(chave)
+        if engine is None:
+            engine = criar_engine(connection_string, fast_executemany=fast_executemany, **opcoes)
+            _engines[chave] = engine
+    return engine
+
+#------------------------------------------- 5.0 Aquecimento e Estatísticas --------------------------------------------
+
+def aquecer_pool(engine, quantidade: int = None) -> int:
+    """
+    Abre conexões antecipadamente para que as primeiras requisições não paguem o handshake TLS + login.
+
+    :param engine: Engine do SQLAlchemy.
+    :param quantidade: Número de conexões (padrão: SQL_POOL_AQUECER, limitado ao tamanho do pool).
+    :return: Número de conexões aquecidas.
+    """
+    if quantidade is None:
+        quantidade = int(os.getenv("SQL_POOL_AQUECER", "0"))
+    quantidade = min(quantidade, engine.pool.size())
+
+    conexoes = []
+    try:
+        # As conexões precisam ficar abertas ao mesmo tempo para que o pool crie `quantidade` distintas
+        for _ in range(quantidade):
+            connection = engine.connect()
+            conexoes.append(connection)
+            connection.execute(text("SELECT 1"))
+    finally:
+        for connection in conexoes:
+            connection.close()
+    return len(conexoes)
+
+
+def estatisticas_pool(engine) -> dict:
+    """
+    Retorna o estado e as métricas do pool de conexões.
+
+    :param engine: Engine do SQLAlchemy.
+    :return: Dicionário com conexões em uso, ociosas, overflow, checkouts, esperas e tempo de espera.
+    """
+    pool = engine.pool
+    estatisticas = {
+        "tamanho": pool.size(),
+        "em_uso": pool.checkedout(),
+        "ociosas": pool.checkedin(),
+        "overflow": pool.overflow(),
+    }
+    if isinstance(pool, PoolInstrumentado):
+        with pool._lock_metricas:
+            estatisticas.update({
+                "checkouts": pool.checkouts,
+                "esperas": pool.esperas,
+                "tempo_espera_total": pool.tempo_espera,
+                "tempo_espera_medio": pool.tempo_espera / pool.esperas if pool.esperas else 0.0,
+            })
+    return estatisticas
@@ -0,0 +1,43 @@
+#---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+import re
+import zlib
+import unicodedata
+
+import numpy as np
+
+#------------------------------------------------ 2.0 Embeddings Locais ------------------------------------------------
+
+def remover_acentos(texto: str) -> str:
+    """
+    Remove acentos e normaliza para caixa baixa.
+
+    :param texto: Texto original.
+    :return: Texto sem acentos, em caixa baixa.
+    """
+    decomposto = unicodedata.normalize("NFKD", texto)
+    return "".join(c for c in decomposto if not unicodedata.combining(c)).casefold()
+
+
+def embedding_ngramas(textos, dim: int = 256, n: int = 3) -> np.ndarray:
+    """
+    Gera embeddings locais por hashing de n-gramas de caracteres, sem modelo externo.
+
+    Cada texto é projetado em `dim` posições via CRC32 dos n-gramas de cada palavra; o resultado
+    é normalizado para norma 1, de forma que o produto interno equivale à similaridade de cosseno.
+
+    :param textos: Lista de textos.
+    :param dim: Dimensão do vetor.
+    :param n: Tamanho dos n-gramas de caracteres.
+    :return: Matriz float32 de formato (len(textos), dim).
+    """
+    matriz = np.zeros((len(textos), dim), dtype=np.float32)
+    for i, texto in enumerate(textos):
+        for palavra in re.findall(r"\w+", remover_acentos(texto)):
+            palavra = f"<{palavra}>"
+            for j in range(max(1, len(palavra) - n + 1)):
+                h = zlib.crc32(palavra[j:j + n].encode("utf-8"))
+                # O bit mais alto define o sinal, reduzindo o viés das colisões
+                matriz[i, h % dim] += 1.0 if h & 0x80000000 else -1.0
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    normas[normas == 0] = 1.0
+    return matriz / normas
@@ -0,0 +1,249 @@
+#---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+#---------------------------------------------- 2.0 Normalização e Chaves ----------------------------------------------
+
+def normalizar_texto(texto: str) -> str:
+    """
+    Normaliza a entrada do usuário para que variações triviais gerem a mesma chave de cache.
+
+    :param texto: Texto em linguagem natural.
+    :return: Texto em caixa baixa, sem espaços redundantes e sem pontuação final.
+    """
+    texto = unicodedata.normalize("NFC", texto).casefold()
+    texto = re.sub(r"\s+", " ", texto).strip()
+    return texto.rstrip(" .?!;")
+
+
+# Partes do dicionário de dados que acompanham os dados, não o schema (faixas de valores do
+# snapshot, ver schema_snapshot.py): uma nova carga não invalida o cache nem os templates aprendidos
+CHAVES_VOLATEIS = ("ranges",)
+
+
+def hash_dicionario(data_dictionary: dict, completo: bool = False) -> str:
+    """
+    Calcula um hash estável do dicionário de dados, de forma que alterações no schema invalidem o cache.
+
+    :param data_dictionary: Dicionário de dados da base de dados.
+    :param completo: Inclui as CHAVES_VOLATEIS de cada tabela.
+    :return: Hash hexadecimal do dicionário.
+    """
+    if not completo:
+        tabelas = {
+            tabela: {k: v for k, v in info.items() if k not in CHAVES_VOLATEIS}
+            for tabela, info in data_dictionary.get("tables", {}).items()
+        }
+        data_dictionary = {**data_dictionary, "tables": tabelas}
+    serializado = json.dumps(data_dictionary, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(serializado.encode("utf-8")).hexdigest()[:16]
+
+
+def gerar_chave(etapa: str, entrada, data_dictionary: dict) -> str:
+    """
+    Gera a chave de cache de uma etapa do pipeline.
+
+    :param etapa: Nome da etapa (e.g., "intencao", "query").
+    :param entrada: Entrada já normalizada da etapa (string ou estrutura serializável em JSON).
+    :param data_dictionary: Dicionário de dados utilizado no prompt.
+    :return: Chave hexadecimal.
+    """
+    conteudo = json.dumps([etapa, entrada, hash_dicionario(data_dictionary)], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+#------------------------------------------------ 3.0 Backends de Cache ------------------------------------------------
+
+class _CacheBase:
+    """Contadores de acertos e falhas compartilhados pelos backends."""
+
+    def __init__(self):
+        self._lock_contadores = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _contar(self, acerto: bool):
+        with self._lock_contadores:
+            if acerto:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def estatisticas(self) -> dict:
+        """
+        Retorna os contadores de acertos e falhas do cache.
+
+        :return: Dicionário com hits, misses, taxa de acerto e número de entradas.
+        """
+        total = self.hits + self.misses
+        return {
+            "backend": type(self).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "taxa_acerto": self.hits / total if total else 0.0,
+            "entradas": len(self),
+        }
+
+
+class CacheMemoria(_CacheBase):
+    """Cache em memória com despejo LRU e expiração por TTL."""
+
+    def __init__(self, capacidade: int = 1024, ttl: float = 3600):
+        super().__init__()
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._dados)
+
+    def get(self, chave: str):
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is not None and time.monotonic() - item[1] > self.ttl:
+                del self._dados[chave]
+                item = None
+            if item is not None:
+                self._dados.move_to_end(chave)
+        self._contar(item is not None)
+        return item[0] if item is not None else None
+
+    def set(self, chave: str, valor: str):
+        with self._lock:
+            self._dados[chave] = (valor, time.monotonic())
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.capacidade:
+                self._dados.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._dados.clear()
+
+
+class CacheSQLite(_CacheBase):
+    """
+    Cache persistente em arquivo SQLite, compartilhado entre processos e mantido entre reinicializações.
+
+    Usa journal WAL para permitir leitores concorrentes enquanto um worker escreve. O despejo LRU é
+    aplicado a cada `intervalo_despejo` escritas para não pagar um COUNT(*) por inserção.
+    """
+
+    def __init__(self, caminho: str, capacidade: int = 100_000, ttl: float = 86400, intervalo_despejo: int = 100):
+        super().__init__()
+        self.caminho = caminho
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self.intervalo_despejo = intervalo_despejo
+        self._local = threading.local()
+        self._escritas = 0
+        with self._conexao() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    chave TEXT PRIMARY KEY,
+                    valor TEXT NOT NULL,
+                    criado_em REAL NOT NULL,
+                    acessado_em REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_acessado_em ON llm_cache (acessado_em)")
+
+    def _conexao(self) -> sqlite3.Connection:
+        # Conexões sqlite3 não podem ser compartilhadas entre threads; mantém uma por thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.caminho, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def __len__(self):
+        return self._conexao().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    def get(self, chave: str):
+        agora = time.time()
+        conn = self._conexao()
+        row = conn.execute(
+            "SELECT valor FROM llm_cache WHERE chave = ? AND criado_em > ?",
+            (chave, agora - self.ttl),
+        ).fetchone()
+        if row is not None:
+            with conn:
+                conn.execute("UPDATE llm_cache SET acessado_em = ? WHERE chave = ?", (agora, chave))
+        self._contar(row is not None)
+        return row[0] if row is not None else None
+
+    def set(self, chave: str, valor: str):
+        agora = time.time()
+        conn = self._conexao()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (chave, valor, criado_em, acessado_em) VALUES (?, ?, ?, ?)",
+                (chave, valor, agora, agora),
+            )
+        self._escritas += 1
+        if self._escritas % self.intervalo_despejo == 0:
+            self._despejar(agora)
+
+    def _despejar(self, agora: float):
+        conn = self._conexao()
+        with conn:
+            conn.execute("DELETE FROM llm_cache WHERE criado_em <= ?", (agora - self.ttl,))
+            conn.execute("""
+                DELETE FROM llm_cache WHERE chave IN (
+                    SELECT chave FROM llm_cache ORDER BY acessado_em DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.capacidade,))
+
+    def clear(self):
+        conn = self._conexao()
+        with conn:
+            conn.execute("DELETE FROM llm_cache")
+
+
+class CacheDesativado(_CacheBase):
+    """Backend nulo: nunca armazena nada, mas mantém os contadores para comparação."""
+
+    def __len__(self):
+        return 0
+
+    def get(self, chave: str):
+        self._contar(False)
+        return None
+
+    def set(self, chave: str, valor: str):
+        pass
+
+    def clear(self):
+        pass
+
+#----------------------------------------------------- 4.0 Fábrica -----------------------------------------------------
+
+def criar_cache_llm():
+    """
+    Cria o backend de cache das etapas de LLM a partir das variáveis de ambiente.
+
+    - LLM_CACHE_BACKEND: "memoria" (padrão), "sqlite" ou "desativado".
+    - LLM_CACHE_PATH: arquivo SQLite do backend em disco (padrão: llm_cache.sqlite).
+    - LLM_CACHE_TTL: tempo de vida das entradas em segundos.
+    - LLM_CACHE_CAPACIDADE: número máximo de entradas.
+
+    :return: Instância do backend de cache.
+    """
+    backend = os.getenv("LLM_CACHE_BACKEND", "memoria").lower()
+    ttl = float(os.getenv("LLM_CACHE_TTL", "3600"))
+    capacidade = int(os.getenv("LLM_CACHE_CAPACIDADE", "1024"))
+
+    if backend == "sqlite":
+        caminho = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite")
+        return CacheSQLite(caminho, capacidade=capacidade, ttl=ttl)
+    if backend == "desativado":
+        return CacheDesativado()
+    return CacheMemoria(capacidade=capacidade, ttl=ttl)
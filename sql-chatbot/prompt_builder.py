@@ -0,0 +1,190 @@
+#---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+import textwrap
+import threading
+from string import Formatter
+
+from llm_cache import hash_dicionario
+from tokens import contar_tokens
+
+#------------------------------------------------- 2.0 Schema Compacto -------------------------------------------------
+
+def linha_coluna(coluna: str, descricao, tipo: str = None, valores: list = None, faixa: list = None) -> str:
+    """
+    Serializa uma coluna do dicionário de dados em uma linha: `- nome (tipo): descrição`.
+
+    Os domínios do snapshot do schema (ver schema_snapshot.py) vêm ao final: os valores das
+    colunas categóricas ou a faixa [mínimo, máximo] das numéricas e de data.
+
+    :param coluna: Nome da coluna.
+    :param descricao: Descrição da coluna.
+    :param tipo: Tipo da coluna, quando conhecido.
+    :param valores: Valores possíveis da coluna.
+    :param faixa: Mínimo e máximo da coluna.
+    :return: Linha da coluna.
+    """
+    linha = f"- {coluna} ({tipo}): {descricao}" if tipo else f"- {coluna}: {descricao}"
+    if valores:
+        linha += f"; valores: {', '.join(str(valor) for valor in valores)}"
+    elif faixa:
+        linha += f"; faixa: {faixa[0]} a {faixa[1]}"
+    return linha
+
+
+def _serializar(data_dictionary: dict) -> str:
+    linhas = []
+    for tabela, info in data_dictionary.get("tables", {}).items():
+        linhas.append(f"{tabela}: {info['description']}" if info.get("description") else tabela)
+        tipos, valores, faixas = info.get("types", {}), info.get("values", {}), info.get("ranges", {})
+        linhas += [
+            linha_coluna(coluna, descricao, tipos.get(coluna), valores.get(coluna), faixas.get(coluna))
+            for coluna, descricao in info.get("columns", {}).items()
+        ]
+    return "\n".join(linhas)
+
+
+# Schemas serializados por versão do dicionário e por objeto; as reduções de `contexto_schema`
+# criam versões novas, então as memórias são esvaziadas ao passar de MAX_MEMORIZADOS entradas
+MAX_MEMORIZADOS = 512
+
+_por_versao = {}
+_por_objeto = {}
+_lock = threading.Lock()
+
+
+def schema_compacto(data_dictionary: dict) -> str:
+    """
+    Serializa o dicionário de dados no formato compacto usado nos prompts.
+
+    Uma linha por tabela e uma por coluna, sem a indentação e as aspas do JSON. A serialização é
+    feita uma única vez por versão do dicionário, e o texto devolvido é sempre o mesmo para a
+    mesma versão: o prefixo dos prompts fica idêntico byte a byte entre as chamadas.
+
+    :param data_dictionary: Dicionário de dados (completo ou reduzido por `contexto_schema`).
+    :return: Schema serializado.
+    """
+    # Caminho rápido: o mesmo objeto de dicionário já serializado
+    memorizado = _por_objeto.get(id(data_dictionary))
+    if memorizado is not None and memorizado[0] is data_dictionary:
+        return memorizado[1]
+
+    # Hash do dicionário inteiro: as faixas, fora de `hash_dicionario`, também mudam o texto
+    chave = hash_dicionario(data_dictionary, completo=True)
+    with _lock:
+        texto = _por_versao.get(chave)
+        if texto is None:
+            if len(_por_versao) >= MAX_MEMORIZADOS:
+                _por_versao.clear()
+            texto = _por_versao[chave] = _serializar(data_dictionary)
+        if len(_por_objeto) >= MAX_MEMORIZADOS:
+            _por_objeto.clear()
+        _por_objeto[id(data_dictionary)] = (data_dictionary, texto)
+    return texto
+
+#------------------------------------------- 3.0 Prompts com Prefixo Estável -------------------------------------------
+
+# O prompt caching do Azure OpenAI só vale a partir de 1024 tokens idênticos no início do prompt e
+# cresce em incrementos de 128 tokens
+CACHE_MIN_TOKENS = 1024
+CACHE_INCREMENTO_TOKENS = 128
+
+
+def tokens_cacheaveis(tokens_prefixo: int) -> int:
+    """Tokens do prefixo que o prompt caching do Azure OpenAI pode reaproveitar."""
+    if tokens_prefixo < CACHE_MIN_TOKENS:
+        return 0
+    return CACHE_MIN_TOKENS + (tokens_prefixo - CACHE_MIN_TOKENS) // CACHE_INCREMENTO_TOKENS * CACHE_INCREMENTO_TOKENS
+
+
+class PromptEstavel:
+    """
+    Prompt dividido em um prefixo estático e um sufixo com as variáveis de cada pergunta.
+
+    O prefixo (instruções + schema compacto) vem primeiro e não depende da pergunta; o sufixo
+    traz as variáveis, cada uma uma única vez. Chamadas com o mesmo schema repetem o prefixo
+    byte a byte, o que permite ao Azure OpenAI reaproveitá-lo do prompt caching.
+
+    Os tokens são contados localmente (`tokens.contar_tokens`) antes do envio: o prefixo uma
+    vez por schema e o sufixo a cada chamada.
+
+    :param nome: Nome do prompt (e.g., "intencao").
+    :param instrucoes: Instruções fixas, sem variáveis.
+    :param sufixo: Parte variável, com as variáveis no formato {nome}.
+    """
+
+    def __init__(self, nome: str, instrucoes: str, sufixo: str):
+        self.nome = nome
+        self.instrucoes = textwrap.dedent(instrucoes).strip()
+        self.sufixo = textwrap.dedent(sufixo).strip()
+        self.variaveis = [campo for _, campo, _, _ in Formatter().parse(self.sufixo) if campo]
+        self._prefixos = {}
+        self._lock = threading.Lock()
+        self.chamadas = 0
+        self.tokens_prompt = 0
+        self.tokens_prefixo = 0
+        self.tokens_cacheaveis = 0
+
+    def prompt_template(self):
+        """PromptTemplate do LangChain equivalente, com o schema na variável `data_dictionary`."""
+        # Importado aqui: o LangChain só é carregado quando as chains são montadas
+        from langchain.prompts import PromptTemplate
+
+        return PromptTemplate(
+            input_variables=["data_dictionary", *self.variaveis],
+            template=self.instrucoes + "\n\nDicionário de dados:\n{data_dictionary}\n\n" + self.sufixo,
+        )
+
+    def prefixo(self, schema: str) -> tuple:
+        """
+        Prefixo estático do prompt para um schema já serializado.
+
+        :param schema: Schema devolvido por `schema_compacto`.
+        :return: Tupla (texto do prefixo, número de tokens).
+        """
+        memorizado = self._prefixos.get(schema)
+        if memorizado is None:
+            texto = f"{self.instrucoes}\n\nDicionário de dados:\n{schema}\n\n"
+            memorizado = (texto, contar_tokens(texto))
+            with self._lock:
+                if len(self._prefixos) >= MAX_MEMORIZADOS:
+                    self._prefixos.clear()
+                self._prefixos[schema] = memorizado
+        return memorizado
+
+    def formatar(self, entradas: dict) -> str:
+        """Monta o prompt completo; `entradas["data_dictionary"]` é o schema compacto."""
+        return self.prefixo(entradas["data_dictionary"])[0] + self.sufixo.format(**entradas)
+
+    def medir(self, entradas: dict) -> dict:
+        """
+        Conta os tokens do prompt sem enviá-lo e acumula as estatísticas.
+
+        :param entradas: Variáveis do prompt, com o schema compacto em "data_dictionary".
+        :return: Atributos para o span da chamada: tokens estimados do prompt e do prefixo,
+                 tokens cacheáveis e a razão entre os tokens cacheáveis e o total.
+        """
+        _, tokens_prefixo = self.prefixo(entradas["data_dictionary"])
+        # O prefixo termina em quebra de linha: a soma das partes é praticamente a contagem do texto inteiro
+        tokens_prompt = tokens_prefixo + contar_tokens(self.sufixo.format(**entradas))
+        cacheaveis = tokens_cacheaveis(tokens_prefixo)
+        with self._lock:
+            self.chamadas += 1
+            self.tokens_prompt += tokens_prompt
+            self.tokens_prefixo += tokens_prefixo
+            self.tokens_cacheaveis += cacheaveis
+        return {
+            "tokens_prompt_estimado": tokens_prompt,
+            "tokens_prefixo": tokens_prefixo,
+            "tokens_cacheaveis": cacheaveis,
+            "razao_prefixo_cache": cacheaveis / tokens_prompt if tokens_prompt else 0.0,
+        }
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {
+                "chamadas": self.chamadas,
+                "tokens_prompt": self.tokens_prompt,
+                "tokens_prefixo": self.tokens_prefixo,
+                "tokens_cacheaveis": self.tokens_cacheaveis,
+                "razao_prefixo_cache": self.tokens_cacheaveis / self.tokens_prompt if self.tokens_prompt else 0.0,
+                "prefixos": len(self._prefixos),
+            }
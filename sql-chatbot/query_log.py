@@ -0,0 +1,84 @@
+#---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+import os
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+#------------------------------------------------ 2.0 Registro de Queries ----------------------------------------------
+
+class RegistroQueries:
+    """
+    Registro em JSON Lines das queries geradas e executadas pelo pipeline.
+
+    Cada linha guarda o template, os parâmetros, o sucesso e o número de linhas. O registro é a carga
+    de trabalho real lida pelo `schema_optimizer.py` para recomendar índices e montar o benchmark.
+    Ao passar de `max_mb`, o arquivo atual vira `<caminho>.1` e um novo é iniciado.
+
+    :param caminho: Arquivo do registro.
+    :param max_mb: Tamanho máximo do arquivo antes da rotação.
+    """
+
+    def __init__(self, caminho: str, max_mb: float = 50.0):
+        self.caminho = caminho
+        self.max_bytes = int(max_mb * 1024 ** 2)
+        self.registradas = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+
+    def registrar(self, query: str, params: dict, sucesso: bool, linhas: int):
+        linha = json.dumps(
+            {"ts": time.time(), "query": query, "params": params or {}, "sucesso": sucesso, "linhas": linhas},
+            ensure_ascii=False,
+            default=str,
+        )
+        with self._lock:
+            try:
+                if os.path.exists(self.caminho) and os.path.getsize(self.caminho) > self.max_bytes:
+                    os.replace(self.caminho, f"{self.caminho}.1")
+                with open(self.caminho, "a", encoding="utf-8") as arquivo:
+                    arquivo.write(linha + "\n")
+                self.registradas += 1
+            except OSError as e:
+                logger.warning("Não foi possível gravar o registro de queries: %s", e)
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {"registradas": self.registradas, "arquivo": self.caminho}
+
+
+def ler_registro(caminho: str):
+    """
+    Lê o registro de queries, começando pelo arquivo rotacionado.
+
+    :param caminho: Arquivo do registro.
+    :return: Gerador de dicionários; linhas corrompidas são ignoradas.
+    """
+    for arquivo in (f"{caminho}.1", caminho):
+        if not os.path.exists(arquivo):
+            continue
+        with open(arquivo, encoding="utf-8") as linhas:
+            for linha in linhas:
+                try:
+                    yield json.loads(linha)
+                except json.JSONDecodeError:
+                    continue
+
+
+def criar_registro_queries():
+    """
+    Cria o registro de queries a partir das variáveis de ambiente.
+
+    SQL_LOG (padrão true) ativa o registro em SQL_LOG_ARQUIVO (padrão data/sql_log.jsonl), com
+    rotação em SQL_LOG_MAX_MB.
+
+    :return: RegistroQueries ou None se desativado.
+    """
+    if os.getenv("SQL_LOG", "true").lower() != "true":
+        return None
+    return RegistroQueries(
+        os.getenv("SQL_LOG_ARQUIVO", os.path.join("data", "sql_log.jsonl")),
+        float(os.getenv("SQL_LOG_MAX_MB", "50")),
+    )
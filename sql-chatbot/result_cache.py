@@ -0,0 +1,260 @@
+#---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+#------------------------------------------------ 2.0 Chaves e Tabelas -------------------------------------------------
+
+def normalizar_sql(query: str) -> str:
+    """
+    Normaliza o texto SQL para que diferenças de espaçamento e caixa não gerem chaves distintas.
+
+    Literais entre aspas simples são preservados como estão.
+
+    :param query: Query SQL.
+    :return: Query normalizada.
+    """
+    partes = re.split(r"('(?:[^']|'')*')", query.strip().rstrip(";"))
+    for i in range(0, len(partes), 2):
+        partes[i] = re.sub(r"\s+", " ", partes[i]).upper()
+    return "".join(partes).strip()
+
+
+def chave_resultado(query: str, params: dict = None) -> str:
+    """
+    Gera a chave de cache de um resultado a partir do SQL normalizado e dos parâmetros.
+
+    :param query: Query SQL.
+    :param params: Parâmetros vinculados à query.
+    :return: Chave hexadecimal.
+    """
+    conteudo = json.dumps([normalizar_sql(query), params or {}], sort_keys=True, default=str)
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+
+def tabelas_referenciadas(query: str) -> set:
+    """
+    Extrai os nomes das tabelas citadas em cláusulas FROM e JOIN.
+
+    :param query: Query SQL.
+    :return: Conjunto com os nomes das tabelas, sem schema e sem colchetes.
+    """
+    nomes = re.findall(r"\b(?:FROM|JOIN)\s+([\w\[\].]+)", query, re.IGNORECASE)
+    return {nome.split(".")[-1].strip("[]").lower() for nome in nomes if not nome.startswith("(")}
+
+
+def tamanho_em_bytes(df: pd.DataFrame) -> int:
+    """Memória ocupada pelo DataFrame, incluindo o conteúdo das colunas de objetos."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def somente_leitura(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Marca os arrays NumPy do DataFrame como somente leitura, sem copiá-los.
+
+    Assim o mesmo objeto pode ser devolvido a vários chamadores sem risco de um deles
+    alterar o resultado em cache. O pandas não tem API pública para isso: os blocos internos
+    (`df._mgr.blocks`) são percorridos e apenas os apoiados em arrays NumPy são congelados.
+    Colunas de extensão (e.g., Arrow, nullable) continuam graváveis; os resultados lidos do
+    banco por `pd.DataFrame.from_records` não as produzem.
+
+    :param df: DataFrame a ser protegido.
+    :return: O próprio DataFrame.
+    """
+    for bloco in getattr(getattr(df, "_mgr", None), "blocks", ()):
+        if isinstance(bloco.values, np.ndarray):
+            bloco.values.flags.writeable = False
+    return df
+
+#----------------------------------------------- 3.0 Versão das Tabelas ------------------------------------------------
+
+# Sonda padrão do SQL Server: contagem de linhas pelos metadados de partição, sem varrer a tabela
+SONDA_PADRAO = """
+    SELECT SUM(row_count)
+    FROM sys.dm_db_partition_stats
+    WHERE object_id = OBJECT_ID(:tabela) AND index_id IN (0, 1)
+"""
+
+# Demais dialetos (e.g., SQLite nos testes e no benchmark): contagem de linhas da tabela
+SONDA_GENERICA = "SELECT COUNT(*) FROM {tabela}"
+
+
+def sonda_padrao(engine, tabela: str) -> str:
+    """
+    Sonda de versão usada quando a tabela não tem uma sonda própria.
+
+    :param engine: Engine do SQLAlchemy.
+    :param tabela: Nome da tabela.
+    :return: Query da sonda; no SQL Server com o parâmetro :tabela, nos demais com o nome já citado.
+    """
+    if engine.dialect.name == "mssql":
+        return SONDA_PADRAO
+    return SONDA_GENERICA.format(tabela=engine.dialect.identifier_preparer.quote(tabela))
+
+
+class VersaoTabelas:
+    """
+    Mantém a versão de cada tabela, consultando o banco no máximo uma vez por intervalo.
+
+    A versão é o resultado de uma query barata (contagem de linhas, data máxima ou contador do
+    change tracking); qualquer alteração nesse valor invalida os resultados em cache da tabela.
+    """
+
+    def __init__(self, engine, intervalo: float = 30, sondas: dict = None):
+        self.engine = engine
+        self.intervalo = intervalo
+        self.sondas = {k.lower(): v for k, v in (sondas or {}).items()}
+        self._versoes = {}
+        self._lock = threading.Lock()
+
+    def versao(self, tabela: str):
+        """
+        Retorna a versão atual da tabela.
+
+        :param tabela: Nome da tabela.
+        :return: Valor da versão ou None se a sonda falhar.
+        """
+        agora = time.monotonic()
+        with self._lock:
+            atual = self._versoes.get(tabela)
+            if atual is not None and agora - atual[1] < self.intervalo:
+                return atual[0]
+            # Reserva o intervalo antes de consultar, evitando sondas simultâneas da mesma tabela
+            self._versoes[tabela] = (atual[0] if atual else None, agora)
+
+        try:
+            sonda = self.sondas.get(tabela) or sonda_padrao(self.engine, tabela)
+            with self.engine.connect() as connection:
+                row = connection.execute(text(sonda), {"tabela": tabela} if ":tabela" in sonda else {}).fetchone()
+            versao = tuple(str(v) for v in row) if row is not None else None
+        except Exception as e:
+            logger.warning("Erro ao consultar a versão da tabela '%s': %s", tabela, e)
+            versao = None
+
+        with self._lock:
+            self._versoes[tabela] = (versao, agora)
+        return versao
+
+#----------------------------------------------- 4.0 Cache de Resultados -----------------------------------------------
+
+class CacheResultados:
+    """
+    Cache dos DataFrames retornados por queries executadas, limitado pelo total de bytes em memória.
+
+    Cada entrada guarda a versão das tabelas no momento da execução e só é servida enquanto
+    essas versões não mudarem. Os DataFrames são devolvidos somente leitura, sem cópia.
+    """
+
+    def __init__(self, engine, max_bytes: int = 256 * 1024 ** 2, max_bytes_item: int = None,
+                 intervalo_versao: float = 30, sondas: dict = None):
+        self.max_bytes = max_bytes
+        self.max_bytes_item = max_bytes_item or max_bytes // 4
+        self.versoes = VersaoTabelas(engine, intervalo=intervalo_versao, sondas=sondas)
+        self._dados = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _versoes_atuais(self, tabelas: set):
+        versoes = {}
+        for tabela in tabelas:
+            versao = self.versoes.versao(tabela)
+            if versao is None:
+                return None
+            versoes[tabela] = versao
+        return versoes
+
+    def get(self, query: str, params: dict = None):
+        """
+        Busca o resultado em cache de uma query.
+
+        :param query: Query SQL.
+        :param params: Parâmetros vinculados à query.
+        :return: DataFrame somente leitura ou None.
+        """
+        chave = chave_resultado(query, params)
+        with self._lock:
+            item = self._dados.get(chave)
+
+        if item is not None:
+            df, versoes, _ = item
+            if self._versoes_atuais(set(versoes)) == versoes:
+                with self._lock:
+                    if chave in self._dados:
+                        self._dados.move_to_end(chave)
+                    self.hits += 1
+                return df
+            self._remover(chave)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, query: str, params: dict, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Armazena o resultado de uma query.
+
+        Resultados de queries sem tabela identificável, com tabelas de versão desconhecida ou
+        maiores que `max_bytes_item` não são armazenados.
+
+        :param query: Query SQL.
+        :param params: Parâmetros vinculados à query.
+        :param df: DataFrame de resultado.
+        :return: O DataFrame, já marcado como somente leitura quando armazenado.
+        """
+        tabelas = tabelas_referenciadas(query)
+        tamanho = tamanho_em_bytes(df)
+        if not tabelas or tamanho > self.max_bytes_item:
+            return df
+        versoes = self._versoes_atuais(tabelas)
+        if versoes is None:
+            return df
+
+        somente_leitura(df)
+        chave = chave_resultado(query, params)
+        with self._lock:
+            if chave in self._dados:
+                self._bytes -= self._dados.pop(chave)[2]
+            self._dados[chave] = (df, versoes, tamanho)
+            self._bytes += tamanho
+            while self._bytes > self.max_bytes:
+                _, (_, _, removido) = self._dados.popitem(last=False)
+                self._bytes -= removido
+        return df
+
+    def _remover(self, chave: str):
+        with self._lock:
+            item = self._dados.pop(chave, None)
+            if item is not None:
+                self._bytes -= item[2]
+
+    def clear(self):
+        with self._lock:
+            self._dados.clear()
+            self._bytes = 0
+
+    def estatisticas(self) -> dict:
+        """
+        Retorna os contadores do cache de resultados.
+
+        :return: Dicionário com hits, misses, número de entradas e bytes ocupados.
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "taxa_acerto": self.hits / total if total else 0.0,
+            "entradas": len(self._dados),
+            "bytes": self._bytes,
+        }
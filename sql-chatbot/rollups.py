@@ -0,0 +1,622 @@
+#---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+import os
+import re
+import time
+import logging
+import calendar
+import threading
+from datetime import date
+from functools import lru_cache
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from result_cache import chave_resultado, somente_leitura
+
+logger = logging.getLogger(__name__)
+
+#---------------------------------------------------- 2.0 Dimensões ----------------------------------------------------
+
+# Eixos do cubo, nesta ordem
+DIMENSOES = ("ano", "mes", "regiao", "tipo_acid", "hora")
+
+
+class Dimensao:
+    """Eixo do cubo com codificação por dicionário: cada valor distinto recebe um índice inteiro."""
+
+    def __init__(self, valores: list = None):
+        self.valores = list(valores or [])
+        self.indice = {self._chave(v): i for i, v in enumerate(self.valores)}
+
+    @staticmethod
+    def _chave(valor):
+        # Comparações de texto no SQL Server ignoram caixa e espaços à direita (collation CI)
+        return valor.rstrip().casefold() if isinstance(valor, str) else valor
+
+    def __len__(self):
+        return len(self.valores)
+
+    def copiar(self) -> "Dimensao":
+        return Dimensao(self.valores)
+
+    def codificar(self, valor) -> int:
+        """Índice do valor, criando uma nova posição se ele ainda não existir."""
+        chave = self._chave(valor)
+        i = self.indice.get(chave)
+        if i is None:
+            i = len(self.valores)
+            self.valores.append(valor)
+            self.indice[chave] = i
+        return i
+
+    def mascara(self, condicao) -> np.ndarray:
+        """Máscara booleana dos valores que satisfazem a condição (NULL nunca satisfaz)."""
+        return np.array([v is not None and condicao(v) for v in self.valores], dtype=bool)
+
+#------------------------------------------------------ 3.0 Cubo -------------------------------------------------------
+
+# Expressões que extraem as dimensões na carga, por dialeto
+EXPRESSOES_CARGA = {
+    "mssql": ("YEAR(data)", "MONTH(data)", "regiao", "tipo_acid", "DATEPART(HOUR, hora)"),
+    "sqlite": ("CAST(strftime('%Y', data) AS INTEGER)", "CAST(strftime('%m', data) AS INTEGER)",
+               "regiao", "tipo_acid", "CAST(substr(hora, 1, 2) AS INTEGER)"),
+}
+
+
+class _Estado:
+    """Fotografia imutável do cubo; atualizações criam um novo estado e trocam a referência."""
+
+    __slots__ = ("dimensoes", "contagem", "feridos", "com_feridos", "atualizado_em")
+
+    def __init__(self, dimensoes, contagem, feridos, com_feridos):
+        self.dimensoes = dimensoes
+        self.contagem = contagem
+        self.feridos = feridos
+        self.com_feridos = com_feridos
+        self.atualizado_em = time.time()
+
+
+class CuboAcidentes:
+    """
+    Agregados pré-calculados de `poa_acidentes_transito` em memória.
+
+    Guarda, para cada combinação de ano, mês, região, tipo de acidente e hora, a contagem de
+    acidentes e a soma de feridos em arrays NumPy densos. Contagens e somas filtradas ou agrupadas
+    por essas dimensões são respondidas localmente por `responder`, sem ida ao banco.
+    """
+
+    def __init__(self, engine, tabela: str = "poa_acidentes_transito", max_respostas: int = 1024):
+        self.engine = engine
+        self.tabela = tabela
+        self.max_respostas = max_respostas
+        self._estado = None
+        # Respostas já montadas da fotografia atual; descartadas a cada atualização do cubo
+        self._respostas = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _consultar(self, desde: str = None) -> list:
+        expressoes = EXPRESSOES_CARGA.get(self.engine.dialect.name, EXPRESSOES_CARGA["mssql"])
+        colunas = ", ".join(expressoes)
+        filtro = "WHERE data >= :desde" if desde else ""
+        sql = f"""
+            SELECT {colunas}, COUNT(*), SUM(feridos), COUNT(feridos)
+            FROM {self.tabela}
+            {filtro}
+            GROUP BY {colunas}
+        """
+        with self.engine.connect() as connection:
+            return connection.execute(text(sql), {"desde": desde} if desde else {}).fetchall()
+
+    @staticmethod
+    def _acumular(dimensoes: list, contagem, feridos, com_feridos, rows: list) -> tuple:
+        """Soma as linhas agregadas ao cubo, ampliando os eixos quando surgem valores novos."""
+        indices = np.array([[d.codificar(v) for d, v in zip(dimensoes, row[:5])] for row in rows],
+                           dtype=np.int64).reshape(-1, 5)
+        forma = tuple(len(d) for d in dimensoes)
+        if contagem.shape != forma:
+            ampliar = [(0, novo - atual) for novo, atual in zip(forma, contagem.shape)]
+            contagem, feridos, com_feridos = (np.pad(a, ampliar) for a in (contagem, feridos, com_feridos))
+        if len(rows):
+            posicao = tuple(indices.T)
+            valores = np.array([row[5:] for row in rows], dtype=object)
+            np.add.at(contagem, posicao, valores[:, 0].astype(np.int64))
+            np.add.at(feridos, posicao, np.array([v or 0 for v in valores[:, 1]], dtype=np.int64))
+            np.add.at(com_feridos, posicao, valores[:, 2].astype(np.int64))
+        return contagem, feridos, com_feridos
+
+    def reconstruir(self):
+        """Recalcula o cubo inteiro a partir da tabela (uma única query agregada)."""
+        inicio = time.perf_counter()
+        rows = self._consultar()
+        dimensoes = [Dimensao() for _ in DIMENSOES]
+        vazio = np.zeros((0,) * 5, dtype=np.int64)
+        arrays = self._acumular(dimensoes, vazio, vazio.copy(), vazio.copy(), rows)
+        with self._lock:
+            self._estado = _Estado(dimensoes, *arrays)
+            self._respostas.clear()
+        logger.info("Cubo de agregados construído: %d células em %.2fs.", len(rows), time.perf_counter() - inicio)
+
+    def atualizar(self, meses: int = 2):
+        """
+        Recalcula apenas os meses mais recentes do cubo.
+
+        Os `meses` últimos meses já carregados são zerados e somados novamente a partir do banco,
+        cobrindo linhas novas e correções recentes sem refazer a agregação da tabela inteira.
+
+        :param meses: Número de meses recalculados.
+        """
+        estado = self._estado
+        if estado is None:
+            return self.reconstruir()
+
+        anos, meses_dim = estado.dimensoes[0], estado.dimensoes[1]
+        periodos = [(a, m) for a in anos.valores if a is not None for m in meses_dim.valores if m is not None
+                    if estado.contagem[anos.indice[a], meses_dim.indice[m]].any()]
+        if not periodos:
+            return self.reconstruir()
+        ano, mes = max(periodos)
+        mes -= meses - 1
+        while mes < 1:
+            ano, mes = ano - 1, mes + 12
+        desde = date(ano, mes, 1)
+
+        rows = self._consultar(desde.isoformat())
+        dimensoes = [d.copiar() for d in estado.dimensoes]
+        contagem, feridos, com_feridos = estado.contagem.copy(), estado.feridos.copy(), estado.com_feridos.copy()
+        for i, a in enumerate(dimensoes[0].valores):
+            for j, m in enumerate(dimensoes[1].valores):
+                if a is not None and m is not None and (a, m) >= (desde.year, desde.month):
+                    contagem[i, j] = feridos[i, j] = com_feridos[i, j] = 0
+        arrays = self._acumular(dimensoes, contagem, feridos, com_feridos, rows)
+        with self._lock:
+            self._estado = _Estado(dimensoes, *arrays)
+            self._respostas.clear()
+
+    def iniciar_atualizacao(self, intervalo: float = 300, meses: int = 2) -> threading.Thread:
+        """
+        Atualiza os meses recentes do cubo periodicamente numa thread em segundo plano.
+
+        :param intervalo: Segundos entre atualizações.
+        :param meses: Meses recalculados a cada atualização.
+        :return: Thread iniciada.
+        """
+        def executar():
+            while True:
+                time.sleep(intervalo)
+                try:
+                    self.atualizar(meses)
+                except Exception as e:
+                    logger.warning("Erro ao atualizar o cubo de agregados: %s", e)
+
+        thread = threading.Thread(target=executar, daemon=True, name="cubo-agregados")
+        thread.start()
+        return thread
+
+    def responder(self, query: str, params: dict = None):
+        """
+        Responde a query a partir do cubo, se ela for uma agregação suportada.
+
+        Suporta COUNT(*) e SUM(feridos) sobre a tabela, com filtros =, IN, <, <=, >, >= e BETWEEN nas
+        dimensões (e faixas de `data` alinhadas a meses), GROUP BY nas dimensões, ORDER BY e TOP/LIMIT.
+
+        :param query: Query SQL (com parâmetros :nome quando `params` é informado).
+        :param params: Valores dos parâmetros vinculados.
+        :return: DataFrame com o resultado ou None se a query precisar ir ao banco.
+        """
+        estado = self._estado
+        plano = analisar_sql(query, self.tabela, params is not None) if estado is not None else None
+        if plano is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        chave = chave_resultado(query, params)
+        with self._lock:
+            df = self._respostas.get(chave)
+            if df is not None and self._estado is estado:
+                self._respostas.move_to_end(chave)
+                self.hits += 1
+                return df
+
+        df = _executar_plano(plano, estado, params or {})
+        with self._lock:
+            if df is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if self._estado is estado:
+                # Devolvido somente leitura, como no cache de resultados
+                self._respostas[chave] = somente_leitura(df)
+                while len(self._respostas) > self.max_respostas:
+                    self._respostas.popitem(last=False)
+        return df
+
+    def estatisticas(self) -> dict:
+        """
+        Retorna os contadores e o tamanho do cubo.
+
+        :return: Dicionário com hits, misses, taxa de acerto, células, bytes e idade em segundos.
+        """
+        estado = self._estado
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "taxa_acerto": self.hits / total if total else 0.0,
+            "celulas": int(estado.contagem.size) if estado else 0,
+            "bytes": int(3 * estado.contagem.nbytes) if estado else 0,
+            "idade": time.time() - estado.atualizado_em if estado else None,
+        }
+
+#-------------------------------------------------- 4.0 Roteador SQL ---------------------------------------------------
+
+# Expressões reconhecidas para cada dimensão, após `_normalizar_expressao`
+EXPRESSOES_DIMENSAO = {
+    "ano": {"YEAR(DATA)", "DATEPART(YEAR,DATA)", "DATEPART(YYYY,DATA)", "DATEPART(YY,DATA)",
+            "CAST(STRFTIME('%Y',DATA)ASINTEGER)"},
+    "mes": {"MONTH(DATA)", "DATEPART(MONTH,DATA)", "DATEPART(MM,DATA)", "DATEPART(M,DATA)",
+            "CAST(STRFTIME('%M',DATA)ASINTEGER)"},
+    "regiao": {"REGIAO"},
+    "tipo_acid": {"TIPO_ACID"},
+    "hora": {"DATEPART(HOUR,HORA)", "DATEPART(HH,HORA)", "CAST(SUBSTR(HORA,1,2)ASINTEGER)",
+             "CAST(STRFTIME('%H',HORA)ASINTEGER)"},
+}
+_DIMENSAO_POR_EXPRESSAO = {e: d for d, expressoes in EXPRESSOES_DIMENSAO.items() for e in expressoes}
+
+AGREGADOS = {"COUNT(*)": "contagem", "COUNT(1)": "contagem", "SUM(FERIDOS)": "feridos"}
+
+_OPERADORES = {
+    "=": lambda a, b: a == b,
+    "<>": lambda a, b: a != b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+
+
+def _normalizar_expressao(expressao: str, tabela: str) -> str:
+    expressao = re.sub(rf"(?i)\b(?:dbo\.)?{tabela}\.", "", expressao.replace("[", "").replace("]", ""))
+    return re.sub(r"\s+", "", expressao).upper()
+
+
+def _dividir(texto: str, separador: str) -> list:
+    """Divide o texto no separador (regex) apenas fora de parênteses e literais."""
+    partes, profundidade, inicio, i = [], 0, 0, 0
+    em_literal = False
+    padrao = re.compile(separador, re.IGNORECASE)
+    # Separadores em palavra (AND) só valem no início de uma palavra
+    em_palavra = separador[0].isalpha()
+    while i < len(texto):
+        c = texto[i]
+        if c == "'":
+            em_literal = not em_literal
+        elif not em_literal and c == "(":
+            profundidade += 1
+        elif not em_literal and c == ")":
+            profundidade -= 1
+        elif not em_literal and profundidade == 0 and not (em_palavra and i and (texto[i - 1].isalnum() or texto[i - 1] == "_")):
+            match = padrao.match(texto, i)
+            if match and match.end() > i:
+                partes.append(texto[inicio:i].strip())
+                inicio = i = match.end()
+                continue
+        i += 1
+    partes.append(texto[inicio:].strip())
+    return partes
+
+
+def _valor(termo: str, com_params: bool):
+    """Converte um termo do SQL em referência de valor: ("param", nome) ou ("literal", valor)."""
+    termo = termo.strip()
+    if com_params and re.fullmatch(r":\w+", termo):
+        return ("param", termo[1:])
+    match = re.fullmatch(r"N?'((?:[^']|'')*)'", termo)
+    if match:
+        return ("literal", match.group(1).replace("''", "'"))
+    if re.fullmatch(r"-?\d+", termo):
+        return ("literal", int(termo))
+    return None
+
+
+def _analisar_condicao(condicao: str, tabela: str, com_params: bool):
+    match = re.fullmatch(r"(.+?)\s+(?:NOT\s+)?BETWEEN\s+(.+?)\s+AND\s+(.+)", condicao, re.IGNORECASE | re.DOTALL)
+    if match:
+        if re.search(r"\bNOT\s+BETWEEN\b", condicao, re.IGNORECASE):
+            return None
+        expressao, inferior, superior = match.groups()
+        valores = (_valor(inferior, com_params), _valor(superior, com_params))
+        return (expressao, "BETWEEN", valores) if None not in valores else None
+
+    match = re.fullmatch(r"(.+?)\s+IN\s*(\(.*\)|:\w+)", condicao, re.IGNORECASE | re.DOTALL)
+    if match:
+        expressao, lista = match.groups()
+        if lista.startswith(":"):
+            valores = [_valor(lista, com_params)]
+        else:
+            valores = [_valor(v, com_params) for v in _dividir(lista[1:-1], ",")]
+        return (expressao, "IN", valores) if None not in valores else None
+
+    match = re.fullmatch(r"(.+?)\s*(<>|!=|<=|>=|=|<|>)\s*(.+)", condicao, re.DOTALL)
+    if match:
+        expressao, operador, termo = match.groups()
+        valor = _valor(termo, com_params)
+        return (expressao, operador, valor) if valor is not None else None
+    return None
+
+
+@lru_cache(maxsize=1024)
+def analisar_sql(query: str, tabela: str = "poa_acidentes_transito", com_params: bool = False):
+    """
+    Reconhece uma agregação sobre a tabela respondível pelo cubo.
+
+    O plano resultante depende apenas do texto, por isso é memorizado por template.
+
+    :param query: Query SQL.
+    :param tabela: Tabela coberta pelo cubo.
+    :param com_params: Indica se a query usa parâmetros :nome.
+    :return: Plano (dicionário) ou None se a query não for suportada.
+    """
+    sql = query.strip().rstrip(";").strip()
+    if com_params:
+        sql = sql.replace(r"\:", ":")
+    match = re.fullmatch(
+        rf"SELECT\s+(?:TOP\s*\(?\s*(?P<top>\d+|:\w+)\s*\)?\s+)?(?P<selecao>.+?)"
+        rf"\s+FROM\s+(?:\[?dbo\]?\.)?\[?{tabela}\]?"
+        rf"(?:\s+WHERE\s+(?P<where>.+?))?"
+        rf"(?:\s+GROUP\s+BY\s+(?P<grupo>.+?))?"
+        rf"(?:\s+ORDER\s+BY\s+(?P<ordem>.+?))?"
+        rf"(?:\s+LIMIT\s+(?P<limit>\d+|:\w+))?",
+        sql, re.IGNORECASE | re.DOTALL,
+    )
+    if not match or re.search(r"\b(OR|NOT\s+IN|LIKE|DISTINCT|HAVING|JOIN|UNION|OVER)\b", sql, re.IGNORECASE):
+        return None
+
+    # Lista do SELECT: dimensões e agregados, com alias opcional
+    selecao = []
+    for item in _dividir(match.group("selecao"), ","):
+        partes = re.fullmatch(r"(.+?)(?:\s+(?:AS\s+)?\[?(\w+)\]?)?", item, re.IGNORECASE | re.DOTALL)
+        expressao, alias = partes.groups()
+        normalizada = _normalizar_expressao(expressao, tabela)
+        if normalizada in AGREGADOS:
+            selecao.append(("agregado", AGREGADOS[normalizada], alias or expressao.strip(), normalizada))
+        elif normalizada in _DIMENSAO_POR_EXPRESSAO:
+            selecao.append(("dimensao", _DIMENSAO_POR_EXPRESSAO[normalizada], alias or expressao.strip(), normalizada))
+        else:
+            return None
+
+    # GROUP BY: todas as dimensões selecionadas e somente elas
+    grupo = []
+    if match.group("grupo"):
+        for expressao in _dividir(match.group("grupo"), ","):
+            normalizada = _normalizar_expressao(expressao, tabela)
+            if normalizada not in _DIMENSAO_POR_EXPRESSAO:
+                return None
+            grupo.append(_DIMENSAO_POR_EXPRESSAO[normalizada])
+    if sorted({s[1] for s in selecao if s[0] == "dimensao"}) != sorted(set(grupo)):
+        return None
+
+    # WHERE: condições ligadas por AND sobre as dimensões ou sobre `data`
+    filtros = []
+    if match.group("where"):
+        condicoes = []
+        for parte in _dividir(match.group("where"), r"AND\b"):
+            # "x BETWEEN a AND b" foi dividido no AND do BETWEEN; junta as duas metades
+            if condicoes and re.search(r"\bBETWEEN\b", condicoes[-1], re.IGNORECASE) \
+                    and not re.search(r"\bBETWEEN\b.+\bAND\b", condicoes[-1], re.IGNORECASE | re.DOTALL):
+                condicoes[-1] = f"{condicoes[-1]} AND {parte}"
+            else:
+                condicoes.append(parte)
+        for condicao in condicoes:
+            analisada = _analisar_condicao(condicao, tabela, com_params)
+            if analisada is None:
+                return None
+            expressao, operador, valor = analisada
+            normalizada = _normalizar_expressao(expressao, tabela)
+            if normalizada == "DATA":
+                if operador == "IN":
+                    return None
+                filtros.append(("data", operador, valor))
+            elif normalizada in _DIMENSAO_POR_EXPRESSAO:
+                filtros.append((_DIMENSAO_POR_EXPRESSAO[normalizada], operador, valor))
+            else:
+                return None
+
+    # ORDER BY: colunas do resultado por alias, expressão ou posição
+    ordem = []
+    if match.group("ordem"):
+        for item in _dividir(match.group("ordem"), ","):
+            partes = re.fullmatch(r"(.+?)(?:\s+(ASC|DESC))?", item, re.IGNORECASE | re.DOTALL)
+            referencia, direcao = partes.groups()
+            normalizada = _normalizar_expressao(referencia, tabela)
+            for posicao, (_, _, nome, expressao) in enumerate(selecao):
+                if normalizada in (expressao, nome.upper()) or normalizada == str(posicao + 1):
+                    ordem.append((posicao, (direcao or "ASC").upper() == "DESC"))
+                    break
+            else:
+                return None
+
+    limite = match.group("top") or match.group("limit")
+    return {
+        "selecao": selecao,
+        "grupo": grupo,
+        "filtros": filtros,
+        "ordem": ordem,
+        "limite": _valor(limite, com_params) if limite else None,
+    }
+
+
+def _resolver(referencia, params: dict):
+    tipo, valor = referencia
+    if tipo == "param":
+        if valor not in params:
+            raise KeyError(valor)
+        return params[valor]
+    return valor
+
+
+def _mes_da_data(valor, inicio: bool):
+    """Converte um limite de `data` em (ano, mês) se ele coincidir com o início ou o fim de um mês."""
+    try:
+        dia = date.fromisoformat(str(valor)[:10])
+    except ValueError:
+        return None
+    if len(str(valor)) > 10 and not re.fullmatch(r".{10}[ T]00:00(:00(\.0+)?)?", str(valor)):
+        return None
+    if inicio and dia.day == 1:
+        return dia.year, dia.month
+    if not inicio and dia.day == calendar.monthrange(dia.year, dia.month)[1]:
+        return dia.year, dia.month
+    return None
+
+
+def _mascara_data(estado: _Estado, operador: str, valor):
+    """Máscara (ano × mês) de uma condição sobre `data`; None se não estiver alinhada a meses."""
+    if operador == "BETWEEN":
+        inferior, superior = _mes_da_data(valor[0], True), _mes_da_data(valor[1], False)
+        if inferior is None or superior is None:
+            return None
+        condicao = lambda p: inferior <= p <= superior
+    elif operador in (">=", "<"):
+        limite = _mes_da_data(valor, True)
+        if limite is None:
+            return None
+        condicao = (lambda p: p >= limite) if operador == ">=" else (lambda p: p < limite)
+    elif operador in (">", "<="):
+        limite = _mes_da_data(valor, False)
+        if limite is None:
+            return None
+        condicao = (lambda p: p > limite) if operador == ">" else (lambda p: p <= limite)
+    else:
+        return None
+    anos, meses = estado.dimensoes[0].valores, estado.dimensoes[1].valores
+    return np.array([[a is not None and m is not None and condicao((a, m)) for m in meses] for a in anos],
+                    dtype=bool)
+
+
+def _condicao_dimensao(operador: str, valor, texto: bool):
+    if operador == "IN":
+        alvos = {Dimensao._chave(v) for v in valor}
+        return lambda v: Dimensao._chave(v) in alvos
+    if operador == "BETWEEN":
+        if texto:
+            return None
+        return lambda v: valor[0] <= v <= valor[1]
+    if texto and operador not in ("=", "<>", "!="):
+        return None
+    alvo = Dimensao._chave(valor)
+    comparar = _OPERADORES[operador]
+    return lambda v: comparar(Dimensao._chave(v), alvo)
+
+
+def _executar_plano(plano: dict, estado: _Estado, params: dict):
+    """Avalia o plano sobre o cubo; devolve None se algum valor não puder ser comparado localmente."""
+    try:
+        mascaras = [np.ones(len(d), dtype=bool) for d in estado.dimensoes]
+        mascara_data = None
+        for dimensao, operador, referencia in plano["filtros"]:
+            if operador == "IN":
+                valor = [v for r in referencia for v in np.atleast_1d(_resolver(r, params)).tolist()]
+            elif operador == "BETWEEN":
+                valor = tuple(_resolver(r, params) for r in referencia)
+            else:
+                valor = _resolver(referencia, params)
+
+            if dimensao == "data":
+                mascara = _mascara_data(estado, operador, valor)
+                if mascara is None:
+                    return None
+                mascara_data = mascara if mascara_data is None else mascara_data & mascara
+                continue
+
+            eixo = DIMENSOES.index(dimensao)
+            texto = dimensao in ("regiao", "tipo_acid")
+            valores = valor if isinstance(valor, (list, tuple)) else [valor]
+            # Dimensões numéricas só aceitam números; texto só aceita texto
+            if any(isinstance(v, str) != texto or isinstance(v, bool) for v in valores):
+                return None
+            condicao = _condicao_dimensao(operador, valor, texto)
+            if condicao is None:
+                return None
+            mascaras[eixo] &= estado.dimensoes[eixo].mascara(condicao)
+    except (KeyError, TypeError):
+        return None
+
+    selecionados = [np.flatnonzero(m) for m in mascaras]
+    recorte = np.ix_(*selecionados)
+    contagem = estado.contagem[recorte]
+    feridos = estado.feridos[recorte]
+    com_feridos = estado.com_feridos[recorte]
+    if mascara_data is not None:
+        filtro = mascara_data[np.ix_(selecionados[0], selecionados[1])][:, :, None, None, None]
+        contagem, feridos, com_feridos = contagem * filtro, feridos * filtro, com_feridos * filtro
+
+    eixos_grupo = sorted(DIMENSOES.index(d) for d in set(plano["grupo"]))
+    eixos_soma = tuple(i for i in range(len(DIMENSOES)) if i not in eixos_grupo)
+    contagem, feridos, com_feridos = (a.sum(axis=eixos_soma) for a in (contagem, feridos, com_feridos))
+
+    if eixos_grupo:
+        # Apenas os grupos com alguma linha, como no GROUP BY do banco
+        posicoes = np.nonzero(contagem)
+    else:
+        # Sem GROUP BY a agregação devolve sempre uma linha, mesmo sem acidentes
+        contagem, feridos, com_feridos = (np.atleast_1d(a) for a in (contagem, feridos, com_feridos))
+        posicoes = (np.zeros(1, dtype=np.int64),)
+
+    colunas = {}
+    for tipo, alvo, nome, _ in plano["selecao"]:
+        if tipo == "dimensao":
+            k = eixos_grupo.index(DIMENSOES.index(alvo))
+            valores = estado.dimensoes[DIMENSOES.index(alvo)].valores
+            codigos = selecionados[DIMENSOES.index(alvo)][posicoes[k]]
+            colunas[nome] = [valores[c] for c in codigos]
+        elif alvo == "contagem":
+            colunas[nome] = contagem[posicoes].astype(np.int64)
+        else:
+            somas = feridos[posicoes]
+            nulos = com_feridos[posicoes] == 0
+            colunas[nome] = somas.astype(np.int64) if not nulos.any() else \
+                [None if n else int(v) for v, n in zip(somas, nulos)]
+
+    df = pd.DataFrame(colunas)
+    if plano["ordem"] and len(df) > 1:
+        nomes = [plano["selecao"][posicao][2] for posicao, _ in plano["ordem"]]
+        df = df.sort_values(nomes, ascending=[not desc for _, desc in plano["ordem"]], kind="stable",
+                            na_position="first").reset_index(drop=True)
+    if plano["limite"] is not None:
+        try:
+            df = df.head(int(_resolver(plano["limite"], params)))
+        except (KeyError, TypeError, ValueError):
+            return None
+    return df
+
+#----------------------------------------------------- 5.0 Fábrica -----------------------------------------------------
+
+def criar_cubo(engine):
+    """
+    Constrói o cubo de agregados a partir das variáveis de ambiente.
+
+    - ROLLUPS: "true" (padrão) ou "false" para desativar.
+    - ROLLUP_INTERVALO: segundos entre atualizações incrementais (padrão 300; 0 desativa).
+    - ROLLUP_MESES: meses recentes recalculados a cada atualização (padrão 2).
+
+    :param engine: Engine do SQLAlchemy.
+    :return: Cubo construído ou None se desativado ou se a construção falhar.
+    """
+    if os.getenv("ROLLUPS", "true").lower() != "true":
+        return None
+    cubo = CuboAcidentes(engine)
+    try:
+        cubo.reconstruir()
+    except Exception as e:
+        logger.warning("Cubo de agregados indisponível; as queries seguem para o banco: %s", e)
+        return None
+    intervalo = float(os.getenv("ROLLUP_INTERVALO", "300"))
+    if intervalo > 0:
+        cubo.iniciar_atualizacao(intervalo, int(os.getenv("ROLLUP_MESES", "2")))
+    return cubo
@@ -0,0 +1,411 @@
+#---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+import os
+import re
+import time
+import argparse
+import statistics
+from collections import Counter
+
+import pandas as pd
+from dotenv import load_dotenv
+from sqlalchemy import inspect, text
+
+from db_engine import obter_engine
+from create_sql_db_azure import read_csv_chunks, TARGET_COLUMNS
+from query_log import ler_registro
+from sql_params import preparar
+
+#------------------------------------------------------ 2.0 Setup ------------------------------------------------------
+
+load_dotenv('.env')
+env_type = "DEV"
+
+TABELA = "poa_acidentes_transito"
+
+# Categorias com até este número de valores distintos são candidatas a tabela de códigos
+MAX_CATEGORIAS = 64
+# Acima deste número de valores distintos a coluna deixa de ser acompanhada valor a valor
+MAX_DISTINTOS = 1000
+
+_DATA_ISO = re.compile(r"^\d{4}-\d{2}-\d{2}(?:[ T]00:00(?::00(?:\.0+)?)?)?$")
+_DATA_BR = re.compile(r"^\d{2}/\d{2}/\d{4}$")
+_DATAHORA = re.compile(r"^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?$")
+_HORA = re.compile(r"^\d{1,2}:\d{2}(?::\d{2})?$")
+
+#----------------------------------------------- 3.0 Inferência de Tipos -----------------------------------------------
+
+def _tipo_inteiro(minimo: int, maximo: int) -> str:
+    if minimo >= 0 and maximo <= 255:
+        return "TINYINT"
+    if -32768 <= minimo and maximo <= 32767:
+        return "SMALLINT"
+    if -2 ** 31 <= minimo and maximo < 2 ** 31:
+        return "INT"
+    return "BIGINT"
+
+
+def _cp1252(valor: str) -> bool:
+    try:
+        valor.encode("cp1252")
+        return True
+    except UnicodeEncodeError:
+        return False
+
+
+def inferir_tipos(csv_path: str, chunksize: int = 100_000) -> dict:
+    """
+    Infere o tipo SQL mais estreito de cada coluna lendo o CSV inteiro, bloco a bloco.
+
+    Textos que são sempre datas viram DATE, horários viram TIME(0), números inteiros usam o menor
+    inteiro que comporta a faixa observada e os demais textos viram VARCHAR do tamanho máximo
+    (NVARCHAR só se houver caracteres fora do cp1252).
+
+    :param csv_path: Caminho do CSV de origem.
+    :param chunksize: Linhas por bloco de leitura.
+    :return: Dicionário coluna -> {"tipo", "conversao", "distintos", "nulos", "observacao"}.
+    """
+    perfis = {coluna: {"nulos": 0, "total": 0, "valores": set(), "muitos": False, "max_len": 0,
+                       "iso": True, "br": True, "datahora": True, "hora": True, "cp1252": True,
+                       "min": None, "max": None, "inteiro": True, "texto": False}
+              for coluna in TARGET_COLUMNS}
+
+    for df in read_csv_chunks(csv_path, chunksize=chunksize):
+        for coluna in TARGET_COLUMNS:
+            perfil = perfis[coluna]
+            serie = df[coluna]
+            perfil["total"] += len(serie)
+            perfil["nulos"] += int(serie.isna().sum())
+            serie = serie.dropna()
+            if serie.empty:
+                continue
+            if pd.api.types.is_numeric_dtype(serie.dtype):
+                minimo, maximo = serie.min(), serie.max()
+                perfil["min"] = minimo if perfil["min"] is None else min(perfil["min"], minimo)
+                perfil["max"] = maximo if perfil["max"] is None else max(perfil["max"], maximo)
+                # Colunas float do CSV (coordenadas) continuam FLOAT mesmo com valores inteiros
+                perfil["inteiro"] &= pd.api.types.is_integer_dtype(serie.dtype)
+            else:
+                perfil["texto"] = True
+                serie = serie.astype(str).str.strip()
+                perfil["max_len"] = max(perfil["max_len"], int(serie.str.len().max()))
+                for chave, padrao in (("iso", _DATA_ISO), ("br", _DATA_BR), ("datahora", _DATAHORA),
+                                      ("hora", _HORA)):
+                    if perfil[chave]:
+                        perfil[chave] = bool(serie.str.match(padrao).all())
+                if perfil["cp1252"]:
+                    perfil["cp1252"] = all(_cp1252(v) for v in serie.unique())
+            if not perfil["muitos"]:
+                perfil["valores"].update(serie.unique().tolist())
+                if len(perfil["valores"]) > MAX_DISTINTOS:
+                    perfil["muitos"], perfil["valores"] = True, set()
+
+    tipos = {}
+    for coluna, perfil in perfis.items():
+        distintos = None if perfil["muitos"] else len(perfil["valores"])
+        origem = f"[{coluna}]"
+        observacao = ""
+        if perfil["total"] == perfil["nulos"]:
+            tipo, conversao = "VARCHAR(1)", origem
+        elif not perfil["texto"]:
+            if perfil["inteiro"]:
+                tipo = _tipo_inteiro(int(perfil["min"]), int(perfil["max"]))
+                conversao = f"TRY_CONVERT({tipo}, {origem})"
+            else:
+                # Coordenadas precisam da precisão dupla: REAL perderia metros
+                tipo, conversao = "FLOAT", f"TRY_CONVERT(FLOAT, {origem})"
+        elif perfil["iso"]:
+            tipo, conversao = "DATE", f"TRY_CONVERT(DATE, {origem}, 23)"
+        elif perfil["br"]:
+            tipo, conversao = "DATE", f"TRY_CONVERT(DATE, {origem}, 103)"
+        elif perfil["datahora"]:
+            tipo, conversao = "DATETIME2(0)", f"TRY_CONVERT(DATETIME2(0), {origem}, 120)"
+        elif perfil["hora"]:
+            tipo, conversao = "TIME(0)", f"TRY_CONVERT(TIME(0), {origem})"
+        else:
+            prefixo = "" if perfil["cp1252"] else "N"
+            tipo, conversao = f"{prefixo}VARCHAR({max(perfil['max_len'], 1)})", f"LTRIM(RTRIM({origem}))"
+            if distintos is not None and distintos <= MAX_CATEGORIAS:
+                observacao = f"categoria com {distintos} valores: candidata a tabela de códigos"
+        tipos[coluna] = {
+            "tipo": tipo,
+            "conversao": conversao,
+            "distintos": distintos,
+            "nulos": perfil["nulos"],
+            "observacao": observacao,
+        }
+    return tipos
+
+#---------------------------------------------- 4.0 Recomendação de Índices --------------------------------------------
+
+_LITERAIS = re.compile(r"(?<!\w)N?'(?:[^']|'')*'")
+
+
+def _clausula(sql: str, inicio: str, fins: str) -> str:
+    m = re.search(rf"\b{inicio}\b(.*?)(?=\b(?:{fins})\b|$)", sql, re.IGNORECASE | re.DOTALL)
+    return m.group(1) if m else ""
+
+
+def colunas_da_query(query: str, colunas: list) -> dict:
+    """
+    Classifica as colunas citadas na query pelo papel que têm no plano.
+
+    :param query: Query SQL.
+    :param colunas: Colunas da tabela.
+    :return: Dicionário com os conjuntos "igualdade", "faixa", "agrupamento", "ordenacao" e
+        "selecionadas", e "asterisco" (SELECT *).
+    """
+    sql = _LITERAIS.sub("''", query)
+    onde = _clausula(sql, "WHERE", "GROUP|ORDER|HAVING|OPTION")
+    grupo = _clausula(sql, r"GROUP\s+BY", "HAVING|ORDER|OPTION")
+    ordem = _clausula(sql, r"ORDER\s+BY", "OFFSET|OPTION|LIMIT")
+    selecao = _clausula(sql, "SELECT", "FROM")
+
+    papeis = {"igualdade": set(), "faixa": set(), "agrupamento": set(), "ordenacao": set(), "selecionadas": set()}
+    for coluna in colunas:
+        c = re.escape(coluna)
+        if re.search(rf"\b{c}\b\s*(?:=|\bIN\b)", onde, re.IGNORECASE):
+            papeis["igualdade"].add(coluna)
+        elif re.search(rf"\b{c}\b\s*(?:[<>]|\bBETWEEN\b|\bLIKE\b)|\w+\s*\([^()]*\b{c}\b[^()]*\)\s*(?:=|[<>]|\bIN\b)",
+                       onde, re.IGNORECASE):
+            # Funções sobre a coluna (YEAR(data) = x) são reescritas como faixa pelo guarda de custo
+            papeis["faixa"].add(coluna)
+        if re.search(rf"\b{c}\b", grupo, re.IGNORECASE):
+            papeis["agrupamento"].add(coluna)
+        if re.search(rf"\b{c}\b", ordem, re.IGNORECASE):
+            papeis["ordenacao"].add(coluna)
+        if re.search(rf"\b{c}\b", selecao, re.IGNORECASE):
+            papeis["selecionadas"].add(coluna)
+    papeis["asterisco"] = bool(re.search(r"(?<![\w(])\*", selecao))
+    return papeis
+
+
+def recomendar_indices(registros: list, colunas: list, chave_clusterizada: str = "data",
+                       min_frequencia: float = 0.05, max_indices: int = 5) -> list:
+    """
+    Recomenda índices não clusterizados de cobertura a partir das queries registradas.
+
+    A chave do índice são as colunas filtradas por igualdade seguidas da coluna filtrada por faixa
+    (ou as colunas agrupadas, se não houver filtro); as demais colunas lidas entram no INCLUDE, para
+    que a query seja respondida só pelo índice. Um filtro apenas por faixa de `chave_clusterizada` já
+    é atendido pelo índice clusterizado. Quando uma chave é prefixo de outra, um único índice, com a
+    chave mais longa, atende às duas.
+
+    :param registros: Queries registradas (dicionários com "query" e "sucesso").
+    :param colunas: Colunas da tabela.
+    :param chave_clusterizada: Coluna do índice clusterizado.
+    :param min_frequencia: Fração mínima da carga que uma chave precisa atender.
+    :param max_indices: Número máximo de índices recomendados.
+    :return: Lista de {"chave", "include", "consultas"} em ordem de frequência.
+    """
+    frequencia = Counter()
+    includes = {}
+    total = 0
+    for registro in registros:
+        if not registro.get("sucesso", True):
+            continue
+        total += 1
+        papeis = colunas_da_query(registro["query"], colunas)
+        faixa = sorted(papeis["faixa"] - papeis["igualdade"])
+        chave = tuple(sorted(papeis["igualdade"])) + tuple(faixa[:1])
+        if not chave:
+            chave = tuple(sorted(papeis["agrupamento"]))
+        if not chave or chave == (chave_clusterizada,):
+            continue
+        frequencia[chave] += 1
+        lidas = set() if papeis["asterisco"] else (
+            papeis["agrupamento"] | papeis["ordenacao"] | papeis["selecionadas"] | set(faixa[1:])
+        )
+        includes.setdefault(chave, set()).update(lidas - set(chave))
+
+    minimo = max(2, min_frequencia * total)
+    recomendados = []
+    for chave, consultas in frequencia.most_common():
+        if consultas < minimo:
+            break
+        chave = list(chave)
+        absorvido = next((r for r in recomendados
+                          if r["chave"][:len(chave)] == chave or chave[:len(r["chave"])] == r["chave"]), None)
+        if absorvido is not None:
+            if len(chave) > len(absorvido["chave"]):
+                absorvido["chave"] = chave
+            colunas_lidas = set(absorvido["include"]) | includes[tuple(chave)]
+            absorvido["include"] = sorted(colunas_lidas - set(absorvido["chave"]))
+            absorvido["consultas"] += consultas
+            continue
+        if len(recomendados) < max_indices:
+            recomendados.append({"chave": chave, "include": sorted(includes[tuple(chave)]), "consultas": consultas})
+    return recomendados
+
+
+def tipo_dicionario(tipo_sql: str) -> str:
+    """Tipo correspondente em `column_types` do backend.py (conversão dos parâmetros e espelho colunar)."""
+    if tipo_sql in ("TINYINT", "SMALLINT", "INT", "BIGINT"):
+        return "int"
+    if tipo_sql == "FLOAT":
+        return "float"
+    if tipo_sql == "DATE":
+        return "date"
+    if tipo_sql.startswith("DATETIME"):
+        return "datetime"
+    return "str"
+
+
+def ddl_indice(tabela: str, indice: dict) -> str:
+    nome = f"ix_{tabela}_{'_'.join(indice['chave'])}"
+    chave = ", ".join(f"[{c}]" for c in indice["chave"])
+    include = f" INCLUDE ({', '.join(f'[{c}]' for c in indice['include'])})" if indice["include"] else ""
+    return f"CREATE NONCLUSTERED INDEX [{nome}] ON [{tabela}] ({chave}){include}"
+
+#------------------------------------------------ 5.0 Aplicação no Banco -----------------------------------------------
+
+def tipos_atuais(engine, tabela: str) -> dict:
+    return {c["name"]: str(c["type"]) for c in inspect(engine).get_columns(tabela)}
+
+
+def espaco_ocupado_mb(engine, tabela: str) -> float:
+    """Espaço reservado pela tabela e seus índices, em MB (SQL Server)."""
+    with engine.connect() as connection:
+        linha = connection.execute(text("EXEC sp_spaceused :tabela"), {"tabela": tabela}).fetchone()
+    return float(str(linha.reserved).split()[0]) / 1024
+
+
+def reconstruir_tabela(engine, tabela: str, tipos: dict, chave_clusterizada: str = "data"):
+    """
+    Recria a tabela com os tipos inferidos e o índice clusterizado em `chave_clusterizada`.
+
+    Os dados são copiados para `<tabela>_otimizada` (heap, carga com TABLOCK), o índice clusterizado é
+    construído depois da carga e as tabelas são trocadas por sp_rename. A original fica como
+    `<tabela>_original` para comparação e rollback.
+    """
+    nova, antiga = f"{tabela}_otimizada", f"{tabela}_original"
+    colunas = ", ".join(f"[{c}] {t['tipo']} NULL" for c, t in tipos.items())
+    destino = ", ".join(f"[{c}]" for c in tipos)
+    origem = ", ".join(t["conversao"] for t in tipos.values())
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP TABLE IF EXISTS [{nova}]"))
+        connection.execute(text(f"CREATE TABLE [{nova}] ({colunas})"))
+        connection.execute(text(f"INSERT INTO [{nova}] WITH (TABLOCK) ({destino}) SELECT {origem} FROM [{tabela}]"))
+        connection.execute(text(
+            f"CREATE CLUSTERED INDEX [cix_{tabela}_{chave_clusterizada}] ON [{nova}] ([{chave_clusterizada}])"
+        ))
+        connection.execute(text(f"DROP TABLE IF EXISTS [{antiga}]"))
+        connection.execute(text("EXEC sp_rename :de, :para"), {"de": tabela, "para": antiga})
+        connection.execute(text("EXEC sp_rename :de, :para"), {"de": nova, "para": tabela})
+    print(f"Tabela '{tabela}' reconstruída; a versão anterior ficou em '{antiga}'.")
+
+
+def criar_indices(engine, tabela: str, indices: list):
+    for indice in indices:
+        ddl = ddl_indice(tabela, indice)
+        with engine.begin() as connection:
+            connection.execute(text(ddl))
+        print(f"Índice criado: {ddl}")
+
+#----------------------------------------------------- 6.0 Benchmark ---------------------------------------------------
+
+def carga_de_trabalho(registros: list, max_consultas: int = 20) -> list:
+    """As queries bem-sucedidas mais frequentes do registro, com os parâmetros da última execução."""
+    contagem = Counter()
+    params = {}
+    for registro in registros:
+        if registro.get("sucesso", True):
+            contagem[registro["query"]] += 1
+            params[registro["query"]] = registro.get("params") or {}
+    return [(query, params[query]) for query, _ in contagem.most_common(max_consultas)]
+
+
+def medir(engine, consultas: list, repeticoes: int = 3) -> list:
+    """
+    Mediana do tempo de execução de cada query, incluindo a leitura de todas as linhas.
+
+    :return: Lista de milissegundos na ordem de `consultas` (None para queries que falharam).
+    """
+    tempos = []
+    for query, params in consultas:
+        execucoes = []
+        try:
+            for _ in range(repeticoes):
+                inicio = time.perf_counter()
+                with engine.connect() as connection:
+                    connection.execute(preparar(query, params), params).fetchall()
+                execucoes.append((time.perf_counter() - inicio) * 1000)
+            tempos.append(statistics.median(execucoes))
+        except Exception as e:
+            print(f"Falha ao medir a query: {e}")
+            tempos.append(None)
+    return tempos
+
+
+def _ms(valor) -> str:
+    return "-" if valor is None else f"{valor:.1f}"
+
+
+def relatorio(tabela: str, antes: dict, tipos: dict, indices: list, consultas: list, tempos_antes: list,
+              tempos_depois: list = None, espaco: tuple = (None, None), aplicado: bool = False) -> str:
+    """Monta o relatório em Markdown: tipos, espaço, índices e tempos antes/depois."""
+    linhas = [f"# Otimização do schema de `{tabela}`", ""]
+    linhas += ["## Tipos das colunas", "", "| Coluna | Antes | Depois | Observação |", "|---|---|---|---|"]
+    for coluna, tipo in tipos.items():
+        linhas.append(f"| {coluna} | {antes.get(coluna, '-')} | {tipo['tipo']} | {tipo['observacao']} |")
+
+    linhas += ["", "Tipos correspondentes em `column_types` (backend.py), a atualizar após a reconstrução:", "",
+               "```python", "{" + ", ".join(f'"{c}": "{tipo_dicionario(t["tipo"])}"' for c, t in tipos.items()) + "}",
+               "```"]
+
+    if espaco[0] is not None:
+        depois = f"{espaco[1]:.1f} MB" if espaco[1] is not None else "-"
+        linhas += ["", "## Espaço ocupado", "", f"- Antes: {espaco[0]:.1f} MB", f"- Depois: {depois}"]
+
+    linhas += ["", "## Índices", "", "- Clusterizado em `data`" + (" (criado)" if aplicado else " (recomendado)")]
+    for indice in indices:
+        linhas.append(f"- `{ddl_indice(tabela, indice)}`: {indice['consultas']} consultas"
+                      + (" (criado)" if aplicado else " (recomendado)"))
+
+    linhas += ["", "## Consultas (mediana, ms)", "", "| # | Antes | Depois | Ganho | Query |", "|---|---|---|---|---|"]
+    for i, (query, _) in enumerate(consultas):
+        depois = tempos_depois[i] if tempos_depois else None
+        ganho = f"{tempos_antes[i] / depois:.1f}x" if tempos_antes[i] and depois else "-"
+        linhas.append(f"| {i + 1} | {_ms(tempos_antes[i])} | {_ms(depois)} | {ganho} | "
+                      f"`{' '.join(query.split())[:120]}` |")
+    return "\n".join(linhas) + "\n"
+
+#------------------------------------------------------- 7.0 Main ------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Otimiza o schema da tabela de acidentes a partir do CSV e das queries registradas.")
+    parser.add_argument("--csv", default=os.path.join('data', 'poa_acidentes_transito_from_201901_to_202409.csv'))
+    parser.add_argument("--log", default=os.getenv("SQL_LOG_ARQUIVO", os.path.join("data", "sql_log.jsonl")))
+    parser.add_argument("--relatorio", default=os.path.join("data", "relatorio_schema.md"))
+    parser.add_argument("--aplicar", action="store_true", help="Reconstrói a tabela e cria os índices; sem a opção, apenas recomenda.")
+    parser.add_argument("--max-indices", type=int, default=5)
+    parser.add_argument("--consultas", type=int, default=20, help="Queries do registro usadas no benchmark.")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args()
+
+    engine = obter_engine(env_type)
+    if args.aplicar and engine.dialect.name != "mssql":
+        parser.error("--aplicar requer o SQL Server.")
+
+    antes = tipos_atuais(engine, TABELA)
+    tipos = inferir_tipos(args.csv)
+    registros = list(ler_registro(args.log))
+    indices = recomendar_indices(registros, list(tipos), max_indices=args.max_indices)
+    consultas = carga_de_trabalho(registros, args.consultas)
+    print(f"{len(registros)} queries registradas; {len(indices)} índices recomendados.")
+
+    espaco_antes = espaco_ocupado_mb(engine, TABELA) if engine.dialect.name == "mssql" else None
+    tempos_antes = medir(engine, consultas, args.repeticoes)
+    tempos_depois, espaco_depois = None, None
+    if args.aplicar:
+        reconstruir_tabela(engine, TABELA, tipos)
+        criar_indices(engine, TABELA, indices)
+        espaco_depois = espaco_ocupado_mb(engine, TABELA)
+        tempos_depois = medir(engine, consultas, args.repeticoes)
+    else:
+        for indice in indices:
+            print(ddl_indice(TABELA, indice))
+
+    with open(args.relatorio, "w", encoding="utf-8") as arquivo:
+        arquivo.write(relatorio(TABELA, antes, tipos, indices, consultas, tempos_antes, tempos_depois,
+                                (espaco_antes, espaco_depois), args.aplicar))
+    print(f"Relatório gravado em {args.relatorio}.")
@@ -0,0 +1,189 @@
+#---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+import re
+import json
+import math
+import hashlib
+import threading
+import unicodedata
+from collections import Counter
+
+from tokens import contar_tokens
+from prompt_builder import linha_coluna, schema_compacto
+
+#--------------------------------------------------- 2.0 Tokenização ---------------------------------------------------
+
+# Palavras sem poder discriminativo nas perguntas e descrições em português
+STOPWORDS = {
+    "a", "o", "as", "os", "de", "da", "do", "das", "dos", "e", "em", "no", "na", "nos", "nas", "um", "uma",
+    "para", "por", "com", "que", "se", "ao", "aos", "ou", "qual", "quais", "quantos", "quantas", "me", "mostre",
+    "quero", "saber", "onde", "foi", "houve", "ocorreu", "numero", "informacao",
+}
+
+
+def tokenizar(texto: str) -> list:
+    """
+    Quebra um texto em termos normalizados (sem acento, caixa baixa, sem plural simples).
+
+    Nomes de colunas como `tipo_acid` são divididos em `tipo` e `acid`.
+
+    :param texto: Texto a ser tokenizado.
+    :return: Lista de termos.
+    """
+    decomposto = unicodedata.normalize("NFKD", texto)
+    texto = "".join(c for c in decomposto if not unicodedata.combining(c)).casefold()
+    termos = []
+    for termo in re.findall(r"[a-z0-9]+", texto):
+        if termo in STOPWORDS or len(termo) < 2:
+            continue
+        if len(termo) > 4 and termo.endswith("s") and not termo.isdigit():
+            termo = termo[:-1]
+        termos.append(termo)
+    return termos
+
+#----------------------------------------------------- 3.0 Índice ------------------------------------------------------
+
+class IndiceSchema:
+    """
+    Índice de tabelas e colunas do dicionário de dados, construído uma única vez.
+
+    A relevância de cada coluna combina BM25 sobre nome + descrição (da coluna e da tabela) com,
+    opcionalmente, a similaridade de cosseno entre embeddings locais da pergunta e da coluna.
+    """
+
+    def __init__(self, data_dictionary: dict, usar_vetores: bool = False, peso_vetorial: float = 0.5,
+                 k1: float = 1.2, b: float = 0.75):
+        self.data_dictionary = data_dictionary
+        self.k1 = k1
+        self.b = b
+        self.peso_vetorial = peso_vetorial
+
+        # Um documento por coluna: (tabela, coluna, frequência dos termos, número de termos)
+        self.documentos = []
+        for tabela, info in data_dictionary.get("tables", {}).items():
+            termos_tabela = tokenizar(tabela) + tokenizar(info.get("description", ""))
+            valores = info.get("values", {})
+            for coluna, descricao in info.get("columns", {}).items():
+                termos = tokenizar(coluna) * 2 + tokenizar(str(descricao)) + termos_tabela
+                # Valores das colunas categóricas (snapshot do schema): "zona sul" encontra `regiao`
+                termos += tokenizar(" ".join(str(valor) for valor in valores.get(coluna, [])))
+                self.documentos.append((tabela, coluna, Counter(termos), len(termos)))
+
+        n = len(self.documentos)
+        self.tamanho_medio = sum(d[3] for d in self.documentos) / n if n else 0.0
+        frequencia = Counter(t for d in self.documentos for t in d[2])
+        self.idf = {t: math.log(1 + (n - f + 0.5) / (f + 0.5)) for t, f in frequencia.items()}
+
+        self.vetores = None
+        if usar_vetores and self.documentos:
+            from embeddings import embedding_ngramas
+            self._embedding = embedding_ngramas
+            textos = [f"{tabela} {coluna} {data_dictionary['tables'][tabela]['columns'][coluna]}"
+                      for tabela, coluna, _, _ in self.documentos]
+            self.vetores = embedding_ngramas(textos)
+
+        self.tokens_total = contar_tokens(schema_compacto(data_dictionary))
+
+    def pontuar(self, pergunta: str) -> list:
+        """
+        Calcula a relevância de cada coluna para a pergunta.
+
+        :param pergunta: Texto da pergunta (ou da intenção).
+        :return: Lista de pontuações, na mesma ordem de `self.documentos`.
+        """
+        termos = set(tokenizar(pergunta))
+        pontuacoes = []
+        for _, _, frequencias, tamanho in self.documentos:
+            score = 0.0
+            for termo in termos & frequencias.keys():
+                tf = frequencias[termo]
+                norm = self.k1 * (1 - self.b + self.b * tamanho / self.tamanho_medio)
+                score += self.idf[termo] * tf * (self.k1 + 1) / (tf + norm)
+            pontuacoes.append(score)
+
+        if self.vetores is not None:
+            maximo = max(pontuacoes) or 1.0
+            similaridades = self.vetores @ self._embedding([pergunta])[0]
+            pontuacoes = [
+                (1 - self.peso_vetorial) * p / maximo + self.peso_vetorial * float(s)
+                for p, s in zip(pontuacoes, similaridades)
+            ]
+        return pontuacoes
+
+    def selecionar(self, pergunta: str, top_k: int = 12, max_tokens: int = 1500) -> dict:
+        """
+        Monta um dicionário de dados reduzido às colunas mais relevantes para a pergunta.
+
+        As colunas entram em ordem de relevância até atingir `top_k` ou o orçamento de tokens;
+        a ordem original das colunas é preservada no resultado para manter o prompt estável.
+
+        :param pergunta: Texto da pergunta (ou da intenção).
+        :param top_k: Número máximo de colunas.
+        :param max_tokens: Orçamento aproximado de tokens do schema serializado.
+        :return: Dicionário de dados com a mesma estrutura do original.
+        """
+        if len(self.documentos) <= top_k and self.tokens_total <= max_tokens:
+            return self.data_dictionary
+
+        pontuacoes = self.pontuar(pergunta)
+        ordem = sorted(range(len(self.documentos)), key=lambda i: -pontuacoes[i])
+
+        escolhidos = set()
+        tokens = 0
+        for i in ordem:
+            tabela, coluna, _, _ = self.documentos[i]
+            custo = self._tokens_coluna(tabela, coluna)
+            if escolhidos and tokens + custo > max_tokens:
+                break
+            escolhidos.add(i)
+            tokens += custo
+            if len(escolhidos) >= top_k:
+                break
+
+        tabelas = {}
+        for i, (tabela, coluna, _, _) in enumerate(self.documentos):
+            if i not in escolhidos:
+                continue
+            info = self.data_dictionary["tables"][tabela]
+            if tabela not in tabelas:
+                tabelas[tabela] = {k: v for k, v in info.items() if k != "columns"}
+                tabelas[tabela]["columns"] = {}
+            tabelas[tabela]["columns"][coluna] = info["columns"][coluna]
+        return {**self.data_dictionary, "tables": tabelas}
+
+    def _tokens_coluna(self, tabela: str, coluna: str) -> int:
+        info = self.data_dictionary["tables"][tabela]
+        return contar_tokens(linha_coluna(
+            coluna, info["columns"][coluna], info.get("types", {}).get(coluna),
+            info.get("values", {}).get(coluna), info.get("ranges", {}).get(coluna),
+        ))
+
+#--------------------------------------------------- 4.0 Memoização ----------------------------------------------------
+
+_indices = {}
+_lock = threading.Lock()
+
+
+def obter_indice(data_dictionary: dict, usar_vetores: bool = False) -> IndiceSchema:
+    """
+    Retorna o índice do dicionário de dados, construindo-o apenas na primeira chamada.
+
+    :param data_dictionary: Dicionário de dados da base de dados.
+    :param usar_vetores: Habilita a pontuação vetorial local (requer NumPy).
+    :return: Índice do schema.
+    """
+    # Caminho rápido: o mesmo objeto de dicionário já indexado
+    indice = _indices.get((id(data_dictionary), usar_vetores))
+    if indice is not None and indice.data_dictionary is data_dictionary:
+        return indice
+
+    serializado = json.dumps(data_dictionary, ensure_ascii=False, sort_keys=True)
+    chave = (hashlib.sha256(serializado.encode("utf-8")).hexdigest(), usar_vetores)
+    indice = _indices.get(chave)
+    if indice is None:
+        with _lock:
+            indice = _indices.get(chave)
+            if indice is None:
+                indice = IndiceSchema(data_dictionary, usar_vetores=usar_vetores)
+                _indices[chave] = indice
+            _indices[(id(data_dictionary), usar_vetores)] = indice
+    return indice
@@ -0,0 +1,325 @@
+#---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import inspect, text
+from sqlalchemy import types as sqltypes
+
+logger = logging.getLogger(__name__)
+
+#-------------------------------------------------- 2.0 Introspecção ---------------------------------------------------
+
+def tipo_simples(tipo) -> str:
+    """
+    Converte um tipo do SQLAlchemy para os tipos do dicionário de dados (ver `sql_params.CONVERSORES`).
+
+    :param tipo: Tipo refletido pelo inspector.
+    :return: "int", "float", "str", "date", "datetime" ou "bool".
+    """
+    if isinstance(tipo, sqltypes.Boolean):
+        return "bool"
+    if isinstance(tipo, sqltypes.Integer):
+        return "int"
+    if isinstance(tipo, sqltypes.Float):
+        return "float"
+    if isinstance(tipo, sqltypes.Numeric):
+        # DECIMAL(p, 0) guarda inteiros
+        return "int" if tipo.scale == 0 else "float"
+    if isinstance(tipo, sqltypes.DateTime):
+        return "datetime"
+    if isinstance(tipo, sqltypes.Date):
+        return "date"
+    return "str"
+
+
+def _perfilavel(tipo, dialeto: str) -> bool:
+    """Colunas em que COUNT(DISTINCT), MIN e MAX são válidos (sem bit, binários e TEXT/NTEXT do SQL Server)."""
+    if isinstance(tipo, (sqltypes.Boolean, sqltypes.LargeBinary, sqltypes.BINARY, sqltypes.VARBINARY)):
+        return False
+    return not (dialeto == "mssql" and isinstance(tipo, sqltypes.Text))
+
+
+def _dividir(tabela: str) -> tuple:
+    """Separa "schema.tabela" em (schema ou None, tabela)."""
+    schema, _, nome = tabela.rpartition(".")
+    return schema or None, nome
+
+
+def colunas_tabela(engine, tabela: str) -> list:
+    """
+    Reflete as colunas da tabela pelo inspector do SQLAlchemy.
+
+    :param engine: Engine do SQLAlchemy.
+    :param tabela: Nome da tabela (com o schema, se necessário).
+    :return: Lista de tuplas (nome, tipo do SQLAlchemy) na ordem da tabela.
+    """
+    schema, nome = _dividir(tabela)
+    return [(coluna["name"], coluna["type"]) for coluna in inspect(engine).get_columns(nome, schema=schema)]
+
+
+def linhas_tabela(connection, tabela: str) -> int:
+    """Número de linhas da tabela; no SQL Server pelos metadados de partição, sem varrer a tabela."""
+    if connection.dialect.name == "mssql":
+        sql = text("SELECT SUM(row_count) FROM sys.dm_db_partition_stats "
+                   "WHERE object_id = OBJECT_ID(:tabela) AND index_id IN (0, 1)")
+        return int(connection.execute(sql, {"tabela": tabela}).scalar() or 0)
+    return int(connection.execute(text(f"SELECT COUNT(*) FROM {_quote(connection, tabela)}")).scalar() or 0)
+
+
+def _quote(connection, tabela: str) -> str:
+    preparador = connection.dialect.identifier_preparer
+    return ".".join(preparador.quote(parte) for parte in tabela.split("."))
+
+#----------------------------------------------- 3.0 Domínios de Valores -----------------------------------------------
+
+# Strings em formato de data (e.g., `data` guardada como texto): MIN/MAX viram a faixa de datas
+_DATA_ISO = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def _json(valor):
+    """Valor do banco em um tipo serializável em JSON."""
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return int(valor) if valor == valor.to_integral_value() else float(valor)
+    if isinstance(valor, bytes):
+        return valor.hex()
+    return valor
+
+
+def perfilar_tabela(connection, tabela: str, colunas: list, max_distintos: int = 30) -> dict:
+    """
+    Calcula os domínios das colunas com consultas de agregação.
+
+    Uma única varredura traz COUNT(*) e, para cada coluna, COUNT(DISTINCT), MIN e MAX. Colunas
+    de texto com até `max_distintos` valores distintos têm os valores listados, do mais ao menos
+    frequente, com um GROUP BY cada; colunas numéricas e de data (ou texto em formato de data)
+    guardam a faixa [mínimo, máximo].
+
+    :param connection: Conexão do SQLAlchemy.
+    :param tabela: Nome da tabela.
+    :param colunas: Lista de tuplas (nome, tipo do SQLAlchemy).
+    :param max_distintos: Máximo de valores distintos para listar os valores da coluna.
+    :return: Dicionário com "linhas", "distintos", "values" e "ranges".
+    """
+    preparador = connection.dialect.identifier_preparer
+    perfilaveis = [(nome, tipo) for nome, tipo in colunas if _perfilavel(tipo, connection.dialect.name)]
+    partes = ["COUNT(*)"]
+    for nome, _ in perfilaveis:
+        coluna = preparador.quote(nome)
+        partes += [f"COUNT(DISTINCT {coluna})", f"MIN({coluna})", f"MAX({coluna})"]
+    origem = _quote(connection, tabela)
+    row = connection.execute(text(f"SELECT {', '.join(partes)} FROM {origem}")).fetchone()
+
+    perfil = {"linhas": int(row[0] or 0), "distintos": {}, "values": {}, "ranges": {}}
+    for i, (nome, tipo) in enumerate(perfilaveis):
+        distintos, minimo, maximo = row[1 + 3 * i: 4 + 3 * i]
+        perfil["distintos"][nome] = int(distintos or 0)
+        simples = tipo_simples(tipo)
+        if simples == "str" and 0 < distintos <= max_distintos:
+            coluna = preparador.quote(nome)
+            valores = connection.execute(text(
+                f"SELECT {coluna} FROM {origem} WHERE {coluna} IS NOT NULL GROUP BY {coluna} ORDER BY COUNT(*) DESC"
+            )).fetchall()
+            perfil["values"][nome] = [_json(valor) for (valor,) in valores]
+        elif minimo is not None and (
+            simples != "str" or (_DATA_ISO.match(str(minimo)) and _DATA_ISO.match(str(maximo)))
+        ):
+            perfil["ranges"][nome] = [_json(minimo), _json(maximo)]
+    return perfil
+
+#---------------------------------------------------- 4.0 Snapshot -----------------------------------------------------
+
+class SnapshotSchema:
+    """
+    Dicionário de dados gerado a partir do banco, versionado e persistido em disco.
+
+    Combina as descrições escritas à mão (`descricoes`, no formato do `data_dictionary`) com o que
+    o banco informa: os tipos reais das colunas (inspector do SQLAlchemy), os valores das colunas
+    categóricas e as faixas das colunas numéricas e de data (`perfilar_tabela`). No dicionário
+    resultante, "types", "values" e "ranges" acompanham "columns" em cada tabela; as descrições
+    continuam sendo strings.
+
+    O arquivo guarda apenas a parte introspectada, com a assinatura da origem (colunas, tipos e
+    número de linhas de cada tabela); as descrições são combinadas na carga. A inicialização lê o
+    arquivo, e `atualizar` só refaz a introspecção quando a assinatura muda.
+
+    :param engine: Engine do SQLAlchemy.
+    :param descricoes: Dicionário de dados escrito à mão; define as tabelas e as colunas do snapshot.
+    :param caminho: Arquivo JSON do snapshot; None mantém o snapshot só em memória.
+    :param max_distintos: Máximo de valores distintos para listar os valores de uma coluna de texto.
+    """
+
+    def __init__(self, engine, descricoes: dict, caminho: str = None, max_distintos: int = 30):
+        self.engine = engine
+        self.descricoes = descricoes
+        self.caminho = caminho
+        self.max_distintos = max_distintos
+        self.versao = 0
+        self.assinatura = None
+        self.gerado_em = None
+        self.tabelas = {}
+        self.data_dictionary = descricoes
+        self._ouvintes = []
+        self._lock = threading.Lock()
+
+    def ao_atualizar(self, funcao):
+        """Registra uma função chamada com o novo dicionário de dados a cada atualização."""
+        self._ouvintes.append(funcao)
+
+    # Persistência
+
+    def carregar(self) -> bool:
+        """
+        Lê o snapshot do disco e combina-o com as descrições.
+
+        :return: True se havia um snapshot para as tabelas de `descricoes`.
+        """
+        if not self.caminho or not os.path.exists(self.caminho):
+            return False
+        try:
+            with open(self.caminho, encoding="utf-8") as arquivo:
+                salvo = json.load(arquivo)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning("Snapshot do schema ilegível (%s); será refeito a partir do banco.", e)
+            return False
+        if set(salvo.get("tabelas", {})) != set(self.descricoes.get("tables", {})):
+            return False
+        self._aplicar(salvo["tabelas"], salvo["assinatura"], salvo["versao"], salvo["gerado_em"])
+        return True
+
+    def salvar(self):
+        if not self.caminho:
+            return
+        with self._lock:
+            conteudo = {"versao": self.versao, "assinatura": self.assinatura, "gerado_em": self.gerado_em,
+                        "tabelas": self.tabelas}
+        os.makedirs(os.path.dirname(self.caminho) or ".", exist_ok=True)
+        temporario = f"{self.caminho}.tmp"
+        with open(temporario, "w", encoding="utf-8") as arquivo:
+            json.dump(conteudo, arquivo, ensure_ascii=False, indent=1)
+        os.replace(temporario, self.caminho)
+
+    # Introspecção
+
+    def _assinatura_origem(self, connection) -> tuple:
+        """Colunas refletidas de cada tabela e a assinatura (colunas, tipos e linhas) da origem."""
+        colunas, origem = {}, {}
+        for tabela in self.descricoes.get("tables", {}):
+            colunas[tabela] = colunas_tabela(self.engine, tabela)
+            tipos = [[nome, str(tipo)] for nome, tipo in colunas[tabela]]
+            origem[tabela] = [tipos, linhas_tabela(connection, tabela)]
+        serializado = json.dumps(origem, sort_keys=True)
+        return colunas, hashlib.sha256(serializado.encode("utf-8")).hexdigest()[:16]
+
+    def atualizar(self, forcar: bool = False) -> bool:
+        """
+        Refaz o snapshot se o schema ou o número de linhas de alguma tabela mudou.
+
+        :param forcar: Refaz o snapshot mesmo sem mudança na origem.
+        :return: True se o snapshot foi refeito.
+        """
+        with self.engine.connect() as connection:
+            colunas, assinatura = self._assinatura_origem(connection)
+            if assinatura == self.assinatura and not forcar:
+                return False
+            tabelas = {}
+            for tabela, info in self.descricoes.get("tables", {}).items():
+                descritas = set(info.get("columns", {}))
+                refletidas = [(nome, tipo) for nome, tipo in colunas[tabela] if nome in descritas]
+                perfil = perfilar_tabela(connection, tabela, refletidas, self.max_distintos)
+                perfil["types"] = {nome: tipo_simples(tipo) for nome, tipo in refletidas}
+                tabelas[tabela] = perfil
+
+        self._aplicar(tabelas, assinatura, self.versao + 1, time.time())
+        self.salvar()
+        logger.info("Snapshot do schema atualizado (versão %d).", self.versao)
+        for funcao in self._ouvintes:
+            funcao(self.data_dictionary)
+        return True
+
+    def _aplicar(self, tabelas: dict, assinatura: str, versao: int, gerado_em: float):
+        """Combina a parte introspectada com as descrições e publica o novo dicionário de dados."""
+        combinado = {}
+        for tabela, info in self.descricoes.get("tables", {}).items():
+            perfil = tabelas.get(tabela, {})
+            combinado[tabela] = {
+                **info,
+                # Tipos declarados à mão valem para as colunas que o inspector não encontrou
+                "types": {**info.get("types", {}), **perfil.get("types", {})},
+                "values": perfil.get("values", {}),
+                "ranges": perfil.get("ranges", {}),
+            }
+        with self._lock:
+            self.tabelas = tabelas
+            self.assinatura = assinatura
+            self.versao = versao
+            self.gerado_em = gerado_em
+            # Um objeto novo a cada versão: os consumidores trocam a referência de uma só vez
+            self.data_dictionary = {**self.descricoes, "tables": combinado}
+
+    def iniciar_atualizacao(self, intervalo: float = 3600) -> threading.Thread:
+        """
+        Confere a origem em segundo plano: logo ao iniciar e depois a cada `intervalo` segundos.
+
+        :param intervalo: Segundos entre as verificações (0 verifica só uma vez).
+        :return: Thread iniciada.
+        """
+        def executar():
+            while True:
+                try:
+                    self.atualizar()
+                except Exception as e:
+                    logger.warning("Erro ao atualizar o snapshot do schema: %s", e)
+                if intervalo <= 0:
+                    return
+                time.sleep(intervalo)
+
+        thread = threading.Thread(target=executar, daemon=True, name="snapshot-schema")
+        thread.start()
+        return thread
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {
+                "versao": self.versao,
+                "assinatura": self.assinatura,
+                "gerado_em": self.gerado_em,
+                "tabelas": {tabela: perfil.get("linhas") for tabela, perfil in self.tabelas.items()},
+                "colunas_com_valores": sum(len(perfil.get("values", {})) for perfil in self.tabelas.values()),
+            }
+
+#----------------------------------------------------- 5.0 Fábrica -----------------------------------------------------
+
+def criar_snapshot(engine, descricoes: dict):
+    """
+    Cria o snapshot do schema a partir das variáveis de ambiente e carrega o arquivo salvo.
+
+    - SCHEMA_SNAPSHOT: "true" (padrão) ou "false" para usar apenas o dicionário escrito à mão.
+    - SCHEMA_SNAPSHOT_ARQUIVO: arquivo do snapshot (padrão data/schema_snapshot.json).
+    - SCHEMA_SNAPSHOT_MAX_DISTINTOS: máximo de valores listados por coluna de texto (padrão 30).
+
+    A verificação da origem é iniciada à parte, com `iniciar_atualizacao`; até lá (ou sem
+    arquivo salvo), `data_dictionary` é o próprio dicionário escrito à mão.
+
+    :param engine: Engine do SQLAlchemy.
+    :param descricoes: Dicionário de dados escrito à mão.
+    :return: SnapshotSchema ou None se desativado.
+    """
+    if os.getenv("SCHEMA_SNAPSHOT", "true").lower() != "true":
+        return None
+    snapshot = SnapshotSchema(
+        engine,
+        descricoes,
+        caminho=os.getenv("SCHEMA_SNAPSHOT_ARQUIVO", os.path.join("data", "schema_snapshot.json")),
+        max_distintos=int(os.getenv("SCHEMA_SNAPSHOT_MAX_DISTINTOS", "30")),
+    )
+    snapshot.carregar()
+    return snapshot
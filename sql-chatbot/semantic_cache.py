@@ -0,0 +1,227 @@
+#---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+import os
+import re
+import json
+import threading
+from collections import OrderedDict
+
+from embeddings import remover_acentos
+
+#-------------------------------------------------- 2.0 Texto e Chave --------------------------------------------------
+
+# Palavras que não mudam o sentido da pergunta. Ao contrário das stopwords do índice de schema,
+# "quantos", "mostre" e "por" são mantidas: distinguem contagem, listagem e agrupamento. Negações
+# ("nao", "sem", "nenhum") e preposições de filtro ("com") nunca entram aqui: mudam a query
+PALAVRAS_VAZIAS = {
+    "a", "o", "as", "os", "de", "da", "do", "das", "dos", "e", "em", "no", "na", "nos", "nas", "um", "uma",
+    "ao", "aos", "me", "eu", "quero", "saber", "gostaria", "favor", "qual", "quais", "transito",
+    "ocorreu", "ocorreram", "aconteceu", "aconteceram", "houve", "teve", "tiveram", "foram", "registrados",
+}
+
+# Formas equivalentes reduzidas a um único termo
+SINONIMOS = {
+    "numero": "quantos", "quantidade": "quantos", "quantas": "quantos", "total": "quantos", "contagem": "quantos",
+    "liste": "mostre", "listar": "mostre", "exiba": "mostre", "mostrar": "mostre",
+    "ultimos": "recentes", "ultimas": "recentes",
+}
+
+
+def normalizar_pergunta(pergunta: str) -> str:
+    """
+    Reduz a pergunta aos termos com conteúdo, para que paráfrases tenham os mesmos termos.
+
+    Os números são removidos; entram na chave separadamente (ver `numeros`).
+
+    :param pergunta: Pergunta do usuário.
+    :return: Termos normalizados separados por espaço.
+    """
+    texto = remover_acentos(pergunta)
+    # "no ano de 2019" equivale a "em 2019"
+    texto = re.sub(r"\b(ano|mes|dia)\s+(de\s+)?(?=\d)", "", texto)
+    termos = []
+    for termo in re.findall(r"[a-z]+", texto):
+        if termo in PALAVRAS_VAZIAS:
+            continue
+        termo = SINONIMOS.get(termo, termo)
+        if len(termo) > 4 and termo.endswith("s"):
+            termo = termo[:-1]
+        termos.append(termo)
+    return " ".join(termos)
+
+
+def numeros(texto: str) -> tuple:
+    """Números citados no texto, em ordem; perguntas com números diferentes nunca são equivalentes."""
+    return tuple(re.findall(r"\d+(?:[.,]\d+)?", texto))
+
+
+def termos_valores(intent_data: dict) -> list:
+    """Termos dos valores das entidades, que precisam aparecer na pergunta para reaproveitar a resposta."""
+    termos = set()
+    for valor in intent_data.get("entidades", {}).values():
+        for item in valor if isinstance(valor, list) else [valor]:
+            termos.update(t for t in re.findall(r"\w+", remover_acentos(str(item))) if not t.isdigit())
+    return sorted(termos)
+
+
+def chave_pergunta(pergunta: str) -> str:
+    """
+    Chave do cache: números da pergunta, em ordem, e seus termos com conteúdo, sem repetição e ordenados.
+
+    Perguntas equivalentes por paráfrase (sinônimos, plurais, palavras vazias, ordem dos termos) têm
+    a mesma chave; um termo a mais ou a menos (e.g., "de moto", "fatais", "sem feridos") muda a chave.
+
+    :param pergunta: Pergunta do usuário.
+    :return: Chave da pergunta.
+    """
+    termos = sorted(set(normalizar_pergunta(pergunta).split()))
+    return f"{' '.join(numeros(pergunta))}|{' '.join(termos)}"
+
+#------------------------------------------------- 3.0 Cache Semântico -------------------------------------------------
+
+class CacheSemantico:
+    """
+    Cache de perguntas equivalentes, indexado pela chave normalizada da pergunta (ver `chave_pergunta`).
+
+    A busca é uma consulta a um dicionário: a pergunta precisa ter os mesmos números e os mesmos
+    termos com conteúdo, negações incluídas, de uma pergunta já respondida. Uma resposta só é servida
+    se, além disso, os valores das entidades em cache aparecerem na pergunta. Com o cache cheio, a
+    entrada usada há mais tempo é descartada.
+
+    Com `caminho`, as entradas são gravadas em `<caminho>.json` por `salvar` e relidas por um novo processo.
+    """
+
+    def __init__(self, capacidade: int = 100_000, caminho: str = None):
+        self.capacidade = capacidade
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if caminho:
+            self._abrir(caminho)
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def buscar_lote(self, perguntas: list) -> list:
+        """
+        Busca em lote as respostas em cache das perguntas.
+
+        :param perguntas: Lista de perguntas.
+        :return: Lista com o dicionário em cache (intent_data, query) ou None para cada pergunta.
+        """
+        chaves = [chave_pergunta(pergunta) for pergunta in perguntas]
+        resultados = []
+
+        with self._lock:
+            for pergunta, chave in zip(perguntas, chaves):
+                resultado = None
+                entrada = self._entradas.get(chave)
+                if entrada is not None:
+                    termos = set(re.findall(r"\w+", remover_acentos(pergunta)))
+                    if set(entrada["termos"]) <= termos:
+                        self._entradas.move_to_end(chave)
+                        resultado = {"intent_data": entrada["intent_data"], "query": entrada["query"]}
+                if resultado is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                resultados.append(resultado)
+        return resultados
+
+    def buscar(self, pergunta: str):
+        """
+        Busca a resposta em cache de uma pergunta equivalente.
+
+        :param pergunta: Pergunta do usuário.
+        :return: Dicionário com intent_data e query, ou None.
+        """
+        return self.buscar_lote([pergunta])[0]
+
+    def adicionar(self, pergunta: str, intent_data: dict, query: str):
+        """
+        Armazena a intenção e a query parametrizada de uma pergunta respondida com sucesso.
+
+        Com o cache cheio, a entrada usada há mais tempo é substituída.
+
+        :param pergunta: Pergunta do usuário.
+        :param intent_data: Intenção interpretada.
+        :param query: Query parametrizada executada.
+        """
+        chave = chave_pergunta(pergunta)
+        entrada = {
+            "pergunta": pergunta,
+            "intent_data": intent_data,
+            "query": query,
+            "termos": termos_valores(intent_data),
+        }
+        with self._lock:
+            self._entradas[chave] = entrada
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.capacidade:
+                self._entradas.popitem(last=False)
+
+    def estatisticas(self) -> dict:
+        """
+        Retorna os contadores do cache semântico.
+
+        :return: Dicionário com hits, misses, taxa de acerto e número de entradas.
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "taxa_acerto": self.hits / total if total else 0.0,
+            "entradas": len(self._entradas),
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def _abrir(self, caminho: str):
+        metadados = f"{caminho}.json"
+        if not os.path.exists(metadados):
+            return
+        with open(metadados, encoding="utf-8") as f:
+            dados = json.load(f)
+        entradas = dados["entradas"]
+        if "ultimo_uso" in dados:
+            # Arquivo do índice vetorial anterior: entradas na ordem de gravação, com o último uso à parte
+            entradas = [e for _, e in sorted(zip(dados["ultimo_uso"], entradas), key=lambda par: par[0])]
+        # A chave é recalculada: a normalização pode ter mudado desde a gravação
+        for entrada in entradas[-self.capacidade:]:
+            self._entradas[chave_pergunta(entrada["pergunta"])] = {
+                campo: entrada[campo] for campo in ("pergunta", "intent_data", "query", "termos")
+            }
+
+    def salvar(self):
+        """Grava as entradas, da usada há mais tempo à mais recente (arquivo temporário + rename)."""
+        if not self.caminho:
+            return
+        with self._lock:
+            dados = {"entradas": list(self._entradas.values())}
+            temporario = f"{self.caminho}.json.tmp"
+            with open(temporario, "w", encoding="utf-8") as f:
+                json.dump(dados, f, ensure_ascii=False, default=str)
+            os.replace(temporario, f"{self.caminho}.json")
+
+#----------------------------------------------------- 4.0 Fábrica -----------------------------------------------------
+
+def criar_cache_semantico():
+    """
+    Cria o cache semântico a partir das variáveis de ambiente.
+
+    - SEMANTIC_CACHE: "true" (padrão) ou "false" para desativar.
+    - SEMANTIC_CACHE_CAPACIDADE: número máximo de perguntas (padrão 100000).
+    - SEMANTIC_CACHE_PATH: prefixo do arquivo .json das entradas (padrão: apenas em memória).
+
+    :return: Instância do cache ou None se desativado.
+    """
+    if os.getenv("SEMANTIC_CACHE", "true").lower() != "true":
+        return None
+    return CacheSemantico(
+        capacidade=int(os.getenv("SEMANTIC_CACHE_CAPACIDADE", "100000")),
+        caminho=os.getenv("SEMANTIC_CACHE_PATH"),
+    )
@@ -1,8 +1,8 @@
 
 import os
 # from langchain.llms import AzureOpenAI
-from langchain_community.llms.openai import AzureOpenAI
-from openai import AzureOpenAI
+
+from aoai_clients import obter_cliente
 
 from dotenv import load_dotenv
 import urllib
@@ -28,13 +28,12 @@ AOAI_API_KEY = os.getenv(f"AOAI_API_KEY_{env_type}")\
 #     deployment_name=AOAI_DEPLOYMENT_NAME
 # )
 
-llm = AzureOpenAI(
-    # temperature=0.7,  # Controla a criatividade das respostas
+# Cliente compartilhado do processo (pool de conexões, limite de taxa e retentativas)
+llm = obter_cliente(
+    endpoint=AOAI_ENDPOINT,
     api_key=AOAI_API_KEY,
-    azure_endpoint=AOAI_ENDPOINT,
-    # openai_api_type="azure",
     api_version='2024-06-01',
-    azure_deployment=AOAI_DEPLOYMENT_NAME
+    deployment=AOAI_DEPLOYMENT_NAME,
 )
 
 def get_chat_response(user_input: str) -> str:
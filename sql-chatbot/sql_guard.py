@@ -0,0 +1,403 @@
+#---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+import os
+import re
+import math
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from sqlalchemy import text
+
+from result_cache import chave_resultado
+from sql_params import renderizar
+
+logger = logging.getLogger(__name__)
+
+#---------------------------------------------------- 2.0 Reescritas ---------------------------------------------------
+
+# Literais, identificadores entre colchetes e entre aspas duplas; mascarados com o mesmo comprimento
+# para que as posições encontradas no SQL mascarado valham no original
+_LITERAIS = re.compile(r"(?<!\w)N?'(?:[^']|'')*'|\[[^\]]*\]|\"(?:[^\"]|\"\")*\"")
+
+# Filtros por ano que impedem o uso de índices em `data`: YEAR(col) = x e DATEPART(year, col) = x
+_FILTRO_ANO = re.compile(
+    r"\b(?:YEAR\s*\(|DATEPART\s*\(\s*(?:YEAR|YYYY|YY)\s*,)\s*(?P<coluna>[\w.]+)\s*\)\s*=\s*(?P<valor>:\w+|\d{4})\b",
+    re.IGNORECASE,
+)
+
+_SELECT = re.compile(r"\bSELECT\b(?:\s+(?:DISTINCT|ALL)\b)?", re.IGNORECASE)
+_CONJUNTOS = re.compile(r"\b(?:UNION|INTERSECT|EXCEPT)\b", re.IGNORECASE)
+
+
+def _mascarar(query: str) -> str:
+    return _LITERAIS.sub(lambda m: "_" * len(m.group(0)), query)
+
+
+def _nivel_zero(sql: str) -> list:
+    """Máscara booleana: True nas posições fora de parênteses."""
+    profundidade = 0
+    niveis = []
+    for caractere in sql:
+        if caractere == "(":
+            profundidade += 1
+        niveis.append(profundidade == 0)
+        if caractere == ")":
+            profundidade -= 1
+    return niveis
+
+
+def _ano(valor) -> int:
+    try:
+        ano = int(valor)
+    except (TypeError, ValueError):
+        return None
+    return ano if 1753 <= ano <= 9998 else None
+
+
+def filtro_ano_em_faixa(query: str, params: dict = None) -> tuple:
+    """
+    Troca `YEAR(col) = x` por `(col >= 'x-01-01' AND col < 'x+1-01-01')`.
+
+    A função sobre a coluna obriga o banco a ler a tabela inteira; a faixa permite a busca pelo índice
+    e devolve as mesmas linhas. Parâmetros ganham os limites `<nome>_inicio` e `<nome>_fim`.
+
+    :param query: Query T-SQL, com parâmetros :nome.
+    :param params: Valores dos parâmetros vinculados.
+    :return: Tupla (query, params) reescrita; a original se nada foi alterado.
+    """
+    params = dict(params or {})
+    partes = []
+    ultimo = 0
+    for m in _FILTRO_ANO.finditer(_mascarar(query)):
+        valor = m.group("valor")
+        if valor.startswith(":"):
+            nome = valor[1:]
+            ano = _ano(params.get(nome))
+            if ano is None:
+                continue
+            params[f"{nome}_inicio"], params[f"{nome}_fim"] = f"{ano:04d}-01-01", f"{ano + 1:04d}-01-01"
+            inicio, fim = f":{nome}_inicio", f":{nome}_fim"
+        else:
+            ano = _ano(valor)
+            if ano is None:
+                continue
+            inicio, fim = f"'{ano:04d}-01-01'", f"'{ano + 1:04d}-01-01'"
+        coluna = query[m.start("coluna"):m.end("coluna")]
+        partes.append(query[ultimo:m.start()])
+        partes.append(f"({coluna} >= {inicio} AND {coluna} < {fim})")
+        ultimo = m.end()
+    if not partes:
+        return query, params
+    partes.append(query[ultimo:])
+    return "".join(partes), params
+
+
+def limitar_linhas(query: str, max_linhas: int, dialeto: str = "mssql") -> str:
+    """
+    Limita o número de linhas devolvidas pelo SELECT principal, se ele ainda não tiver limite.
+
+    No SQL Server injeta `TOP (n)`; nos demais dialetos acrescenta `LIMIT n`. Queries com UNION,
+    INTERSECT ou EXCEPT no nível principal ficam como estão.
+
+    :param query: Query SQL.
+    :param max_linhas: Máximo de linhas devolvidas.
+    :param dialeto: Nome do dialeto do SQLAlchemy.
+    :return: Query limitada.
+    """
+    sql = _mascarar(query).rstrip().rstrip(";")
+    niveis = _nivel_zero(sql)
+    selects = [m for m in _SELECT.finditer(sql) if niveis[m.start()]]
+    if len(selects) != 1 or any(niveis[m.start()] for m in _CONJUNTOS.finditer(sql)):
+        return query
+
+    # Apenas o nível principal: TOP/LIMIT de subqueries não limitam o resultado
+    fora = "".join(c if n else " " for c, n in zip(sql, niveis))
+    if dialeto == "mssql":
+        fim = selects[0].end()
+        if re.match(r"\s*TOP\b", sql[fim:], re.IGNORECASE) or re.search(r"\bOFFSET\b", fora, re.IGNORECASE):
+            return query
+        return f"{query[:fim]} TOP ({int(max_linhas)}){query[fim:]}"
+
+    if re.search(r"\bLIMIT\b|\bOFFSET\b|\bFETCH\s+FIRST\b", fora, re.IGNORECASE):
+        return query
+    return f"{query[:len(sql)]} LIMIT {int(max_linhas)}"
+
+#------------------------------------------------- 3.0 Tempo Limite ----------------------------------------------------
+
+@contextmanager
+def limite_tempo(connection, segundos: float = None):
+    """
+    Aplica um tempo limite às queries executadas na conexão dentro do bloco `with`.
+
+    SQL Server (pyodbc): o atributo `timeout` da conexão, restaurado ao final para não afetar o
+    próximo uso da conexão do pool. SQLite: um progress handler que interrompe a query no prazo.
+    Nos demais dialetos o bloco roda sem tempo limite.
+
+    :param connection: Conexão do SQLAlchemy.
+    :param segundos: Tempo limite; None ou 0 não aplica limite.
+    """
+    if not segundos:
+        yield
+        return
+    bruta = connection.connection.dbapi_connection
+    dialeto = connection.dialect.name
+    if dialeto == "mssql" and hasattr(bruta, "timeout"):
+        anterior = bruta.timeout
+        bruta.timeout = max(1, math.ceil(segundos))
+        try:
+            yield
+        finally:
+            bruta.timeout = anterior
+    elif dialeto == "sqlite":
+        prazo = time.monotonic() + segundos
+        bruta.set_progress_handler(lambda: time.monotonic() > prazo, 10000)
+        try:
+            yield
+        finally:
+            bruta.set_progress_handler(None, 0)
+    else:
+        yield
+
+#------------------------------------------------ 4.0 Guarda de Custo --------------------------------------------------
+
+# Cláusula FROM até a próxima cláusula (ou o fim da subquery) e seus itens: tabelas separadas por
+# vírgula ou JOIN
+_CLAUSULA_FROM = re.compile(r"\bFROM\b(.*?)(?=\b(?:WHERE|GROUP|ORDER|HAVING|UNION|INTERSECT|EXCEPT|OPTION)\b|\)|$)",
+                            re.IGNORECASE | re.DOTALL)
+_ITENS_FROM = re.compile(r",|\b(?:(?:INNER|LEFT|RIGHT|FULL|CROSS)\s+(?:OUTER\s+)?)?JOIN\b", re.IGNORECASE)
+
+
+def _juncoes(sql: str) -> tuple:
+    """Tabelas citadas nas cláusulas FROM (sem as CTEs) e se alguma junção não tem condição (produto cartesiano)."""
+    tabelas = []
+    cartesiano = False
+    ctes = {nome.lower() for nome in re.findall(r"(\w+)\s*(?:\([^)]*\))?\s+AS\s*\(", sql, re.IGNORECASE)}
+    for clausula in _CLAUSULA_FROM.finditer(sql):
+        itens = _ITENS_FROM.split(clausula.group(1))
+        separadores = _ITENS_FROM.findall(clausula.group(1))
+        for item in itens:
+            nome = re.match(r"\s*([A-Za-z_][\w.]*)", item)
+            if nome and nome.group(1).lower() not in ctes:
+                tabelas.append(nome.group(1).lower())
+        for separador, item in zip(separadores, itens[1:]):
+            if separador == "," or separador.upper().startswith("CROSS") or \
+                    not re.search(r"\b(?:ON|USING)\b", item, re.IGNORECASE):
+                cartesiano = True
+    return tabelas, cartesiano
+
+
+class GuardaSQL:
+    """
+    Etapa entre a geração e a execução do SQL que protege o banco compartilhado.
+
+    1. Reescreve anti-padrões: filtros `YEAR(data) = x` viram faixas de datas e o SELECT principal
+       sem limite recebe TOP/LIMIT.
+    2. Estima o custo: no SQL Server pelo plano estimado (SHOWPLAN_XML, sem executar); nos demais
+       dialetos, ou se o plano falhar, pelo número de linhas das tabelas multiplicado nas junções
+       sem condição (produto cartesiano).
+    3. Compara com o orçamento: acima dele a query é rebaixada (menos linhas, MAXDOP 1 e tempo limite
+       menor); acima de `fator_rejeicao` vezes o orçamento, é rejeitada.
+
+    :param engine: Engine do SQLAlchemy.
+    :param max_linhas: Limite de linhas injetado em queries sem TOP/LIMIT.
+    :param max_custo: Orçamento em unidades de custo do plano do SQL Server.
+    :param max_linhas_lidas: Orçamento em linhas lidas, para a estimativa por estatísticas.
+    :param fator_rejeicao: Múltiplo do orçamento a partir do qual a query é rejeitada.
+    :param linhas_rebaixada: Limite de linhas de uma query rebaixada.
+    :param timeout: Tempo limite por query, em segundos.
+    :param timeout_rebaixada: Tempo limite de uma query rebaixada.
+    :param usar_plano: Consulta o plano estimado do SQL Server.
+    :param intervalo_estatisticas: Segundos entre atualizações da contagem de linhas das tabelas.
+    :param max_estimativas: Número de estimativas de custo mantidas em memória.
+    """
+
+    def __init__(self, engine, max_linhas: int = 10000, max_custo: float = 50.0,
+                 max_linhas_lidas: float = 5_000_000, fator_rejeicao: float = 10.0, linhas_rebaixada: int = 1000,
+                 timeout: float = 30.0, timeout_rebaixada: float = 10.0, usar_plano: bool = True,
+                 intervalo_estatisticas: float = 300.0, max_estimativas: int = 1024):
+        self.engine = engine
+        self.dialeto = engine.dialect.name
+        self.max_linhas = max_linhas
+        self.max_custo = max_custo
+        self.max_linhas_lidas = max_linhas_lidas
+        self.fator_rejeicao = fator_rejeicao
+        self.linhas_rebaixada = linhas_rebaixada
+        self.timeout = timeout
+        self.timeout_rebaixada = timeout_rebaixada
+        self.usar_plano = usar_plano and self.dialeto == "mssql"
+        self.intervalo_estatisticas = intervalo_estatisticas
+        self.max_estimativas = max_estimativas
+
+        self._estimativas = OrderedDict()
+        self._linhas_tabelas = {}
+        self._lock = threading.Lock()
+        self.contadores = {"avaliadas": 0, "reescritas": 0, "limitadas": 0, "rebaixadas": 0, "rejeitadas": 0}
+
+    # ---- estimativa de custo ----
+
+    def _custo_plano(self, query: str, params: dict) -> dict:
+        """Custo e linhas do plano estimado; a query não é executada."""
+        with self.engine.connect() as connection:
+            connection.exec_driver_sql("SET SHOWPLAN_XML ON")
+            try:
+                plano = connection.exec_driver_sql(renderizar(query, params or {})).scalar()
+            finally:
+                connection.exec_driver_sql("SET SHOWPLAN_XML OFF")
+        custos = [float(v) for v in re.findall(r'StatementSubTreeCost="([^"]+)"', plano or "")]
+        linhas = [float(v) for v in re.findall(r'StatementEstRows="([^"]+)"', plano or "")]
+        if not custos:
+            raise ValueError("plano sem StatementSubTreeCost")
+        return {"fonte": "plano", "custo": max(custos), "linhas": max(linhas, default=0.0)}
+
+    def _linhas_tabela(self, tabela: str) -> int:
+        """Número de linhas da tabela, das estatísticas do servidor quando disponíveis."""
+        agora = time.monotonic()
+        with self._lock:
+            em_cache = self._linhas_tabelas.get(tabela)
+        if em_cache is not None and agora - em_cache[1] < self.intervalo_estatisticas:
+            return em_cache[0]
+        nome = tabela.split(".")[-1]
+        if self.dialeto == "mssql":
+            sql = text("SELECT SUM(row_count) FROM sys.dm_db_partition_stats "
+                       "WHERE object_id = OBJECT_ID(:tabela) AND index_id IN (0, 1)")
+            argumentos = {"tabela": nome}
+        else:
+            sql, argumentos = text(f'SELECT COUNT(*) FROM "{nome}"'), {}
+        try:
+            with self.engine.connect() as connection:
+                linhas = int(connection.execute(sql, argumentos).scalar() or 0)
+        except Exception as e:
+            logger.warning("Não foi possível obter o número de linhas de %s: %s", nome, e)
+            linhas = 0
+        with self._lock:
+            self._linhas_tabelas[tabela] = (linhas, agora)
+        return linhas
+
+    def _custo_estatisticas(self, query: str) -> dict:
+        """Linhas lidas estimadas: soma das tabelas citadas, ou o produto quando há junção sem condição."""
+        tabelas, cartesiano = _juncoes(_mascarar(query))
+        linhas = [self._linhas_tabela(tabela) for tabela in tabelas]
+        if not linhas:
+            return {"fonte": "estatisticas", "custo": 0.0, "linhas": 0.0}
+        if cartesiano:
+            lidas = float(math.prod(max(n, 1) for n in linhas))
+        else:
+            lidas = float(sum(linhas))
+        return {"fonte": "estatisticas", "custo": lidas, "linhas": lidas}
+
+    def estimar(self, query: str, params: dict = None) -> dict:
+        """
+        Estima o custo da query, com as estimativas recentes em cache.
+
+        :return: Dicionário com a fonte ("plano" ou "estatisticas"), o custo e as linhas estimadas.
+        """
+        chave = chave_resultado(query, params)
+        with self._lock:
+            if chave in self._estimativas:
+                self._estimativas.move_to_end(chave)
+                return self._estimativas[chave]
+        estimativa = None
+        if self.usar_plano:
+            try:
+                estimativa = self._custo_plano(query, params)
+            except Exception as e:
+                logger.warning("Plano estimado indisponível (%s); usando as estatísticas das tabelas.", e)
+        if estimativa is None:
+            estimativa = self._custo_estatisticas(query)
+        with self._lock:
+            self._estimativas[chave] = estimativa
+            while len(self._estimativas) > self.max_estimativas:
+                self._estimativas.popitem(last=False)
+        return estimativa
+
+    # ---- decisão ----
+
+    def _rebaixar(self, query: str) -> str:
+        query = limitar_linhas(query, self.linhas_rebaixada, self.dialeto)
+        if self.dialeto == "mssql" and not re.search(r"\bOPTION\s*\(", _mascarar(query), re.IGNORECASE):
+            # Um único núcleo: a query cara não disputa os processadores com as demais
+            query = f"{query.rstrip().rstrip(';')} OPTION (MAXDOP 1)"
+        return query
+
+    def limitar(self, query: str, max_linhas: int = None) -> str:
+        """
+        Limite de linhas de `avaliar`, sem acessar o banco.
+
+        :param query: Query SQL, com parâmetros :nome.
+        :param max_linhas: Limite de linhas injetado (padrão: o do guarda).
+        :return: Query limitada.
+        """
+        return limitar_linhas(query, max_linhas or self.max_linhas, self.dialeto)
+
+    def avaliar(self, query: str, params: dict = None, max_linhas: int = None) -> dict:
+        """
+        Reescreve a query, estima o custo e decide se ela executa, é rebaixada ou rejeitada.
+
+        :param query: Query SQL, com parâmetros :nome.
+        :param params: Valores dos parâmetros vinculados.
+        :param max_linhas: Limite de linhas injetado (padrão: o do guarda).
+        :return: Dicionário com a ação ("executar", "rebaixar" ou "rejeitar"), a query e os params a
+            executar, o tempo limite, a estimativa de custo e o motivo da rejeição.
+        """
+        reescrita, novos_params = filtro_ano_em_faixa(query, params)
+        # Sem params a query roda como texto puro; só os anos literais são reescritos
+        params_exec = novos_params if params is not None else None
+        limitada = limitar_linhas(reescrita, max_linhas or self.max_linhas, self.dialeto)
+        estimativa = self.estimar(limitada, params_exec)
+
+        orcamento = self.max_custo if estimativa["fonte"] == "plano" else self.max_linhas_lidas
+        razao = estimativa["custo"] / orcamento if orcamento else 0.0
+        decisao = {"acao": "executar", "query": limitada, "params": params_exec, "timeout": self.timeout,
+                   "motivo": "", **estimativa}
+        if razao > self.fator_rejeicao:
+            decisao["acao"] = "rejeitar"
+            decisao["motivo"] = (f"Query rejeitada pelo limite de custo: custo estimado {estimativa['custo']:.0f} "
+                                 f"({estimativa['fonte']}), orçamento {orcamento:.0f}.")
+        elif razao > 1:
+            decisao.update(acao="rebaixar", query=self._rebaixar(reescrita), timeout=self.timeout_rebaixada)
+
+        with self._lock:
+            self.contadores["avaliadas"] += 1
+            self.contadores["reescritas"] += reescrita != query
+            self.contadores["limitadas"] += limitada != reescrita
+            if decisao["acao"] == "rebaixar":
+                self.contadores["rebaixadas"] += 1
+            elif decisao["acao"] == "rejeitar":
+                self.contadores["rejeitadas"] += 1
+        return decisao
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {
+                **self.contadores,
+                "estimativas_em_cache": len(self._estimativas),
+                "fonte": "plano" if self.usar_plano else "estatisticas",
+            }
+
+
+def criar_guarda(engine):
+    """
+    Cria o guarda de custo a partir das variáveis de ambiente.
+
+    SQL_GUARDA (padrão true) ativa o guarda; os limites vêm de SQL_GUARDA_MAX_LINHAS,
+    SQL_GUARDA_MAX_CUSTO, SQL_GUARDA_MAX_LINHAS_LIDAS, SQL_GUARDA_FATOR_REJEICAO,
+    SQL_GUARDA_LINHAS_REBAIXADA, SQL_GUARDA_TIMEOUT, SQL_GUARDA_TIMEOUT_REBAIXADA e SQL_GUARDA_PLANO.
+
+    :param engine: Engine do SQLAlchemy.
+    :return: GuardaSQL ou None se desativado.
+    """
+    if os.getenv("SQL_GUARDA", "true").lower() != "true":
+        return None
+    return GuardaSQL(
+        engine,
+        max_linhas=int(os.getenv("SQL_GUARDA_MAX_LINHAS", "10000")),
+        max_custo=float(os.getenv("SQL_GUARDA_MAX_CUSTO", "50")),
+        max_linhas_lidas=float(os.getenv("SQL_GUARDA_MAX_LINHAS_LIDAS", "5000000")),
+        fator_rejeicao=float(os.getenv("SQL_GUARDA_FATOR_REJEICAO", "10")),
+        linhas_rebaixada=int(os.getenv("SQL_GUARDA_LINHAS_REBAIXADA", "1000")),
+        timeout=float(os.getenv("SQL_GUARDA_TIMEOUT", "30")),
+        timeout_rebaixada=float(os.getenv("SQL_GUARDA_TIMEOUT_REBAIXADA", "10")),
+        usar_plano=os.getenv("SQL_GUARDA_PLANO", "true").lower() == "true",
+    )
@@ -0,0 +1,238 @@
+#---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+import os
+import re
+from datetime import date, datetime
+from functools import lru_cache
+
+#------------------------------------------------- 2.0 Tipos e Coerção -------------------------------------------------
+
+# Conversores dos tipos declarados em data_dictionary["tables"][tabela]["types"]
+CONVERSORES = {
+    "int": lambda v: int(float(v)) if isinstance(v, str) else int(v),
+    "float": float,
+    "str": str,
+    "date": lambda v: v if isinstance(v, date) else date.fromisoformat(str(v)[:10]),
+    "datetime": lambda v: v if isinstance(v, datetime) else datetime.fromisoformat(str(v)),
+}
+
+_INTEIRO = re.compile(r"-?\d+")
+_DECIMAL = re.compile(r"-?\d+\.\d+")
+
+
+def tipos_colunas(data_dictionary: dict) -> dict:
+    """
+    Reúne os tipos das colunas de todas as tabelas do dicionário de dados.
+
+    :param data_dictionary: Dicionário de dados da base de dados.
+    :return: Dicionário {coluna: tipo}.
+    """
+    tipos = {}
+    for info in data_dictionary.get("tables", {}).values():
+        tipos.update(info.get("types", {}))
+    return tipos
+
+
+def coagir(valor, tipo: str = None):
+    """
+    Converte o valor de uma entidade para o tipo da coluna com que será comparado.
+
+    Sem tipo conhecido, strings numéricas viram int/float (e.g., "2019" para um ano) e o resto
+    é mantido como veio do LLM.
+
+    :param valor: Valor da entidade.
+    :param tipo: Tipo da coluna ("int", "float", "str", "date", "datetime").
+    :return: Valor convertido.
+    """
+    if isinstance(valor, (list, tuple)):
+        return [coagir(v, tipo) for v in valor]
+    if valor is None or isinstance(valor, bool):
+        return valor
+    if tipo in CONVERSORES:
+        try:
+            return CONVERSORES[tipo](valor)
+        except (TypeError, ValueError):
+            return valor
+    if isinstance(valor, str):
+        texto = valor.strip()
+        if _INTEIRO.fullmatch(texto):
+            return int(texto)
+        if _DECIMAL.fullmatch(texto):
+            return float(texto)
+    return valor
+
+#------------------------------------------------- 3.0 Parametrização --------------------------------------------------
+
+# Literais entre aspas simples (com '' escapado) e identificadores entre colchetes
+_LITERAIS = re.compile(r"('(?:[^']|'')*'|\[[^\]]*\])")
+
+
+def _coluna_comparada(query: str, nome: str, tipos: dict, marcador: str = "@"):
+    """Identifica a coluna comparada com o placeholder (e.g., `regiao = @zona`)."""
+    padrao = rf"\[?(\w+)\]?\s*(?:=|<>|!=|<=|>=|<|>|\bLIKE|\bIN|\bBETWEEN)\s*\(?\s*{marcador}{nome}\b"
+    for coluna in re.findall(padrao, query, re.IGNORECASE):
+        if coluna in tipos:
+            return coluna
+    return None
+
+
+def _tipo_parametro(query: str, nome: str, tipos: dict, marcador: str = "@"):
+    """Tipo do placeholder: o da entidade, o da coluna comparada ou int para a quantidade de um TOP."""
+    if re.search(rf"\bTOP\s*\(\s*{marcador}{nome}\b", query, re.IGNORECASE):
+        return "int"
+    return tipos.get(nome) or tipos.get(_coluna_comparada(query, nome, tipos, marcador))
+
+
+def parametrizar(query: str, entidades: dict, tipos: dict = None) -> tuple:
+    """
+    Converte os placeholders @nome da query gerada em parâmetros vinculados (:nome).
+
+    O texto da query deixa de depender dos valores, de modo que perguntas com a mesma forma
+    reutilizam o mesmo plano de execução no servidor. Os valores são convertidos para o tipo
+    da coluna correspondente; listas viram parâmetros expandidos de IN.
+
+    :param query: Query SQL com placeholders (e.g., @ano).
+    :param entidades: Dicionário com os valores das entidades.
+    :param tipos: Tipos das colunas ({coluna: tipo}), ver `tipos_colunas`.
+    :return: Tupla (template, params) para `preparar` / `connection.execute`.
+    """
+    tipos = tipos or {}
+    params = {}
+    # O SQL Server só aceita parâmetro no TOP entre parênteses: "TOP @n" passa a "TOP (@n)"
+    query = re.sub(r"\bTOP\s+@(\w+)", r"TOP (@\1)", query, flags=re.IGNORECASE)
+    partes = _LITERAIS.split(query)
+
+    def substituir(match):
+        nome = match.group(1)
+        if nome not in entidades:
+            return match.group(0)
+        if nome not in params:
+            params[nome] = coagir(entidades[nome], _tipo_parametro(query, nome, tipos))
+        return f":{nome}"
+
+    for i, parte in enumerate(partes):
+        # Dois-pontos fora dos placeholders (e.g., '10:30') não podem ser lidos como parâmetros
+        parte = parte.replace(":", r"\:")
+        if i % 2 == 0:
+            parte = re.sub(r"(?<![@\w])@(\w+)", substituir, parte)
+        partes[i] = parte
+
+    template = "".join(partes)
+    # Listas usam parâmetro expandido: "IN (@regioes)" passa a "IN :regioes"
+    for nome, valor in params.items():
+        if isinstance(valor, list):
+            template = re.sub(rf"\(\s*:{nome}\s*\)", f":{nome}", template)
+    return template.strip(), params
+
+
+def parametros_template(template: str) -> set:
+    """
+    Lista os parâmetros :nome de um template, ignorando literais e dois-pontos escapados.
+
+    :param template: Query com parâmetros :nome.
+    :return: Conjunto com os nomes dos parâmetros.
+    """
+    partes = _LITERAIS.split(template)
+    return {nome for parte in partes[::2] for nome in re.findall(r"(?<![\\\w:]):(\w+)", parte)}
+
+
+def instanciar(template: str, entidades: dict, tipos: dict = None) -> tuple:
+    """
+    Preenche um template já parametrizado com os valores de novas entidades.
+
+    :param template: Query com parâmetros :nome (saída de `parametrizar`).
+    :param entidades: Dicionário com os valores das entidades.
+    :param tipos: Tipos das colunas ({coluna: tipo}).
+    :return: Tupla (template, params), ou None se faltar valor para algum parâmetro.
+    """
+    tipos = tipos or {}
+    params = {}
+    for nome in parametros_template(template):
+        if nome not in entidades:
+            return None
+        params[nome] = coagir(entidades[nome], _tipo_parametro(template, nome, tipos, marcador=":"))
+    return template, params
+
+#----------------------------------------------- 4.0 Cache de Statements -----------------------------------------------
+
+# Quantidade de templates compilados mantidos em memória
+STATEMENT_CACHE = int(os.getenv("SQL_STATEMENT_CACHE", "256"))
+
+
+@lru_cache(maxsize=STATEMENT_CACHE)
+def _preparar(template: str, expandidos: tuple):
+    # O SQLAlchemy só é importado na primeira query preparada
+    from sqlalchemy import bindparam, text
+
+    return text(template).bindparams(*(bindparam(nome, expanding=True) for nome in expandidos))
+
+
+def preparar(template: str, params: dict = None):
+    """
+    Retorna o statement preparado de um template, reutilizando-o entre execuções.
+
+    O mesmo objeto é devolvido para o mesmo template, o que evita refazer o parse do texto e
+    mantém a chave do cache de compilação do SQLAlchemy estável.
+
+    :param template: Query com parâmetros :nome.
+    :param params: Valores dos parâmetros (usados para identificar as listas expandidas).
+    :return: TextClause do SQLAlchemy.
+    """
+    expandidos = tuple(sorted(k for k, v in (params or {}).items() if isinstance(v, list)))
+    return _preparar(template, expandidos)
+
+
+def estatisticas_statements() -> dict:
+    """
+    Retorna os contadores do cache de statements preparados.
+
+    :return: Dicionário com hits, misses, taxa de acerto e número de entradas.
+    """
+    info = _preparar.cache_info()
+    total = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "taxa_acerto": info.hits / total if total else 0.0,
+        "entradas": info.currsize,
+    }
+
+#-------------------------------------------------- 5.0 Renderização ---------------------------------------------------
+
+def literal_sql(valor) -> str:
+    """
+    Representa um valor como literal T-SQL, escapando aspas simples.
+
+    :param valor: Valor do parâmetro.
+    :return: Literal SQL.
+    """
+    if valor is None:
+        return "NULL"
+    if isinstance(valor, bool):
+        return "1" if valor else "0"
+    if isinstance(valor, (int, float)):
+        return repr(valor)
+    if isinstance(valor, (list, tuple)):
+        return "(" + ", ".join(literal_sql(v) for v in valor) + ")"
+    if isinstance(valor, (date, datetime)):
+        valor = valor.isoformat()
+    return "'" + str(valor).replace("'", "''") + "'"
+
+
+def renderizar(template: str, params: dict) -> str:
+    """
+    Gera o texto SQL com os valores embutidos, para exibição e registro.
+
+    A execução deve usar o template e os parâmetros; este texto serve apenas para leitura.
+
+    :param template: Query com parâmetros :nome.
+    :param params: Valores dos parâmetros.
+    :return: Query SQL com literais.
+    """
+    partes = _LITERAIS.split(template)
+    for i in range(0, len(partes), 2):
+        partes[i] = re.sub(
+            r"(?<![\\\w]):(\w+)",
+            lambda m: literal_sql(params[m.group(1)]) if m.group(1) in params else m.group(0),
+            partes[i],
+        )
+    return "".join(partes).replace(r"\:", ":")
@@ -0,0 +1,231 @@
+#---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+from llm_cache import hash_dicionario
+from schema_retrieval import tokenizar
+from sql_params import instanciar, tipos_colunas
+
+#--------------------------------------------------- 2.0 Assinatura ----------------------------------------------------
+
+def assinatura(intent_data: dict, data_dictionary: dict) -> str:
+    """
+    Gera a assinatura canônica de uma intenção: categoria, chaves das entidades e ação.
+
+    A categoria é o texto da intenção tokenizado, sem os valores das entidades, de modo que
+    "contar acidentes em 2019" e "contar acidentes em 2021" compartilham a assinatura.
+    Entidades com lista de valores são marcadas, pois geram um IN expandido no template.
+
+    :param intent_data: Dicionário contendo a intenção, entidades e ação.
+    :param data_dictionary: Dicionário de dados (alterações no schema geram novas assinaturas).
+    :return: Assinatura em texto.
+    """
+    entidades = intent_data.get("entidades", {})
+    valores = set()
+    for valor in entidades.values():
+        for item in valor if isinstance(valor, list) else [valor]:
+            valores.update(tokenizar(str(item)))
+
+    categoria = sorted(set(tokenizar(str(intent_data.get("intencao", "")))) - valores)
+    chaves = sorted(f"{k}[]" if isinstance(v, list) else k for k, v in entidades.items())
+    acao = str(intent_data.get("acao", "")).upper()
+    return json.dumps([" ".join(categoria), chaves, acao, hash_dicionario(data_dictionary)], ensure_ascii=False)
+
+#-------------------------------------------- 3.0 Repositório de Templates ---------------------------------------------
+
+class RepositorioTemplates:
+    """
+    Biblioteca de templates SQL aprendidos a partir das queries executadas com sucesso.
+
+    Cada assinatura de intenção guarda um template parametrizado e seus contadores. O template
+    só é servido depois de `min_sucessos` execuções bem-sucedidas e enquanto a taxa de sucesso
+    estiver acima de `confianca_minima`; `max_falhas` falhas seguidas o removem.
+    """
+
+    def __init__(self, caminho: str = None, capacidade: int = 500, min_sucessos: int = 2,
+                 confianca_minima: float = 0.9, max_falhas: int = 3, salvar_a_cada: int = 20):
+        self.caminho = caminho
+        self.capacidade = capacidade
+        self.min_sucessos = min_sucessos
+        self.confianca_minima = confianca_minima
+        self.max_falhas = max_falhas
+        self.salvar_a_cada = salvar_a_cada
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+        self._alteracoes = 0
+        self.hits = 0
+        self.misses = 0
+        self.removidos = 0
+        if caminho and os.path.exists(caminho):
+            self.carregar()
+
+    def __len__(self):
+        return len(self._templates)
+
+    @staticmethod
+    def _confianca(item: dict) -> float:
+        total = item["sucessos"] + item["falhas"]
+        return item["sucessos"] / total if total else 0.0
+
+    def _confiavel(self, item: dict) -> bool:
+        return item["sucessos"] >= self.min_sucessos and self._confianca(item) >= self.confianca_minima
+
+    def buscar(self, intent_data: dict, data_dictionary: dict):
+        """
+        Instancia o template conhecido para a intenção com os valores das novas entidades.
+
+        :param intent_data: Dicionário contendo a intenção, entidades e ação.
+        :param data_dictionary: Dicionário de dados da base de dados.
+        :return: Tupla (template, params) ou None se não houver template confiável.
+        """
+        chave = assinatura(intent_data, data_dictionary)
+        with self._lock:
+            item = self._templates.get(chave)
+            confiavel = item is not None and self._confiavel(item)
+            if confiavel:
+                self._templates.move_to_end(chave)
+
+        instanciado = instanciar(item["template"], intent_data.get("entidades", {}),
+                                 tipos_colunas(data_dictionary)) if confiavel else None
+        with self._lock:
+            if instanciado is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                item["usos"] += 1
+                item["ultimo_uso"] = time.time()
+        return instanciado
+
+    def registrar(self, intent_data: dict, data_dictionary: dict, template: str, params: dict, sucesso: bool):
+        """
+        Registra o resultado da execução de uma query parametrizada.
+
+        Só são aprendidos templates em que todas as entidades viraram parâmetros; caso contrário o
+        texto da query depende dos valores e não pode ser reaproveitado.
+
+        :param intent_data: Dicionário contendo a intenção, entidades e ação.
+        :param data_dictionary: Dicionário de dados da base de dados.
+        :param template: Query parametrizada executada.
+        :param params: Parâmetros utilizados na execução.
+        :param sucesso: Indica se a execução terminou sem erro.
+        """
+        entidades = intent_data.get("entidades", {})
+        if not template or set(params) != set(entidades):
+            return
+        chave = assinatura(intent_data, data_dictionary)
+
+        with self._lock:
+            item = self._templates.get(chave)
+            if item is not None and item["template"] != template:
+                # Outro template para a mesma assinatura só substitui um que ainda não é confiável
+                if not sucesso or self._confiavel(item):
+                    return
+                item = None
+            if item is None:
+                if not sucesso:
+                    return
+                item = {"template": template, "sucessos": 0, "falhas": 0, "falhas_seguidas": 0,
+                        "usos": 0, "criado": time.time(), "ultimo_uso": None}
+                self._templates[chave] = item
+
+            if sucesso:
+                item["sucessos"] += 1
+                item["falhas_seguidas"] = 0
+            else:
+                item["falhas"] += 1
+                item["falhas_seguidas"] += 1
+                if item["falhas_seguidas"] >= self.max_falhas:
+                    del self._templates[chave]
+                    self.removidos += 1
+
+            if chave in self._templates:
+                self._templates.move_to_end(chave)
+            while len(self._templates) > self.capacidade:
+                self._templates.popitem(last=False)
+                self.removidos += 1
+            self._alteracoes += 1
+            salvar = self.caminho and self._alteracoes >= self.salvar_a_cada
+
+        if salvar:
+            self.salvar()
+
+    def listar(self) -> list:
+        """
+        Retorna os templates conhecidos com seus contadores.
+
+        :return: Lista de dicionários com assinatura, template, sucessos, falhas, usos e confiança.
+        """
+        with self._lock:
+            return [
+                {"assinatura": chave, **item, "confianca": self._confianca(item), "ativo": self._confiavel(item)}
+                for chave, item in self._templates.items()
+            ]
+
+    def estatisticas(self) -> dict:
+        """
+        Retorna os contadores da biblioteca de templates.
+
+        :return: Dicionário com hits, misses, taxa de acerto, templates, ativos e removidos.
+        """
+        total = self.hits + self.misses
+        with self._lock:
+            ativos = sum(self._confiavel(item) for item in self._templates.values())
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "taxa_acerto": self.hits / total if total else 0.0,
+            "templates": len(self._templates),
+            "ativos": ativos,
+            "removidos": self.removidos,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+
+    def salvar(self):
+        """Grava os templates em JSON de forma atômica (arquivo temporário + rename)."""
+        if not self.caminho:
+            return
+        with self._lock:
+            dados = dict(self._templates)
+            self._alteracoes = 0
+            temporario = f"{self.caminho}.tmp"
+            with open(temporario, "w", encoding="utf-8") as f:
+                json.dump(dados, f, ensure_ascii=False, indent=2)
+            os.replace(temporario, self.caminho)
+
+    def carregar(self):
+        """Carrega os templates gravados por `salvar`."""
+        with open(self.caminho, encoding="utf-8") as f:
+            dados = json.load(f)
+        with self._lock:
+            self._templates = OrderedDict(dados)
+
+#----------------------------------------------------- 4.0 Fábrica -----------------------------------------------------
+
+def criar_repositorio_templates():
+    """
+    Cria a biblioteca de templates SQL a partir das variáveis de ambiente.
+
+    - SQL_TEMPLATES: "true" (padrão) ou "false" para desativar.
+    - SQL_TEMPLATES_PATH: arquivo JSON de persistência (padrão: apenas em memória).
+    - SQL_TEMPLATES_MIN_SUCESSOS: execuções bem-sucedidas antes de servir o template (padrão 2).
+    - SQL_TEMPLATES_CONFIANCA: taxa de sucesso mínima para servir o template (padrão 0.9).
+    - SQL_TEMPLATES_MAX_FALHAS: falhas seguidas que removem o template (padrão 3).
+    - SQL_TEMPLATES_CAPACIDADE: número máximo de templates.
+
+    :return: Instância do repositório ou None se desativado.
+    """
+    if os.getenv("SQL_TEMPLATES", "true").lower() != "true":
+        return None
+    return RepositorioTemplates(
+        caminho=os.getenv("SQL_TEMPLATES_PATH"),
+        capacidade=int(os.getenv("SQL_TEMPLATES_CAPACIDADE", "500")),
+        min_sucessos=int(os.getenv("SQL_TEMPLATES_MIN_SUCESSOS", "2")),
+        confianca_minima=float(os.getenv("SQL_TEMPLATES_CONFIANCA", "0.9")),
+        max_falhas=int(os.getenv("SQL_TEMPLATES_MAX_FALHAS", "3")),
+    )
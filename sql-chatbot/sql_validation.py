@@ -0,0 +1,270 @@
+#---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+import os
+import re
+import logging
+import threading
+from functools import lru_cache
+
+from sqlalchemy import text
+
+from result_cache import tabelas_referenciadas
+from sql_params import preparar, renderizar
+
+# Dependência opcional: com o sqlglot a sintaxe é verificada por um parser T-SQL completo
+try:
+    import sqlglot
+    from sqlglot.errors import ParseError
+except ImportError:
+    sqlglot = None
+
+logger = logging.getLogger(__name__)
+
+#------------------------------------------------ 2.0 Verificações Locais ----------------------------------------------
+
+# Literais (N'...'), identificadores entre colchetes e entre aspas duplas
+_LITERAIS = re.compile(r"(?<!\w)N?'(?:[^']|'')*'|\[[^\]]*\]|\"(?:[^\"]|\"\")*\"")
+
+# Somente consultas: qualquer uma destas palavras invalida o candidato
+_PROIBIDAS = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|MERGE|DROP|ALTER|CREATE|TRUNCATE|EXEC|EXECUTE|INTO|GRANT|REVOKE|DECLARE|"
+    r"OPENROWSET|OPENQUERY|SHUTDOWN|BACKUP|RESTORE)\b",
+    re.IGNORECASE,
+)
+
+# Palavras reservadas, tipos, partes de data e funções sem parênteses que não são colunas
+PALAVRAS_SQL = {
+    "select", "distinct", "all", "top", "percent", "with", "ties", "from", "where", "and", "or", "not", "in",
+    "is", "null", "like", "escape", "between", "exists", "any", "some", "as", "on", "join", "inner", "left",
+    "right", "full", "outer", "cross", "apply", "group", "by", "having", "order", "asc", "desc", "offset",
+    "fetch", "first", "next", "row", "rows", "only", "limit", "union", "except", "intersect", "case", "when", "then",
+    "else", "end", "over", "partition", "range", "unbounded", "preceding", "following", "current", "collate",
+    "nolock", "readuncommitted", "option", "recompile", "dbo", "true", "false",
+    # Tipos de CAST/CONVERT
+    "int", "integer", "bigint", "smallint", "tinyint", "bit", "float", "real", "decimal", "numeric", "money",
+    "char", "varchar", "nchar", "nvarchar", "text", "ntext", "date", "datetime", "datetime2", "smalldatetime",
+    "time", "max",
+    # Partes de data de DATEPART/DATEADD/DATEDIFF/DATENAME
+    "year", "yy", "yyyy", "quarter", "qq", "q", "month", "mm", "m", "dayofyear", "dy", "y", "day", "dd", "d",
+    "week", "wk", "ww", "weekday", "dw", "w", "hour", "hh", "minute", "mi", "n", "second", "ss", "s",
+    "millisecond", "ms",
+    "current_timestamp", "current_date",
+}
+
+_PREFIXO = re.compile(r"^\s*(?:WITH\s+\w+(?:\s*\([^)]*\))?\s+AS\s*\(|\(?\s*SELECT\b)", re.IGNORECASE)
+
+
+def _mascarar(query: str) -> tuple:
+    """Substitui literais por espaços e devolve (sql mascarado, identificadores entre colchetes/aspas)."""
+    entre_colchetes = []
+
+    def mascarar(m):
+        token = m.group(0)
+        if token[0] in "[\"":
+            entre_colchetes.append(token[1:-1].replace('""', '"'))
+            return " _id_ "
+        return " '' "
+
+    return _LITERAIS.sub(mascarar, query), entre_colchetes
+
+
+def _balanceada(sql: str) -> bool:
+    profundidade = 0
+    for caractere in sql:
+        profundidade += caractere == "("
+        profundidade -= caractere == ")"
+        if profundidade < 0:
+            return False
+    return profundidade == 0
+
+
+@lru_cache(maxsize=1024)
+def erro_sintaxe(query: str) -> str:
+    """
+    Verifica a sintaxe da query sem acessar o banco.
+
+    Com o sqlglot instalado, a query é analisada pelo parser T-SQL; sem ele, apenas a forma geral
+    (SELECT/WITH, parênteses e aspas balanceados, um único statement somente leitura).
+
+    :param query: Query T-SQL, com parâmetros :nome.
+    :return: Descrição do erro ou "" se a sintaxe é válida.
+    """
+    if query.count("'") % 2:
+        return "aspas simples não balanceadas"
+    sql, _ = _mascarar(query)
+    sql = sql.strip().rstrip(";")
+    if not _PREFIXO.match(sql):
+        return "a query não começa com SELECT ou WITH"
+    if ";" in sql:
+        return "mais de um statement"
+    if (proibida := _PROIBIDAS.search(sql)) is not None:
+        return f"palavra não permitida: {proibida.group(1).upper()}"
+    if not _balanceada(sql):
+        return "parênteses não balanceados"
+    if "`" in sql:
+        return "bloco de código na resposta"
+
+    if sqlglot is not None:
+        try:
+            # :nome não é T-SQL; @nome é o marcador equivalente para o parser
+            sqlglot.parse_one(re.sub(r"(?<![\w:]):(\w+)", r"@\1", query), read="tsql")
+        except ParseError as e:
+            return f"erro de sintaxe: {str(e).splitlines()[0]}"
+    return ""
+
+
+def _colunas_conhecidas(data_dictionary: dict) -> tuple:
+    """Tabelas e colunas do dicionário de dados, em minúsculas."""
+    tabelas = data_dictionary.get("tables", {})
+    colunas = {coluna.lower() for tabela in tabelas.values() for coluna in tabela.get("columns", {})}
+    return {tabela.lower() for tabela in tabelas}, colunas
+
+
+# Cláusulas que podem seguir o apelido de uma expressão da lista do SELECT
+_FIM_APELIDO = r"(?=\s*(?:,|\)|$|\b(?:FROM|WHERE|GROUP|ORDER|HAVING|UNION|EXCEPT|INTERSECT|INTO)\b))"
+
+
+def _apelidos_sem_as(query: str) -> set:
+    """
+    Apelidos escritos sem AS: `COUNT(*) total`, `regiao r`, `CASE ... END faixa` e `(SELECT ...) t`.
+
+    Um identificador é apelido se vier logo depois de `)`, de um literal, de END ou de outro
+    identificador que não seja palavra reservada (no SELECT, seguido de vírgula ou de cláusula).
+    """
+    # Apelidos entre colchetes contam como os demais
+    sql, _ = _mascarar(re.sub(r"\[(\w+)\]", r"\1", query))
+    apelidos = set(re.findall(r"\)\s*(\w+)", sql))
+    for anterior, nome in re.findall(r"(''|\w+)\s+(\w+)" + _FIM_APELIDO, sql, re.IGNORECASE):
+        # Números ficam de fora: em TOP 10 coluna, o nome depois do número é uma coluna
+        if anterior.lower() == "end" or (anterior.lower() not in PALAVRAS_SQL and not anterior[0].isdigit()):
+            apelidos.add(nome)
+    return {nome.lower() for nome in apelidos if not nome[0].isdigit()} - PALAVRAS_SQL
+
+
+def erro_colunas(query: str, data_dictionary: dict) -> str:
+    """
+    Confere tabelas e colunas da query com o dicionário de dados.
+
+    Apelidos (com ou sem AS), CTEs e apelidos de tabela são aceitos; funções são reconhecidas pelo parêntese
+    seguinte. A verificação é conservadora: só rejeita identificadores que não podem ser nenhum deles.
+
+    :param query: Query T-SQL, com parâmetros :nome.
+    :param data_dictionary: Dicionário de dados da base de dados.
+    :return: Descrição do erro ou "" se todos os nomes existem.
+    """
+    tabelas, colunas = _colunas_conhecidas(data_dictionary)
+    sql, entre_colchetes = _mascarar(query)
+    # Parâmetros e variáveis não são identificadores
+    sql = re.sub(r"(?<![\w:]):\w+|@@?\w+", " ", sql)
+
+    ctes = {nome.lower() for nome in re.findall(r"(\w+)\s*(?:\([^)]*\))?\s+AS\s*\(", sql, re.IGNORECASE)}
+    desconhecidas = tabelas_referenciadas(query) - tabelas - ctes
+    if desconhecidas:
+        return f"tabela fora do dicionário de dados: {', '.join(sorted(desconhecidas))}"
+
+    apelidos = {nome.lower() for nome in re.findall(r"\bAS\s+(\w+)", sql, re.IGNORECASE)}
+    apelidos |= {
+        nome.lower()
+        for nome in re.findall(r"\b(?:FROM|JOIN)\s+[\w.]+\s+(?:AS\s+)?(\w+)", sql, re.IGNORECASE)
+    }
+    apelidos |= _apelidos_sem_as(query)
+    aceitos = colunas | tabelas | ctes | apelidos | PALAVRAS_SQL
+
+    nomes = [nome for nome in entre_colchetes if nome.lower() not in aceitos]
+    for m in re.finditer(r"\b([A-Za-z_]\w*)\b(?!\s*\()", sql):
+        nome = m.group(1)
+        # "_id_" marca os identificadores entre colchetes, verificados acima
+        if nome != "_id_" and nome.lower() not in aceitos:
+            nomes.append(nome)
+    if nomes:
+        return f"coluna fora do dicionário de dados: {', '.join(sorted(set(nomes)))}"
+    return ""
+
+#------------------------------------------------ 3.0 Validador de Queries ---------------------------------------------
+
+class ValidadorSQL:
+    """
+    Valida queries geradas pelo LLM antes da execução, da verificação mais barata à mais cara.
+
+    1. sintaxe, sem acessar o banco;
+    2. tabelas e colunas contra o dicionário de dados;
+    3. compilação no servidor sem executar a query: `sp_describe_first_result_set` no SQL Server e
+       `EXPLAIN` nos demais dialetos. Custa uma ida ao banco, mas nenhuma linha é lida.
+
+    :param data_dictionary: Dicionário de dados da base de dados.
+    :param engine: Engine do SQLAlchemy; None desativa a verificação no servidor.
+    """
+
+    def __init__(self, data_dictionary: dict, engine=None):
+        self.data_dictionary = data_dictionary
+        self.engine = engine
+        self._lock = threading.Lock()
+        self.validadas = 0
+        self.rejeitadas = {"sintaxe": 0, "colunas": 0, "servidor": 0}
+
+    def erro_local(self, query: str) -> str:
+        """Verificações que não acessam o banco (sintaxe e colunas)."""
+        motivo = erro_sintaxe(query)
+        if motivo:
+            self._contar("sintaxe")
+            return motivo
+        motivo = erro_colunas(query, self.data_dictionary)
+        if motivo:
+            self._contar("colunas")
+        return motivo
+
+    def erro_servidor(self, query: str, params: dict = None) -> str:
+        """Compila a query no servidor, sem executá-la."""
+        if self.engine is None:
+            return ""
+        try:
+            with self.engine.connect() as connection:
+                if self.engine.dialect.name == "mssql":
+                    # Descreve o resultado a partir do plano compilado; a query não é executada
+                    connection.execute(
+                        text("EXEC sp_describe_first_result_set @tsql = :tsql"),
+                        {"tsql": renderizar(query, params or {})},
+                    ).fetchall()
+                else:
+                    connection.execute(preparar(f"EXPLAIN {query}", params), params or {}).fetchall()
+        except Exception as e:
+            self._contar("servidor")
+            return f"erro no servidor: {str(e).splitlines()[0]}"
+        return ""
+
+    def validar(self, query: str, params: dict = None) -> str:
+        """
+        Executa todas as verificações, parando na primeira que falhar.
+
+        :param query: Query T-SQL, com parâmetros :nome.
+        :param params: Valores dos parâmetros vinculados.
+        :return: Motivo da rejeição ou "" se a query é válida.
+        """
+        motivo = self.erro_local(query) or self.erro_servidor(query, params)
+        if not motivo:
+            with self._lock:
+                self.validadas += 1
+        return motivo
+
+    def _contar(self, etapa: str):
+        with self._lock:
+            self.rejeitadas[etapa] += 1
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {
+                "validadas": self.validadas,
+                "rejeitadas": dict(self.rejeitadas),
+                "parser": "sqlglot" if sqlglot is not None else "basico",
+                "servidor": self.engine is not None,
+            }
+
+
+def criar_validador(data_dictionary: dict, engine=None) -> ValidadorSQL:
+    """
+    Cria o validador a partir das variáveis de ambiente.
+
+    SQL_VALIDAR_SERVIDOR (padrão true) ativa a compilação no servidor.
+    """
+    if os.getenv("SQL_VALIDAR_SERVIDOR", "true").lower() != "true":
+        engine = None
+    return ValidadorSQL(data_dictionary, engine)
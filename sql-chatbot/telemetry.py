@@ -0,0 +1,286 @@
+#---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+import os
+import json
+import time
+import bisect
+import secrets
+import threading
+import contextvars
+import urllib.request
+from collections import defaultdict, deque
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#------------------------------------------------------ 2.0 Spans ------------------------------------------------------
+
+# Span ativo no contexto atual (thread ou task asyncio), usado para encadear pais e filhos
+_span_atual = contextvars.ContextVar("span_atual", default=None)
+
+
+class _SpanNulo:
+    """Span sem efeito, devolvido quando a telemetria está desativada."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **atributos):
+        pass
+
+
+SPAN_NULO = _SpanNulo()
+
+
+class Span:
+    """Intervalo de tempo de uma etapa do pipeline, com atributos e relação pai/filho."""
+
+    __slots__ = ("coletor", "nome", "atributos", "trace_id", "span_id", "parent_id",
+                 "inicio_ns", "fim_ns", "erro", "_token", "_inicio")
+
+    def __init__(self, coletor, nome: str, atributos: dict):
+        self.coletor = coletor
+        self.nome = nome
+        self.atributos = atributos
+        self.erro = None
+
+    def set(self, **atributos):
+        self.atributos.update(atributos)
+
+    def __enter__(self):
+        pai = _span_atual.get()
+        self.trace_id = pai.trace_id if pai is not None else secrets.token_hex(16)
+        self.parent_id = pai.span_id if pai is not None else None
+        self.span_id = secrets.token_hex(8)
+        self._token = _span_atual.set(self)
+        self.inicio_ns = time.time_ns()
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, valor, tb):
+        duracao = time.perf_counter() - self._inicio
+        self.fim_ns = self.inicio_ns + int(duracao * 1e9)
+        _span_atual.reset(self._token)
+        if valor is not None:
+            self.erro = f"{tipo.__name__}: {valor}"
+        self.coletor.registrar(self, duracao)
+        return False
+
+#----------------------------------------------------- 3.0 Coletor -----------------------------------------------------
+
+# Limites dos buckets do histograma de duração, em segundos
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Telemetria:
+    """
+    Coleta os spans do pipeline e os agrega em métricas.
+
+    Desativada, `span()` devolve sempre o mesmo objeto nulo e nada é medido ou armazenado.
+    """
+
+    def __init__(self, ativa: bool = False, servico: str = "sql-chatbot", max_spans: int = 10_000):
+        self.ativa = ativa
+        self.servico = servico
+        self._lock = threading.Lock()
+        self._spans = deque(maxlen=max_spans)
+        self._histogramas = defaultdict(lambda: [0] * (len(BUCKETS) + 1))
+        self._somas = defaultdict(float)
+        self._contadores = defaultdict(float)
+
+    def span(self, nome: str, **atributos):
+        """
+        Abre um span para uma etapa do pipeline (use com `with`).
+
+        :param nome: Nome da etapa.
+        :param atributos: Atributos iniciais (tokens, cache_hit, linhas, ...).
+        :return: Span, ou o span nulo quando a telemetria está desativada.
+        """
+        if not self.ativa:
+            return SPAN_NULO
+        return Span(self, nome, atributos)
+
+    def registrar(self, span: Span, duracao: float):
+        atributos = span.atributos
+        with self._lock:
+            self._spans.append(span)
+            self._histogramas[span.nome][bisect.bisect_left(BUCKETS, duracao)] += 1
+            self._somas[span.nome] += duracao
+            if span.erro is not None or atributos.get("erro"):
+                self._contadores[("erros", span.nome, "")] += 1
+            if "cache_hit" in atributos:
+                resultado = "hit" if atributos["cache_hit"] else "miss"
+                self._contadores[("cache", span.nome, resultado)] += 1
+            for tipo in ("prompt", "completion", "prompt_cache", "prompt_estimado", "cacheaveis"):
+                tokens = atributos.get(f"tokens_{tipo}")
+                if tokens:
+                    self._contadores[("tokens", span.nome, tipo)] += tokens
+            if atributos.get("linhas") is not None:
+                self._contadores[("linhas", span.nome, "")] += atributos["linhas"]
+
+    def limpar(self):
+        with self._lock:
+            self._spans.clear()
+            self._histogramas.clear()
+            self._somas.clear()
+            self._contadores.clear()
+
+    def exportar_prometheus(self) -> str:
+        """
+        Exporta as métricas no formato texto do Prometheus.
+
+        :return: Texto com o histograma de duração por etapa e os contadores de tokens, cache, linhas e erros.
+        """
+        linhas = [
+            "# HELP sqlchatbot_etapa_duracao_segundos Duração das etapas do pipeline.",
+            "# TYPE sqlchatbot_etapa_duracao_segundos histogram",
+        ]
+        with self._lock:
+            for etapa, contagens in sorted(self._histogramas.items()):
+                acumulado = 0
+                for limite, contagem in zip(BUCKETS + ("+Inf",), contagens):
+                    acumulado += contagem
+                    linhas.append(f'sqlchatbot_etapa_duracao_segundos_bucket{{etapa="{etapa}",le="{limite}"}} {acumulado}')
+                linhas.append(f'sqlchatbot_etapa_duracao_segundos_sum{{etapa="{etapa}"}} {self._somas[etapa]}')
+                linhas.append(f'sqlchatbot_etapa_duracao_segundos_count{{etapa="{etapa}"}} {acumulado}')
+
+            metricas = {
+                "tokens": ("sqlchatbot_tokens_total", "Tokens consumidos por etapa.", "tipo"),
+                "cache": ("sqlchatbot_cache_total", "Consultas ao cache por etapa.", "resultado"),
+                "linhas": ("sqlchatbot_linhas_total", "Linhas retornadas por etapa.", None),
+                "erros": ("sqlchatbot_erros_total", "Erros por etapa.", None),
+            }
+            for chave, (nome, ajuda, rotulo) in metricas.items():
+                valores = sorted((k, v) for k, v in self._contadores.items() if k[0] == chave)
+                if not valores:
+                    continue
+                linhas.append(f"# HELP {nome} {ajuda}")
+                linhas.append(f"# TYPE {nome} counter")
+                for (_, etapa, extra), valor in valores:
+                    rotulos = f'etapa="{etapa}"' + (f',{rotulo}="{extra}"' if rotulo else "")
+                    linhas.append(f"{nome}{{{rotulos}}} {valor:g}")
+        return "\n".join(linhas) + "\n"
+
+    def exportar_traces(self, limpar: bool = True) -> dict:
+        """
+        Exporta os spans finalizados no formato OTLP/JSON do OpenTelemetry.
+
+        :param limpar: Remove os spans exportados do buffer.
+        :return: Payload compatível com o endpoint /v1/traces de um coletor OTLP.
+        """
+        with self._lock:
+            spans = list(self._spans)
+            if limpar:
+                self._spans.clear()
+
+        def valor_otlp(valor):
+            if isinstance(valor, bool):
+                return {"boolValue": valor}
+            if isinstance(valor, int):
+                return {"intValue": str(valor)}
+            if isinstance(valor, float):
+                return {"doubleValue": valor}
+            return {"stringValue": str(valor)}
+
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.servico}}]},
+            "scopeSpans": [{
+                "scope": {"name": "sql-chatbot.telemetry"},
+                "spans": [{
+                    "traceId": s.trace_id,
+                    "spanId": s.span_id,
+                    "parentSpanId": s.parent_id or "",
+                    "name": s.nome,
+                    "kind": 1,
+                    "startTimeUnixNano": str(s.inicio_ns),
+                    "endTimeUnixNano": str(s.fim_ns),
+                    "attributes": [{"key": k, "value": valor_otlp(v)} for k, v in s.atributos.items()],
+                    "status": {"code": 2, "message": s.erro} if s.erro else {"code": 1},
+                } for s in spans],
+            }],
+        }]}
+
+    def enviar_otlp(self, endpoint: str, timeout: float = 5):
+        """
+        Envia os spans finalizados a um coletor OpenTelemetry via OTLP/HTTP (JSON).
+
+        :param endpoint: URL do coletor (e.g., http://localhost:4318/v1/traces).
+        :param timeout: Timeout da requisição em segundos.
+        """
+        corpo = json.dumps(self.exportar_traces()).encode("utf-8")
+        requisicao = urllib.request.Request(endpoint, data=corpo, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(requisicao, timeout=timeout):
+            pass
+
+    def iniciar_servidor_metricas(self, porta: int = 9464) -> ThreadingHTTPServer:
+        """
+        Serve `exportar_prometheus()` em http://0.0.0.0:<porta>/metrics numa thread em segundo plano.
+
+        :param porta: Porta HTTP.
+        :return: Servidor iniciado.
+        """
+        telemetria = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                corpo = telemetria.exportar_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+            def log_message(self, *args):
+                pass
+
+        servidor = ThreadingHTTPServer(("0.0.0.0", porta), Handler)
+        threading.Thread(target=servidor.serve_forever, daemon=True, name="metricas").start()
+        return servidor
+
+#----------------------------------------------- 4.0 Contagem de Tokens ------------------------------------------------
+
+@lru_cache(maxsize=None)
+def _contador_tokens():
+    """Classe do callback de tokens, criada no primeiro uso para adiar o import do LangChain."""
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class ContadorTokens(BaseCallbackHandler):
+        """Callback do LangChain que grava no span o uso de tokens informado pelo modelo."""
+
+        # Executa no próprio contexto da chamada também no caminho assíncrono
+        run_inline = True
+
+        def __init__(self, span):
+            self.span = span
+
+        def on_llm_end(self, response, **kwargs):
+            uso = (response.llm_output or {}).get("token_usage") or {}
+            prompt = uso.get("prompt_tokens", 0)
+            # Tokens do início do prompt reaproveitados do prompt caching do Azure OpenAI
+            em_cache = (uso.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+            self.span.set(
+                tokens_prompt=prompt,
+                tokens_completion=uso.get("completion_tokens", 0),
+                tokens_prompt_cache=em_cache,
+                razao_cache=em_cache / prompt if prompt else 0.0,
+            )
+
+    return ContadorTokens
+
+
+# Instância do processo; TELEMETRIA=true ativa a coleta
+telemetria = Telemetria(ativa=os.getenv("TELEMETRIA", "false").lower() == "true")
+span = telemetria.span
+
+
+def callbacks_llm(span_llm) -> list:
+    """
+    Callbacks a repassar para a chain para registrar os tokens no span da chamada ao LLM.
+
+    :param span_llm: Span da chamada ao LLM.
+    :return: Lista de callbacks, ou None com a telemetria desativada.
+    """
+    return [_contador_tokens()(span_llm)] if telemetria.ativa else None
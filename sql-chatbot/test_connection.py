@@ -1,8 +1,8 @@
 import os
-from sqlalchemy import create_engine
 from sqlalchemy.exc import SQLAlchemyError
 from dotenv import load_dotenv
-import urllib
+
+from db_engine import obter_engine, aquecer_pool, estatisticas_pool
 
 # Carregar variáveis de ambiente
 load_dotenv('.env')
@@ -19,29 +19,15 @@ password = os.getenv(f"AZURE_SQL_PASSWORD_{env_type}")
 if not all([driver, server, database, username, password]):
     raise ValueError("Por favor, defina as variáveis de ambiente AZURE_SQL_SERVER, AZURE_SQL_DATABASE, AZURE_SQL_USERNAME, AZURE_SQL_PASSWORD e DRIVER no arquivo .env")
 
-# Construir a string de conexão ODBC
-odbc_str = (
-    f'DRIVER={{{driver}}};'
-    f'SERVER={server};'
-    f'DATABASE={database};'
-    f'UID={username};'
-    f'PWD={password};'
-    'Encrypt=yes;'
-    'TrustServerCertificate=no;'
-    'Connection Timeout=30;'
-)
-
-# URL-encode a string ODBC
-params = urllib.parse.quote_plus(odbc_str)
-
-# Construir a URL de conexão SQLAlchemy com pyodbc
-connection_string = f'mssql+pyodbc:///?odbc_connect={params}'
-
-# Criar o engine
+# Criar o engine (mesma fábrica usada por backend.py e create_sql_db_azure.py)
 try:
-    engine = create_engine(connection_string)
+    engine = obter_engine(env_type, driver=driver)
     connection = engine.connect()
     print("Conexão bem-sucedida com o Azure SQL Database!")
     connection.close()
+
+    # Aquecer o pool e exibir suas estatísticas
+    aquecer_pool(engine)
+    print("Pool de conexões:", estatisticas_pool(engine))
 except SQLAlchemyError as e:
-    print(f"Erro ao conectar ao banco de dados: {e}")
\ No newline at end of file
+    print(f"Erro ao conectar ao banco de dados: {e}")
@@ -0,0 +1,43 @@
+#---------------------------------------------------- 1.0 Libraries ----------------------------------------------------
+import threading
+from functools import lru_cache
+
+#----------------------------------------------- 2.0 Contagem de Tokens ------------------------------------------------
+
+# Encoding dos modelos gpt-4o; o tiktoken é opcional e carregado sob demanda
+ENCODING_PADRAO = "o200k_base"
+
+_lock = threading.Lock()
+_encoding = None
+_encoding_carregado = False
+
+
+def _obter_encoding():
+    global _encoding, _encoding_carregado
+    if not _encoding_carregado:
+        with _lock:
+            if not _encoding_carregado:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(ENCODING_PADRAO)
+                except Exception:
+                    # Sem tiktoken (ou sem o arquivo BPE em cache) usamos a estimativa por caracteres
+                    _encoding = None
+                _encoding_carregado = True
+    return _encoding
+
+
+@lru_cache(maxsize=4096)
+def contar_tokens(texto: str) -> int:
+    """
+    Conta os tokens de um texto sem chamar a API.
+
+    Usa o tiktoken quando disponível; caso contrário, estima ~4 caracteres por token.
+
+    :param texto: Texto a ser contado.
+    :return: Número de tokens.
+    """
+    encoding = _obter_encoding()
+    if encoding is not None:
+        return len(encoding.encode(texto))
+    return max(1, (len(texto) + 3) // 4) if texto else 0